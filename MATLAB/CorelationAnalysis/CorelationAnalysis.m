@@ -15,6 +15,9 @@
 % Input: 
 % - 'Merged4.xlsx': A table containing data for different categories, products, 
 %   satellites, indices, and other related metrics.
+% - 'Merged4_grids.mat' (optional): The r, rho and n values pivoted by Merge.py
+%   into Satellite x Category x Index x Product grids. When it exists, it is
+%   loaded instead of reading 'Merged4.xlsx'.
 % ----------------------------------------------------------------------------
 % Output: 
 % - Multiple scatter plots: Each plot visualizes data points based on the 
@@ -24,8 +27,13 @@ clc;
 clear all;
 close all;
 
-% Read data from the new Excel file
-T = readtable('Merged4.xlsx');
+% Load the pre-pivoted grids when they exist, otherwise read data from the new Excel file
+useGrids = isfile('Merged4_grids.mat');
+if useGrids
+    G = load('Merged4_grids.mat', 'r', 'rho', 'n', 'satellites', 'products', 'index_labels');
+else
+    T = readtable('Merged4.xlsx');
+end
 
 % Define marker shapes
 mkr = {"^", "v", "<", ">", "^", "v", "<", ">", "^", "v", "<", ">", "^", "v", "<", ">", "^", "v", "<", ">", "^", "v", "<", ">", "^", "v", "<", ">"};
@@ -45,7 +53,11 @@ for j = 1:length(categories)
     category = categories{j};
     
     % Filter data for the current category
-    categoryData = T(strcmp(T.Category, category), :);
+    if useGrids
+        categoryData = gridRows(G, j);
+    else
+        categoryData = T(strcmp(T.Category, category), :);
+    end
     
     % Sub-plot for "r"
     nexttile;
@@ -61,7 +73,11 @@ for j = 1:length(categories)
     category = categories{j};
     
     % Filter data for the current category
-    categoryData = T(strcmp(T.Category, category), :);
+    if useGrids
+        categoryData = gridRows(G, j);
+    else
+        categoryData = T(strcmp(T.Category, category), :);
+    end
     
     % Individual plot for "r"
     f_r = figure('Units', 'centimeters', 'Name', ['r_', char(matlab.lang.makeValidName(category))]);
@@ -108,3 +124,16 @@ function createScatterPlot(data, yVar, mkr)
     set(gca, 'PlotBoxAspectRatio', [2, 1, 1]);
 end
 
+function data = gridRows(G, categoryNumber)
+    % Build the rows of one category from the grids, in the order of Merged4.xlsx
+    % (satellite, then product, then index)
+    [indexNumber, productNumber, satelliteNumber] = ndgrid(1:numel(G.index_labels), 1:numel(G.products), 1:numel(G.satellites));
+    data = table(reshape(G.satellites(satelliteNumber), [], 1), reshape(G.products(productNumber), [], 1), ...
+                 reshape(G.index_labels(indexNumber), [], 1), indexNumber(:), ...
+                 'VariableNames', {'Satellite', 'Product', 'Index', 'Index_Number'});
+    for name = {'r', 'rho', 'n'}
+        % Index x product x satellite values of the category
+        values = permute(G.(name{1})(:, categoryNumber, :, :), [3, 4, 1, 2]);
+        data.(name{1}) = values(:);
+    end
+end
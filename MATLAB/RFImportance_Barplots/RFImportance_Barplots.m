@@ -15,6 +15,9 @@
 % Input: 
 % - 'Merged4.xlsx': An Excel file containing data on the importance scores 
 %   of various indices for different products, categorized by Satellite and Category.
+% - 'Merged4_grids.mat' (optional): The same importance scores pivoted by Merge.py
+%   into Satellite x Category x Index x Product grids. When it exists, it is
+%   loaded instead of reading 'Merged4.xlsx'.
 % ----------------------------------------------------------------------------
 % Output: 
 % - Multiple stacked bar plots: Each bar represents an index, and each 
@@ -25,9 +28,14 @@ clc;
 clear all;
 close all;
 
-% Load the data
+% Load the pre-pivoted grids when they exist, otherwise load the data
 filename = 'Merged4.xlsx'; % The file is in the same folder as the script
-dataTable = readtable(filename);
+useGrids = isfile('Merged4_grids.mat');
+if useGrids
+    G = load('Merged4_grids.mat', 'importance', 'satellites', 'categories');
+else
+    dataTable = readtable(filename);
+end
 
 % Define colors for each product
 colors = containers.Map({'Level1', 'Level2', 'ACOLITE', 'ATCOR', 'C2RCC', 'DOS1', 'FLAASH', 'iCOR', 'Polymer', 'QUAC'}, ...
@@ -40,13 +48,19 @@ orderedIndices = compose("I%d", 1:27);
 orderedProducts = {'Level1', 'Level2', 'ACOLITE', 'ATCOR', 'C2RCC', 'DOS1', 'FLAASH', 'iCOR', 'Polymer', 'QUAC'};
 
 % Find unique Satellite and Category pairs
-[satCat, ~, idx] = unique(dataTable(:, {'Satellite', 'Category'}), 'rows');
+if useGrids
+    % The pairs with any importance score, sorted by name as unique sorts them
+    [satelliteNumbers, categoryNumbers] = find(any(any(~isnan(G.importance), 3), 4));
+    satCat = sortrows(table(reshape(G.satellites(satelliteNumbers), [], 1), reshape(G.categories(categoryNumbers), [], 1), ...
+                            satelliteNumbers, categoryNumbers, ...
+                            'VariableNames', {'Satellite', 'Category', 'SatelliteNumber', 'CategoryNumber'}), ...
+                      {'Satellite', 'Category'});
+else
+    [satCat, ~, idx] = unique(dataTable(:, {'Satellite', 'Category'}), 'rows');
+end
 
 % Iterate over each unique Satellite and Category pair
 for k = 1:height(satCat)
-    % Select rows corresponding to the current Satellite and Category pair
-    subsetTable = dataTable(idx == k, :);
-    
     % Create a new figure
     figure;
     titleString = strcat(satCat.Satellite{k}, ' - ', satCat.Category{k});
@@ -54,21 +68,34 @@ for k = 1:height(satCat)
     title(titleString);
 
 
-    % Find unique Products and Indices for the current Satellite and Category pair
-    products = intersect(orderedProducts, unique(subsetTable.Product), 'stable');
-    indices = unique(subsetTable.Index);
-    
-    % Initialize the data matrix for the stacked bar plot
-    barData = zeros(length(indices), length(products));
-    
-    % Populate the data matrix
-    for p = 1:numel(products)
-        product = products{p};
-        productRows = strcmp(subsetTable.Product, product);
-        for i = 1:numel(indices)
-            index = indices{i};
-            indexRow = strcmp(subsetTable.Index, index);
-            barData(i, p) = sum(subsetTable.ImportanceScore(productRows & indexRow));
+    if useGrids
+        % The grid of the current pair, restricted to the indices and products with a score
+        importanceMatrix = squeeze(G.importance(satCat.SatelliteNumber(k), satCat.CategoryNumber(k), :, :));
+        hasScore = ~isnan(importanceMatrix);
+        products = orderedProducts(any(hasScore, 1));
+        indices = cellstr(orderedIndices(any(hasScore, 2)))';
+        barData = importanceMatrix(any(hasScore, 2), any(hasScore, 1));
+        barData(isnan(barData)) = 0;
+    else
+        % Select rows corresponding to the current Satellite and Category pair
+        subsetTable = dataTable(idx == k, :);
+
+        % Find unique Products and Indices for the current Satellite and Category pair
+        products = intersect(orderedProducts, unique(subsetTable.Product), 'stable');
+        indices = unique(subsetTable.Index);
+
+        % Initialize the data matrix for the stacked bar plot
+        barData = zeros(length(indices), length(products));
+
+        % Populate the data matrix
+        for p = 1:numel(products)
+            product = products{p};
+            productRows = strcmp(subsetTable.Product, product);
+            for i = 1:numel(indices)
+                index = indices{i};
+                indexRow = strcmp(subsetTable.Index, index);
+                barData(i, p) = sum(subsetTable.ImportanceScore(productRows & indexRow));
+            end
         end
     end
     
@@ -16,6 +16,9 @@
 % Input: 
 % - 'Merged4.xlsx': An Excel file containing the R2 values of various 
 %   indices for different products, categorized by Satellite and Category.
+% - 'Merged4_grids.mat' (optional): The same R2 values pivoted by Merge.py into
+%   Satellite x Category x Index x Product grids, with the average row and
+%   column. When it exists, it is loaded instead of reading 'Merged4.xlsx'.
 % ----------------------------------------------------------------------------
 % Output: 
 % - Multiple heatmaps: Each heatmap represents the R2 values of different 
@@ -25,8 +28,13 @@ clc;
 clear all
 close all  % Close all previously open figure windows
 
-% Read the new input file
-T = readtable('Merged4.xlsx');
+% Load the pre-pivoted grids when they exist, otherwise read the new input file
+useGrids = isfile('Merged4_grids.mat');
+if useGrids
+    G = load('Merged4_grids.mat', 'r2');
+else
+    T = readtable('Merged4.xlsx');
+end
 
 % Define the unique values for Category and Satellite
 categories = {'All', 'HH', 'WLO', 'AW', 'SS', 'EH', 'OM'};
@@ -46,22 +54,27 @@ for i = 1:length(categories)
         category = categories{i};
         satellite = satellites{j};
         
-        % Filter the table based on the current category and satellite
-        Table = T(strcmp(T.Category, category) & strcmp(T.Satellite, satellite), :);
+        if useGrids
+            % The grid of the current satellite and category already holds the averages
+            dataMatrix = squeeze(G.r2(j, i, :, :));
+        else
+            % Filter the table based on the current category and satellite
+            Table = T(strcmp(T.Category, category) & strcmp(T.Satellite, satellite), :);
         
-        % Initialize the data matrix for the heatmap
-        dataMatrix = nan(28, numel(products));
+            % Initialize the data matrix for the heatmap
+            dataMatrix = nan(28, numel(products));
         
-        % Fill the data matrix based on the filtered Table
-        for k = 1:height(Table)
-            rowIndex = Table.Index_Number(k);
-            colIndex = find(strcmp(products, Table.Product{k}));
-            dataMatrix(rowIndex, colIndex) = Table.r2(k);
-        end
+            % Fill the data matrix based on the filtered Table
+            for k = 1:height(Table)
+                rowIndex = Table.Index_Number(k);
+                colIndex = find(strcmp(products, Table.Product{k}));
+                dataMatrix(rowIndex, colIndex) = Table.r2(k);
+            end
         
-        % Compute the average for each row and column and fill the last column and last row
-        dataMatrix(1:27, end) = nanmean(dataMatrix(1:27, 1:end-1), 2);
-        dataMatrix(end, 1:end-1) = nanmean(dataMatrix(1:27, 1:end-1), 1);
+            % Compute the average for each row and column and fill the last column and last row
+            dataMatrix(1:27, end) = nanmean(dataMatrix(1:27, 1:end-1), 2);
+            dataMatrix(end, 1:end-1) = nanmean(dataMatrix(1:27, 1:end-1), 1);
+        end
         
         % Create a new figure for each heatmap
         figure;
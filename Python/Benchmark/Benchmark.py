@@ -0,0 +1,237 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Benchmark.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This script measures how the stages of the workflow scale with the size of
+# the data, on synthetic matchup tables (Synthetic.py):
+# - excel_load: reading the Excel input files (pandas.read_excel, no cache).
+# - correlation: the correlation metrics of CorrelationAnalysis.py.
+# - rf_importance: the Random Forest importance of RFImportance.py.
+# - models: the batched regressions and cross-validation of Models.py.
+# - merge: the keyed update of Merged3.xlsx done by Merge.py.
+# For every number of rows, each stage is timed and its peak memory (allocations
+# traced by tracemalloc, in a second run) is recorded in a JSON report.
+# ----------------------------------------------------------------------------
+# Dependencies: os, sys, json, time, platform, argparse, tempfile, tracemalloc,
+#               importlib, numpy, pandas, sklearn, Synthetic
+# ----------------------------------------------------------------------------
+# Output:
+# - A JSON report (Outputs/Benchmark.json by default) with the environment, the
+#   settings and one result per number of rows and stage.
+# ----------------------------------------------------------------------------
+# Notes:
+# - Usage: python Benchmark.py --rows 100 1000 10000 [--files 28] [--stages correlation models]
+#   [--compare OLD_REPORT.json --threshold 1.25]
+# - With --compare, the stages that got slower than threshold times the old report
+#   (for the same number of rows) are listed and the script exits with status 1.
+# - Excel holds at most 1,048,575 data rows per sheet; larger sizes skip excel_load.
+#   Forests are skipped above --rf-max-rows rows, since they grow superlinearly.
+# - The caches of the scripts are disabled, so every stage computes its results.
+# - The forests are grown to a fixed number of trees (--rf-trees, no early stopping)
+#   so that timings are comparable between runs.
+# ----------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import importlib
+import numpy as np
+import pandas as pd
+import sklearn
+
+# Make the scripts and the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Common.MergePipeline import filter_bands
+from Common.Regression import stack_tables
+from Common.ResultStore import ResultStore
+from Common.Schema import index_columns
+from Synthetic import generate_files, merged3_template, write_files
+
+# Specify the default report path
+default_report_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Outputs", "Benchmark.json")
+
+# Define the stages and the largest number of rows of an Excel sheet
+stage_names = ["excel_load", "correlation", "rf_importance", "models", "merge"]
+max_excel_rows = 1048575
+
+# Function to run a function once, returning its result and the elapsed time in seconds
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+# Function to run a function once while tracing allocations, returning the peak of the traced memory in bytes
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Function to import the scripts of the workflow with their caches disabled and fixed-size forests
+def load_scripts(rf_trees):
+    correlation = importlib.import_module("CorrelationAnalysis.CorrelationAnalysis")
+    rf_importance = importlib.import_module("RFImportance.RFImportance")
+    models = importlib.import_module("Models.Models")
+    correlation.reuse_results = False
+    rf_importance.reuse_results = False
+    rf_importance.importance_tolerance = None
+    rf_importance.max_trees = rf_trees
+    models.reuse_results = False
+    return correlation, rf_importance, models
+
+# Function to build the stage functions of one data size (each returns its result so that the next stages can use it)
+def build_stage_functions(tables, directory, scripts, merge_source):
+    correlation, rf_importance, models = scripts
+
+    def excel_load():
+        return [pd.read_excel(os.path.join(directory, name)) for name in tables]
+
+    def correlation_stage():
+        return [correlation.compute_correlations(name, table) for name, table in tables.items()]
+
+    def rf_importance_stage():
+        return [rf_importance.compute_importance(name, table) for name, table in tables.items()]
+
+    def models_stage():
+        first = next(iter(tables.values()))
+        candidates = index_columns(first.columns, 16)
+        responses, predictors = stack_tables([(table.iloc[:, 7].to_numpy(dtype=float), table[candidates].to_numpy(dtype=float))
+                                              for table in tables.values()])
+        return models.fit_group(responses, predictors)
+
+    def merge_stage():
+        # The outputs as Merge.py reads them: without the base column row and with numeric index numbers
+        outputs = [output.iloc[1:].reset_index(drop=True) for output in merge_source()]
+        merged_store = ResultStore.concat(ResultStore.from_frame(output) for output in outputs)
+        return filter_bands(merged_store).update_frame(merged3_template(), ["Satellite", "Category", "Product", "Index", "Index_Number"],
+                                                       ["r", "rho", "r2", "n"], condition=lambda rows: rows["n"] > 10)
+
+    return {
+        "excel_load": excel_load,
+        "correlation": correlation_stage,
+        "rf_importance": rf_importance_stage,
+        "models": models_stage,
+        "merge": merge_stage,
+    }
+
+# Function to benchmark the selected stages for every number of rows and return the results
+def run_benchmark(arguments):
+    scripts = load_scripts(arguments.rf_trees)
+    results = []
+
+    for n_rows in arguments.rows:
+        tables = generate_files(arguments.files, n_rows, arguments.products, arguments.indices, arguments.bands,
+                                arguments.nan_fraction, arguments.seed)
+        n_columns = next(iter(tables.values())).shape[1]
+
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as directory:
+            # The merge stage uses the correlation outputs (computed outside the timed region when needed)
+            correlation_outputs = {}
+
+            def merge_source():
+                if "outputs" not in correlation_outputs:
+                    correlation_outputs["outputs"] = functions["correlation"]()
+                return correlation_outputs["outputs"]
+
+            functions = build_stage_functions(tables, directory, scripts, merge_source)
+            for stage in arguments.stages:
+                result = {"stage": stage, "rows": n_rows, "files": arguments.files, "columns": n_columns}
+
+                # Skip the sizes a stage cannot (Excel) or should not (forests) handle
+                if stage == "excel_load" and n_rows > max_excel_rows:
+                    results.append(dict(result, status="skipped", reason="more rows than an Excel sheet holds"))
+                    continue
+                if stage == "rf_importance" and n_rows > arguments.rf_max_rows:
+                    results.append(dict(result, status="skipped", reason="more rows than --rf-max-rows"))
+                    continue
+                if stage == "excel_load" and not os.listdir(directory):
+                    write_files(tables, directory)
+                if stage == "merge":
+                    merge_source()
+
+                output, seconds = timed(functions[stage])
+                result.update(status="ok", seconds=seconds)
+                if stage == "correlation":
+                    correlation_outputs["outputs"] = output
+                if arguments.memory:
+                    result["peak_memory_bytes"] = peak_memory(functions[stage])
+
+                print(f"{stage}: {n_rows} rows x {arguments.files} files in {seconds:.3f} s"
+                      + (f", peak {result['peak_memory_bytes'] / 1024 ** 2:.1f} MiB" if arguments.memory else ""))
+                results.append(result)
+
+    return results
+
+# Function to list the stages that got slower than threshold times an older report
+def find_regressions(results, old_report_path, threshold):
+    with open(old_report_path) as handle:
+        old_results = json.load(handle)["results"]
+    old_seconds = {(result["stage"], result["rows"], result["files"], result["columns"]): result["seconds"]
+                   for result in old_results if result.get("status") == "ok"}
+
+    regressions = []
+    for result in results:
+        key = (result["stage"], result["rows"], result["files"], result["columns"])
+        if result.get("status") == "ok" and key in old_seconds and result["seconds"] > threshold * old_seconds[key]:
+            regressions.append(dict(result, previous_seconds=old_seconds[key]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the workflow stages on synthetic matchup tables.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000], help="numbers of rows per file")
+    parser.add_argument("--files", type=int, default=28, help="number of files")
+    parser.add_argument("--products", type=int, default=10, help="number of processors (at most 10)")
+    parser.add_argument("--indices", type=int, default=27, help="number of indices per processor")
+    parser.add_argument("--bands", type=int, default=5, help="number of bands per processor")
+    parser.add_argument("--nan-fraction", type=float, default=0.1, help="fraction of missing feature values")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--stages", nargs="+", choices=stage_names, default=stage_names, help="stages to benchmark")
+    parser.add_argument("--rf-trees", type=int, default=100, help="number of trees of each forest")
+    parser.add_argument("--rf-max-rows", type=int, default=100000, help="largest number of rows for which forests are fitted")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="do not trace the peak memory")
+    parser.add_argument("--report", default=default_report_path, help="path of the JSON report")
+    parser.add_argument("--compare", metavar="OLD_REPORT", help="report to compare the timings with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown factor reported as a regression")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments)
+
+    # Save the report with the environment and the settings
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "settings": {key: value for key, value in vars(arguments).items() if key not in ("report", "compare", "threshold")},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(arguments.report)), exist_ok=True)
+    with open(arguments.report, "w") as handle:
+        json.dump(report, handle, indent=1)
+    print(f"Report saved to {arguments.report}.")
+
+    # Report the stages that got slower than the older report
+    if arguments.compare:
+        regressions = find_regressions(results, arguments.compare, arguments.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression['stage']} with {regression['rows']} rows took {regression['seconds']:.3f} s "
+                  f"(previously {regression['previous_seconds']:.3f} s).")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Synthetic.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module generates synthetic matchup tables with the schema of the
+# Satellite x Category input files, for benchmarking:
+# - Columns 0-15 hold the metadata (Study_Area, Season, TSI_Class, ...), with
+#   the in-situ Chl-a (ChlA_Uncorrected_µg_L) at column 7.
+# - The feature columns follow, product by product: "<Product>_B01".. for the
+#   bands and "<Product>_I1".. for the indices. Some indices are related to
+#   log10(Chl-a) so that the correlations and forests have a signal to find.
+# - The number of rows, products, indices and bands, the fraction of missing
+#   feature values and the number of files are configurable.
+# - merged3_template builds the matching Merged3.xlsx template of the merge step.
+# ----------------------------------------------------------------------------
+# Dependencies: os, numpy, pandas
+# ----------------------------------------------------------------------------
+# Notes:
+# - The tables only depend on their arguments (including the seed).
+# ----------------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+
+# Define the processors, satellites, categories and metadata columns of the real data
+products = ["ACOLITE", "ATCOR", "C2RCC", "DOS1", "FLAASH", "iCOR", "Level1", "Level2", "Polymer", "QUAC"]
+satellites = ["Landsat5", "Landsat7", "Landsat8", "Sentinel2"]
+categories = ["All", "HH", "WLO", "AW", "SS", "EH", "OM"]
+metadata_columns = ["Study_Area", "Lat_DD_WGS84", "Long_DD_WGS84", "Sampling_Date", "Season", "Sampling_Depth_Start_m",
+                    "Sampling_Depth_End_m", "ChlA_Uncorrected_µg_L", "ChlA_Corrected_µg_L", "Detection_Limit_µg_L", "Source",
+                    "TSI_Class", "Satellite", "Tile_Name", "Sensing_Date", "Sampling_and_Sensing_Interval"]
+
+# Function to get the feature column names of the given numbers of products, indices and bands
+def feature_names(n_products=10, n_indices=27, n_bands=5):
+    names = []
+    for product in products[:n_products]:
+        names += [f"{product}_B{band:02d}" for band in range(1, n_bands + 1)]
+        names += [f"{product}_I{index}" for index in range(1, n_indices + 1)]
+    return names
+
+# Function to get the file name of the i-th synthetic file (the real Satellite x Category names first)
+def file_name(i):
+    satellite = satellites[i % len(satellites)]
+    category = categories[(i // len(satellites)) % len(categories)]
+    cycle = i // (len(satellites) * len(categories))
+    return f"{satellite}_{category}.xlsx" if cycle == 0 else f"{satellite}_{category}{cycle}.xlsx"
+
+# Function to generate one synthetic matchup table
+def generate_matchups(n_rows, n_products=10, n_indices=27, n_bands=5, nan_fraction=0.1, satellite="Landsat8", seed=0):
+    rng = np.random.default_rng(seed)
+
+    # In-situ Chl-a (log-normal) and the metadata derived from it
+    chla = np.round(10.0 ** rng.normal(0.3, 0.45, n_rows), 2)
+    seasons = rng.choice(["Winter", "Spring", "Summer", "Autumn"], n_rows)
+    tsi = np.select([chla < 2.6, chla < 7.3, chla < 56], ["Oligotrophic", "Mesotrophic", "Eutrophic"], "Hypereutrophic")
+    sampling_dates = pd.Timestamp("2000-01-01") + pd.to_timedelta(rng.integers(0, 8000, n_rows), unit="D")
+    interval = rng.integers(0, 4, n_rows)
+    data = {
+        "Study_Area": rng.choice(["HH", "WLO"], n_rows, p=[0.3, 0.7]),
+        "Lat_DD_WGS84": np.round(rng.uniform(43.2, 43.9, n_rows), 4),
+        "Long_DD_WGS84": np.round(rng.uniform(-79.9, -79.0, n_rows), 4),
+        "Sampling_Date": sampling_dates,
+        "Season": seasons,
+        "Sampling_Depth_Start_m": rng.integers(0, 3, n_rows),
+        "Sampling_Depth_End_m": rng.integers(0, 3, n_rows),
+        "ChlA_Uncorrected_µg_L": chla,
+        "ChlA_Corrected_µg_L": np.where(rng.random(n_rows) < 0.2, np.nan, chla),
+        "Detection_Limit_µg_L": np.full(n_rows, 0.1),
+        "Source": rng.choice(["ECCC_Water_Quality_Monitoring_and_Surveillance_Division", "Great_Lakes_Nearshore"], n_rows),
+        "TSI_Class": tsi,
+        "Satellite": np.full(n_rows, satellite),
+        "Tile_Name": np.full(n_rows, "SYNTHETIC_TILE"),
+        "Sensing_Date": sampling_dates + pd.to_timedelta(interval, unit="D"),
+        "Sampling_and_Sensing_Interval": interval,
+    }
+
+    # Feature columns: a third of the indices follow log10(Chl-a) with noise, the rest are noise
+    names = feature_names(n_products, n_indices, n_bands)
+    signal = rng.random(len(names)) < 1.0 / 3.0
+    slopes = rng.normal(0.0, 1.0, len(names)) * signal
+    features = np.log10(chla)[:, np.newaxis] * slopes + rng.normal(0.0, 0.5, (n_rows, len(names)))
+    features[rng.random(features.shape) < nan_fraction] = np.nan
+
+    table = pd.DataFrame(data, columns=metadata_columns)
+    return pd.concat([table, pd.DataFrame(features, columns=names)], axis=1)
+
+# Function to generate n_files synthetic tables (by file name), each with its own seed
+def generate_files(n_files, n_rows, n_products=10, n_indices=27, n_bands=5, nan_fraction=0.1, seed=0):
+    tables = {}
+    for i in range(n_files):
+        name = file_name(i)
+        tables[name] = generate_matchups(n_rows, n_products, n_indices, n_bands, nan_fraction, satellite=name.split("_")[0], seed=seed + i)
+    return tables
+
+# Function to write synthetic tables to Excel files in a directory
+def write_files(tables, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, table in tables.items():
+        table.to_excel(os.path.join(directory, name), index=False)
+
+# Function to build the Merged3.xlsx template (one row per Satellite, Category, Product and Index) of the merge step
+def merged3_template(n_products=10, n_indices=27):
+    rows = [(satellite, category, product, f"I{index}", index)
+            for satellite in satellites for category in categories
+            for product in products[:n_products] for index in range(1, n_indices + 1)]
+    template = pd.DataFrame(rows, columns=["Satellite", "Category", "Product", "Index", "Index_Number"])
+    for column in ["r", "rho", "r2", "n"]:
+        template[column] = np.nan
+    return template
@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Cache.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module provides an on-disk cache shared by the scripts.
+# - DiskCache stores files under a key in a cache directory and evicts the least
+#   recently used entries once the directory grows beyond a size limit.
+# - read_excel is a drop-in replacement for pandas.read_excel. On the first read
+#   of a workbook it saves the parsed table in a binary columnar format (Parquet
+#   when pyarrow is installed, otherwise a pandas pickle). Later reads load that
+#   file for as long as the content of the workbook is unchanged.
+# - Optionally (memory_cache_bytes > 0, e.g. in the long-lived Worker.py), the
+#   parsed tables are also kept in memory, so that later reads in the same
+#   process skip the disk cache too.
+# ----------------------------------------------------------------------------
+# Dependencies: os, hashlib, tempfile, collections, pandas, pyarrow (optional)
+# ----------------------------------------------------------------------------
+# Notes:
+# - Cache entries are keyed by a SHA-1 hash of the workbook content and the
+#   read_excel arguments, so a modified workbook is never served from an old entry.
+# - The hash of a workbook is remembered per (path, size, modification time), so
+#   unchanged files are only hashed once per process.
+# - The size of the cache directory is scanned once per process and then kept as a
+#   running total; the directory is only scanned again to evict entries once the
+#   total exceeds max_cache_bytes. Entries written by other processes are counted
+#   at the next scan.
+# - Tables kept in memory are returned as copies, so callers can modify them.
+# ----------------------------------------------------------------------------
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+# Specify the cache directory and its maximum size in bytes
+cache_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+max_cache_bytes = 1024 * 1024 * 1024
+
+# Specify the bytes of parsed tables kept in memory by this process (0 keeps none)
+memory_cache_bytes = 0
+
+# Hashes of the files already read by this process, keyed by (path, size, modification time)
+_file_hashes = {}
+
+# Total size in bytes of the entries of each cache directory, scanned once and then kept up to date by this process
+_directory_bytes = {}
+
+# Parsed tables kept in memory by this process with their sizes in bytes (least recently used first), keyed like the disk cache
+_memory_tables = OrderedDict()
+
+class DiskCache:
+    def __init__(self, directory, max_bytes=max_cache_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    # Function to get the path of the file stored under a key
+    def path(self, key, extension=""):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    # Function to get the path of a stored file, or None if there is no such file
+    def get(self, key, extension=""):
+        path = self.path(key, extension)
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    # Function to store a file under a key using write_function(temporary_path)
+    def put(self, key, write_function, extension=""):
+        path = self.path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        total = self.size() - _file_size(path)
+
+        # Write to a temporary file first so that other processes never see a partial entry
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(handle)
+        try:
+            write_function(temporary_path)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+        # Only scan the directory for the least recently used entries once the running total exceeds the limit
+        _directory_bytes[self.directory] = total + _file_size(path)
+        if _directory_bytes[self.directory] > self.max_bytes:
+            self.evict()
+        return path
+
+    # Function to list the entries as (modification time, size, path)
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+        return entries
+
+    # Function to get the total size of the entries in bytes (the directory is scanned once per process)
+    def size(self):
+        if self.directory not in _directory_bytes:
+            _directory_bytes[self.directory] = sum(size for _, size, _ in self._entries())
+        return _directory_bytes[self.directory]
+
+    # Function to delete the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        _directory_bytes[self.directory] = total
+
+    # Function to delete every entry
+    def clear(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+        _directory_bytes.pop(self.directory, None)
+
+# Function to get the size of a file in bytes (0 when it does not exist)
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# Function to compute the SHA-1 hash of the content of a file
+def file_hash(file_path):
+    status = os.stat(file_path)
+    stamp = (os.path.abspath(file_path), status.st_size, status.st_mtime_ns)
+    if stamp not in _file_hashes:
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(block)
+        _file_hashes[stamp] = digest.hexdigest()
+    return _file_hashes[stamp]
+
+# Function to check whether Parquet files can be written
+def _has_parquet():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# Function to save a parsed table in the cache (Parquet when possible, otherwise a pickle)
+def _store_table(cache, key, table):
+    if _has_parquet():
+        try:
+            return cache.put(key, lambda path: table.to_parquet(path, index=False), ".parquet")
+        except (ValueError, TypeError, ImportError, ArithmeticError) as error:
+            # Columns with mixed types cannot be stored in Parquet
+            print(f"Warning: Parquet cache failed ({error}). Using a pickle instead.")
+    return cache.put(key, table.to_pickle, ".pkl")
+
+# Function to load a table from the cache, or None if it is not cached
+def _load_table(cache, key):
+    import pandas as pd
+
+    path = cache.get(key, ".parquet")
+    if path is not None:
+        return pd.read_parquet(path)
+    path = cache.get(key, ".pkl")
+    if path is not None:
+        return pd.read_pickle(path)
+    return None
+
+# Function to read an Excel file through the cache, with the same arguments as pandas.read_excel
+def read_excel(file_path, cache=None, **kwargs):
+    import pandas as pd
+
+    if cache is None:
+        cache = DiskCache(cache_directory, max_cache_bytes)
+
+    # Only single-sheet reads are cached (sheet_name=None or a list returns several tables)
+    sheet_name = kwargs.get("sheet_name", 0)
+    if sheet_name is None or isinstance(sheet_name, list):
+        return pd.read_excel(file_path, **kwargs)
+
+    # Key the entry by the content of the workbook, the read arguments and the pandas version
+    arguments = repr(sorted(kwargs.items()))
+    key = hashlib.sha1(f"{file_hash(file_path)}|{arguments}|{pd.__version__}".encode()).hexdigest()
+
+    if key in _memory_tables:
+        _memory_tables.move_to_end(key)
+        return _memory_tables[key][0].copy()
+
+    table = _load_table(cache, key)
+    if table is None:
+        table = pd.read_excel(file_path, **kwargs)
+        _store_table(cache, key, table)
+    _keep_in_memory(key, table)
+    return table
+
+# Function to keep a parsed table in memory, evicting the least recently used tables beyond memory_cache_bytes
+def _keep_in_memory(key, table):
+    if memory_cache_bytes <= 0:
+        return
+    _memory_tables[key] = (table.copy(), int(table.memory_usage(deep=True).sum()))
+    while _memory_tables and sum(size for _, size in _memory_tables.values()) > memory_cache_bytes:
+        _memory_tables.popitem(last=False)
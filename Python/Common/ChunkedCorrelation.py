@@ -0,0 +1,167 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: ChunkedCorrelation.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module computes the correlation metrics of CorrelationAnalysis.py (r, rho,
+# r2 and n of a base column against every target column) for tables that do not
+# fit in memory, by reading them in chunks of rows (CSV or Parquet files).
+# - Pass 1 merges the Pearson moments of every chunk (Common.Moments), which
+#   gives n and r exactly, and keeps a seeded random sample of rows.
+# - The sample places the rank bins of every column (at its quantiles, or at
+#   its distinct values when there are fewer of them than bins).
+# - Pass 2 counts the pairwise-complete values of every column in its bins, so
+#   each bin gets the average rank of the values in it.
+# - Pass 3 merges the Pearson moments of the binned ranks, which gives rho.
+# Memory is bounded by the chunk size, the sample size and the number of bins,
+# whatever the number of rows.
+# ----------------------------------------------------------------------------
+# Dependencies: os, numpy, pandas, pyarrow (Parquet files only), Common.Moments,
+#               Common.Trace
+# ----------------------------------------------------------------------------
+# Notes:
+# - rho is approximate: values in the same bin share one rank. It is exact when
+#   the sample holds every distinct value of a column (e.g. when the table has
+#   fewer rows than the sample and fewer distinct values than bins).
+# - The file is read three times. The results only depend on the seed, not on
+#   the chunk size.
+# ----------------------------------------------------------------------------
+import os
+import numpy as np
+
+from Common.Moments import PearsonMoments
+from Common.Trace import count, span
+
+# Function to read the column names of a CSV or Parquet file
+def read_columns(file_path):
+    import pandas as pd
+
+    if file_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return list(pq.ParquetFile(file_path).schema_arrow.names)
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+# Function to read the given columns of a CSV or Parquet file in chunks of rows (as DataFrames)
+def iterate_chunks(file_path, columns, chunk_rows=50000):
+    import pandas as pd
+
+    if file_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    with pd.read_csv(file_path, usecols=columns, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk[columns]
+
+# Function to keep the sample_rows rows with the smallest random keys among the sample and a new chunk
+def _sample_rows(sample, sample_keys, rows, keys, sample_rows):
+    rows = np.concatenate([sample, rows])
+    keys = np.concatenate([sample_keys, keys])
+    if len(keys) > sample_rows:
+        keep = np.argpartition(keys, sample_rows)[:sample_rows]
+        rows, keys = rows[keep], keys[keep]
+    return rows, keys
+
+# Function to place the rank bins of one column: its distinct values, or its quantiles when there are more than n_bins
+def _bin_edges(values, n_bins):
+    edges = np.unique(values)
+    if len(edges) > n_bins:
+        edges = np.unique(np.quantile(values, np.arange(1, n_bins + 1) / n_bins, method="inverted_cdf"))
+    return edges
+
+# Function to find the bin of every value of every column (edges: columns x bins, padded with inf)
+def _bin_columns(edges, values):
+    bins = np.empty(values.shape, dtype=np.int64)
+    for column in range(values.shape[1]):
+        bins[:, column] = np.searchsorted(edges[column], values[:, column])
+    return bins
+
+# Function to count the valid values of every column in its bins (bins: rows x columns of bin numbers)
+def _bin_counts(bins, valid, n_bins):
+    flat = (np.arange(bins.shape[1]) * n_bins + bins)[valid]
+    return np.bincount(flat, minlength=bins.shape[1] * n_bins).reshape(bins.shape[1], n_bins)
+
+# Function to compute the average rank of the values of every bin from the bin counts
+def _bin_ranks(counts):
+    return np.cumsum(counts, axis=1) - counts + (counts + 1) / 2.0
+
+# Function to compute r, rho, r2 and n between a base column and every target column from chunks of rows
+def chunked_correlation(read_chunks, n_bins=1024, sample_rows=10000, seed=42):
+    # read_chunks() returns a new iterator of (base: rows, targets: rows x columns) arrays on every call
+    rng = np.random.default_rng(seed)
+    moments = None
+    sample = None
+
+    # Pass 1: Pearson moments and a random sample of the rows (base column first)
+    with span("moments_pass"):
+        for base, targets in read_chunks():
+            chunk_moments = PearsonMoments.from_data(base, targets)
+            moments = chunk_moments if moments is None else moments.merge(chunk_moments)
+            rows = np.column_stack([base, targets])
+            if sample is None:
+                sample, sample_keys = rows[:0], np.empty(0)
+            sample, sample_keys = _sample_rows(sample, sample_keys, rows, rng.random(len(rows)), sample_rows)
+            count("rows", len(rows))
+    if moments is None:
+        raise ValueError("The table has no rows.")
+    n_columns = len(moments.n)
+
+    # Place the bins of the base column on all its sampled values, and those of each target column on its sampled pairs
+    base_edges = _bin_edges(sample[~np.isnan(sample[:, 0]), 0], n_bins)
+    column_edges = [_bin_edges(sample[~np.isnan(sample[:, 0]) & ~np.isnan(sample[:, column + 1]), column + 1], n_bins)
+                    for column in range(n_columns)]
+    target_edges = np.full((n_columns, max(len(edges) for edges in column_edges)), np.inf)
+    for column, edges in enumerate(column_edges):
+        target_edges[column, :len(edges)] = edges
+    n_base_bins = len(base_edges) + 1
+    n_target_bins = target_edges.shape[1] + 1
+
+    # Pass 2: count the pairwise-complete values of every column in its bins
+    base_counts = np.zeros((n_columns, n_base_bins), dtype=np.int64)
+    target_counts = np.zeros((n_columns, n_target_bins), dtype=np.int64)
+    with span("histogram_pass"):
+        for base, targets in read_chunks():
+            valid = ~np.isnan(targets) & ~np.isnan(base)[:, np.newaxis]
+            base_bins = np.broadcast_to(np.searchsorted(base_edges, base)[:, np.newaxis], targets.shape)
+            base_counts += _bin_counts(base_bins, valid, n_base_bins)
+            target_counts += _bin_counts(_bin_columns(target_edges, targets), valid, n_target_bins)
+    base_ranks = _bin_ranks(base_counts)
+    target_ranks = _bin_ranks(target_counts)
+
+    # Pass 3: Pearson moments of the ranks of the bins
+    rank_moments = None
+    with span("rank_pass"):
+        columns = np.arange(n_columns)
+        for base, targets in read_chunks():
+            valid = ~np.isnan(targets) & ~np.isnan(base)[:, np.newaxis]
+            x = np.where(valid, base_ranks[columns, np.searchsorted(base_edges, base)[:, np.newaxis]], np.nan)
+            y = np.where(valid, target_ranks[columns, _bin_columns(target_edges, targets)], np.nan)
+            chunk_moments = PearsonMoments.from_data(x, y)
+            rank_moments = chunk_moments if rank_moments is None else rank_moments.merge(chunk_moments)
+
+    r = moments.correlation()
+    return {
+        'r': r,
+        'rho': rank_moments.correlation(),
+        'r2': r ** 2,
+        'n': moments.n,
+    }
+
+# Function to compute the correlation metrics of a CSV or Parquet file, returning the base column name, the target columns and the metrics
+def file_correlation(file_path, base_column_index, first_target_column_index, chunk_rows=50000, n_bins=1024, sample_rows=10000, seed=42):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    columns = read_columns(file_path)
+    base_name = columns[base_column_index]
+    target_columns = columns[first_target_column_index:]
+
+    # Read only the base and target columns, as floats
+    def read_chunks():
+        for chunk in iterate_chunks(file_path, [base_name] + target_columns, chunk_rows):
+            values = chunk.to_numpy(dtype=float)
+            yield values[:, 0], values[:, 1:]
+
+    return base_name, target_columns, chunked_correlation(read_chunks, n_bins, sample_rows, seed)
@@ -0,0 +1,163 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Correlation.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module provides a vectorized correlation engine shared by the scripts.
+# - Ranks the columns of a NumPy array (average ranks for ties, NaN ignored).
+# - Computes Pearson r, Spearman rho, R^2 and the count of pairwise-complete
+#   data points between a base column and every target column in a single
+#   masked-matrix pass, instead of one dropna/corr call per column.
+# - Optionally bootstraps percentile confidence intervals and p-values of r and
+#   rho for every target column, with the resamples drawn as one seeded matrix
+#   of row indices and evaluated in chunks of replicates with the same masked
+#   passes.
+# ----------------------------------------------------------------------------
+# Dependencies: numpy
+# ----------------------------------------------------------------------------
+# Notes:
+# - Results match pandas Series.corr (pearson/spearman) on the pairwise-complete
+#   rows of each column up to floating point rounding.
+# - The bootstrap resamples the rows of the table (rows with a base value), so a
+#   target column with missing values can have a different n in each replicate.
+#   All indices are drawn up front, so the results only depend on the seed and
+#   the number of replicates, not on the chunk size.
+# - The bootstrap p-value is two-sided for a correlation of zero:
+#   p = min(1, 2 * min(P(r* <= 0), P(r* >= 0))), over the defined replicates.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+# Function to rank the values along an axis, giving tied values their average rank and keeping NaN values as NaN
+def rank_columns(values, axis=0):
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, -1)
+    length = values.shape[-1]
+
+    # Sort each column (NaN values are placed at the end)
+    order = np.argsort(values, axis=-1, kind='mergesort')
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+
+    # Find the first and last position of every group of tied values
+    positions = np.broadcast_to(np.arange(length), sorted_values.shape)
+    starts = np.ones(sorted_values.shape, dtype=bool)
+    starts[..., 1:] = sorted_values[..., 1:] != sorted_values[..., :-1]
+    ends = np.ones(sorted_values.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(ends, positions, length - 1), axis=-1), axis=-1), axis=-1)
+
+    # The average rank of a group is the mean of its first and last (1-based) positions
+    sorted_ranks = (first + last) / 2.0 + 1.0
+    sorted_ranks[np.isnan(sorted_values)] = np.nan
+
+    # Scatter the ranks back to the original order
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=-1)
+    return np.moveaxis(ranks, -1, axis)
+
+# Function to compute the Pearson correlation of every column pair (x[:, j], y[:, j]) over the rows where valid[:, j] is True
+def masked_pearson(x, y, valid, axis=0):
+    n = valid.sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Center each column on the mean of its valid rows
+        x = np.where(valid, x, 0.0)
+        y = np.where(valid, y, 0.0)
+        dx = np.where(valid, x - np.expand_dims(x.sum(axis=axis) / n, axis), 0.0)
+        dy = np.where(valid, y - np.expand_dims(y.sum(axis=axis) / n, axis), 0.0)
+
+        # Compute the sums of squares and cross-products
+        sxx = (dx * dx).sum(axis=axis)
+        syy = (dy * dy).sum(axis=axis)
+        sxy = (dx * dy).sum(axis=axis)
+
+        r = sxy / np.sqrt(sxx * syy)
+
+    # Correlations need at least two pairs and a non-constant column
+    r = np.where((n >= 2) & (sxx > 0) & (syy > 0), r, np.nan)
+    return np.clip(r, -1.0, 1.0)
+
+# Function to compute r, rho, r2 and n between a base column and every target column using the pairwise-complete rows
+def pairwise_correlation(base, targets, row_mask=None):
+    base = np.asarray(base, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    if targets.ndim == 1:
+        targets = targets[:, np.newaxis]
+
+    # Rows are valid for a target column when neither the base nor the target value is NaN
+    valid = ~np.isnan(targets) & ~np.isnan(base)[:, np.newaxis]
+    if row_mask is not None:
+        valid &= np.asarray(row_mask, dtype=bool)[:, np.newaxis]
+
+    # Mask out the invalid rows of each column pair
+    x = np.where(valid, base[:, np.newaxis], np.nan)
+    y = np.where(valid, targets, np.nan)
+
+    # Pearson on the values and Spearman as Pearson on the ranks of the valid rows
+    r = masked_pearson(x, y, valid)
+    rho = masked_pearson(rank_columns(x), rank_columns(y), valid)
+
+    return {
+        'r': r,
+        'rho': rho,
+        'r2': r ** 2,
+        'n': valid.sum(axis=0),
+    }
+
+# Function to compute the percentile confidence interval and two-sided p-value of every column from its bootstrap replicates
+def bootstrap_summary(replicates, confidence=0.95):
+    defined = ~np.isnan(replicates)
+    count = defined.sum(axis=0)
+    tail = (1.0 - confidence) / 2.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        low = np.full(replicates.shape[1], np.nan)
+        high = np.full(replicates.shape[1], np.nan)
+        columns = count > 0
+        if columns.any():
+            low[columns], high[columns] = np.nanquantile(replicates[:, columns], [tail, 1.0 - tail], axis=0)
+        below = (replicates <= 0).sum(axis=0) / count
+        above = (replicates >= 0).sum(axis=0) / count
+        p = np.minimum(1.0, 2.0 * np.minimum(below, above))
+    return low, high, np.where(columns, p, np.nan)
+
+# Function to bootstrap confidence intervals and p-values of r and rho between a base column and every target column
+def bootstrap_correlation(base, targets, row_mask=None, n_replicates=1000, seed=42, confidence=0.95, max_chunk_bytes=256 * 1024 ** 2):
+    base = np.asarray(base, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    if targets.ndim == 1:
+        targets = targets[:, np.newaxis]
+
+    # Resample only the rows that have a base value (and are in the row mask)
+    rows = ~np.isnan(base)
+    if row_mask is not None:
+        rows &= np.asarray(row_mask, dtype=bool)
+    base = base[rows]
+    targets = targets[rows]
+    n_rows, n_columns = targets.shape
+
+    # Draw the row indices of every replicate at once from the seeded generator
+    r_replicates = np.full((n_replicates, n_columns), np.nan)
+    rho_replicates = np.full((n_replicates, n_columns), np.nan)
+    if n_rows >= 2:
+        indices = np.random.default_rng(seed).integers(0, n_rows, size=(n_replicates, n_rows))
+
+        # Evaluate the replicates in chunks to bound the memory of the (replicates, rows, columns) arrays
+        chunk_size = max(1, int(max_chunk_bytes // (8 * 8 * n_rows * n_columns)))
+        for start in range(0, n_replicates, chunk_size):
+            chunk = indices[start:start + chunk_size]
+            y = targets[chunk]
+            valid = ~np.isnan(y)
+            x = np.where(valid, base[chunk][..., np.newaxis], np.nan)
+            r_replicates[start:start + len(chunk)] = masked_pearson(x, y, valid, axis=1)
+            rho_replicates[start:start + len(chunk)] = masked_pearson(rank_columns(x, axis=1), rank_columns(y, axis=1), valid, axis=1)
+
+    r_low, r_high, r_p = bootstrap_summary(r_replicates, confidence)
+    rho_low, rho_high, rho_p = bootstrap_summary(rho_replicates, confidence)
+    return {
+        'r_low': r_low,
+        'r_high': r_high,
+        'r_p': r_p,
+        'rho_low': rho_low,
+        'rho_high': rho_high,
+        'rho_p': rho_p,
+    }
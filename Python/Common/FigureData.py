@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: FigureData.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module pivots Merged4 (the output of the Merge.py scripts) into the
+# grids the MATLAB figures plot, and saves them as arrays:
+# - correlation_grids: r2 per (Satellite, Category, Index, Product) with the Avg
+#   row and column of Rsquared_Heatmap.m, and r, rho and n without them for the
+#   scatter plots of CorelationAnalysis.m.
+# - importance_grids: the importance scores per (Satellite, Category, Index,
+#   Product), as RFImportance_Barplots.m stacks them, and their standard
+#   deviations.
+# - save_grids writes the grids and their labels to a .mat file (scipy.io), an
+#   .npz file (numpy) and/or an .h5 file (h5py), so the figures load them with
+#   no Excel parsing or pivoting.
+# ----------------------------------------------------------------------------
+# Dependencies: warnings, numpy, pandas, scipy.io (.mat only), h5py (optional, .h5 only),
+#               Common.Schema
+# ----------------------------------------------------------------------------
+# Notes:
+# - The grids are indexed (satellite, category, index, product) in the order of
+#   the MATLAB scripts: Landsat5, Landsat7, Landsat8, Sentinel2; All, HH, WLO, AW,
+#   SS, EH, OM; I1..I27 (then Avg); Level1, Level2, ACOLITE, ..., QUAC (then Avg).
+#   In MATLAB, squeeze(r2(j, i, :, :)) is the 28 x 11 heatmap matrix of satellite
+#   j and category i.
+# - Cells without a value are NaN. As in Rsquared_Heatmap.m, the averages ignore
+#   NaN values and the Avg x Avg cell is NaN.
+# - The .mat file is a MAT-file version 5, written with scipy.io.savemat (SciPy
+#   cannot write the HDF5-based version 7.3), and loaded with load in MATLAB.
+#   Version 5 limits each variable to 2 GB; larger grids need the .h5 format,
+#   read with h5read.
+# ----------------------------------------------------------------------------
+import warnings
+import numpy as np
+
+from Common.Schema import category_names, satellite_prefixes
+
+# Define the product order of the MATLAB figures and the number of indices
+figure_products = ["Level1", "Level2", "ACOLITE", "ATCOR", "C2RCC", "DOS1", "FLAASH", "iCOR", "Polymer", "QUAC"]
+n_indices = 27
+
+# Function to pivot one value column of Merged4 into a (satellite, category, index, product) grid
+def pivot_grid(table, column):
+    import pandas as pd
+
+    satellite = pd.Categorical(table["Satellite"], categories=satellite_prefixes).codes
+    category = pd.Categorical(table["Category"], categories=category_names).codes
+    product = pd.Categorical(table["Product"], categories=figure_products).codes
+    index = pd.to_numeric(table["Index_Number"], errors="coerce").to_numpy(dtype=float)
+    valid = (satellite >= 0) & (category >= 0) & (product >= 0) & (index >= 1) & (index <= n_indices) & (index % 1 == 0)
+
+    # Later rows overwrite earlier ones, as in the fill loop of Rsquared_Heatmap.m
+    grid = np.full((len(satellite_prefixes), len(category_names), n_indices, len(figure_products)), np.nan)
+    grid[satellite[valid], category[valid], index[valid].astype(int) - 1, product[valid]] = \
+        pd.to_numeric(table[column], errors="coerce").to_numpy(dtype=float)[valid]
+    return grid
+
+# Function to add the Avg column (mean over the products) and the Avg row (mean over the indices) to a grid
+def add_averages(grid):
+    satellites, categories, indices, products = grid.shape
+    with_averages = np.full((satellites, categories, indices + 1, products + 1), np.nan)
+    with_averages[:, :, :indices, :products] = grid
+    with warnings.catch_warnings():
+        # Rows and columns without any value average to NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        with_averages[:, :, :indices, products] = np.nanmean(grid, axis=3)
+        with_averages[:, :, indices, :products] = np.nanmean(grid, axis=2)
+    return with_averages
+
+# Function to get the labels of the grid dimensions
+def grid_labels():
+    index_labels = [f"I{index}" for index in range(1, n_indices + 1)]
+    return {
+        "satellites": satellite_prefixes,
+        "categories": category_names,
+        "products": figure_products,
+        "index_labels": index_labels,
+        "products_avg": figure_products + ["Avg"],
+        "index_labels_avg": index_labels + ["Avg"],
+    }
+
+# Function to build the grids of the correlation figures from Merged4 of CorrelationAnalysis
+def correlation_grids(table):
+    grids = grid_labels()
+    grids["r2"] = add_averages(pivot_grid(table, "r2"))
+    for column in ["r", "rho", "n"]:
+        grids[column] = pivot_grid(table, column)
+    return grids
+
+# Function to build the grids of the importance bar plots from Merged4 of RFImportance
+def importance_grids(table):
+    grids = grid_labels()
+    grids["importance"] = pivot_grid(table, "Importance Score")
+    grids["importance_std"] = pivot_grid(table, "Standard Deviation")
+    return grids
+
+# Function to save the grids next to a path (e.g. Merged4_grids) in the given formats (.mat, .npz, .h5) and return the file paths
+def save_grids(grids, path, formats=(".mat", ".npz")):
+    paths = []
+    for extension in formats:
+        file_path = path + extension
+        if extension == ".mat":
+            from scipy.io import savemat
+            # Lists of labels become cell arrays of char vectors
+            savemat(file_path, {name: np.array(value, dtype=object) if isinstance(value, list) else value
+                                for name, value in grids.items()}, do_compression=True)
+        elif extension == ".npz":
+            np.savez_compressed(file_path, **{name: np.array(value) for name, value in grids.items()})
+        elif extension == ".h5":
+            import h5py
+            with h5py.File(file_path, "w") as handle:
+                for name, value in grids.items():
+                    handle.create_dataset(name, data=np.array(value, dtype=h5py.string_dtype()) if isinstance(value, list) else value)
+        else:
+            raise ValueError(f"Unknown grid format {extension!r} (expected .mat, .npz or .h5).")
+        paths.append(file_path)
+    return paths
@@ -0,0 +1,67 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Forest.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module grows Random Forest regressors for the importance analysis.
+# - The forest is grown in warm-start batches of trees, each batch fitted on
+#   n_jobs threads.
+# - The importances of the new trees of every batch are merged into a running
+#   mean and variance (Common.Moments.RunningMoments) instead of being stacked.
+# - Growth stops once the set of the top features and the mean and standard
+#   deviation of the importances change by less than the tolerance between
+#   two batches, or when the maximum number of trees is reached.
+# ----------------------------------------------------------------------------
+# Dependencies: numpy, sklearn (imported when a forest is grown), Common.Moments
+# ----------------------------------------------------------------------------
+# Notes:
+# - Warm-start batches draw the same tree seeds as a single fit, so growing to
+#   max_trees without early stopping (tolerance=None) gives the same forest as
+#   RandomForestRegressor(n_estimators=max_trees) with the same random_state.
+# - The standard deviation is the population standard deviation (ddof=0) of
+#   the per-tree importances, as np.std over rf.estimators_.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from Common.Moments import RunningMoments
+
+# Function to check whether the importances of two consecutive batches agree within the tolerance
+def has_converged(previous, current, tolerance, top_features=10):
+    previous_mean, previous_std = previous
+    current_mean, current_std = current
+
+    # The set of the most important features must not change
+    top = min(top_features, len(current_mean))
+    same_ranking = set(np.argsort(-previous_mean, kind='stable')[:top]) == set(np.argsort(-current_mean, kind='stable')[:top])
+
+    # The largest changes of the mean and standard deviation, relative to their largest values
+    mean_change = np.max(np.abs(current_mean - previous_mean)) / max(np.max(current_mean), np.finfo(float).tiny)
+    std_change = np.max(np.abs(current_std - previous_std)) / max(np.max(current_std), np.finfo(float).tiny)
+
+    return same_ranking and mean_change <= tolerance and std_change <= tolerance
+
+# Function to grow a Random Forest in batches until the importances converge, returning the forest and the importance moments
+def grow_forest(features, response, n_jobs=1, random_state=42, batch_size=25, min_trees=50, max_trees=500, tolerance=0.05):
+    from sklearn.ensemble import RandomForestRegressor
+
+    rf = RandomForestRegressor(n_estimators=batch_size, random_state=random_state, n_jobs=n_jobs, warm_start=True)
+    moments = RunningMoments(np.shape(features)[1])
+    previous = None
+    n_trees = 0
+
+    while n_trees < max_trees:
+        # Fit the next batch of trees (on n_jobs threads) and stream their importances into the moments
+        rf.set_params(n_estimators=min(n_trees + batch_size, max_trees))
+        rf.fit(features, response)
+        moments.update([tree.feature_importances_ for tree in rf.estimators_[n_trees:]])
+        n_trees = len(rf.estimators_)
+
+        # Stop once the importances have converged
+        current = (moments.mean, moments.std())
+        if tolerance is not None and previous is not None and moments.n >= min_trees and has_converged(previous, current, tolerance):
+            break
+        previous = current
+
+    return rf, moments
@@ -0,0 +1,97 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Imputation.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module prepares the feature matrix and the response of a Random Forest
+# fit with missing feature values filled in:
+# - column_statistics computes the mean (or median) of every feature column,
+#   and dataset_statistics computes it once per process for a whole dataset
+#   (e.g. a satellite sheet of AllData.xlsx), so that all the Satellite x
+#   Category subsets of the dataset share it.
+# - prepare_fit copies the feature columns straight into one preallocated
+#   float32 matrix (the type the trees are fitted on) and fills the missing
+#   values in place, instead of building imputed copies of the table. The
+#   matrix is column-major, so every column is written contiguously.
+# - The response is never imputed: rows without a response are left out.
+# - With the "native" strategy the missing values are kept as NaN, for the
+#   estimators that handle them themselves (e.g. the Random Forest of
+#   scikit-learn 1.4 and later).
+# ----------------------------------------------------------------------------
+# Dependencies: warnings, numpy, pandas
+# ----------------------------------------------------------------------------
+# Notes:
+# - With the "mean" strategy and the statistics of the fitted rows, the matrix
+#   is the same as SimpleImputer(strategy='mean').fit_transform followed by the
+#   float32 conversion of the trees (the statistics are computed in float64).
+# - Feature columns without any value in the fitted rows are dropped, as
+#   SimpleImputer drops them.
+# ----------------------------------------------------------------------------
+import warnings
+import numpy as np
+
+# Define the imputation strategies
+imputation_strategies = ["mean", "median", "native"]
+
+# Column statistics of the datasets already seen by this process, keyed by (dataset key, columns, strategy)
+_statistics = {}
+
+# Function to get the values of a column as floats, restricted to the row positions in rows (all rows when rows is None)
+def column_values(data, column, rows=None):
+    values = data[column].to_numpy(dtype=float)
+    return values if rows is None else values[rows]
+
+# Function to compute the mean or median of every column over the given rows (NaN for a column without values), as a Series
+def column_statistics(data, columns, strategy="mean", rows=None):
+    import pandas as pd
+
+    if strategy not in ("mean", "median"):
+        raise ValueError(f"Column statistics are computed for the mean and median strategies, not {strategy!r}.")
+    function = np.nanmean if strategy == "mean" else np.nanmedian
+    with warnings.catch_warnings():
+        # Columns without any value give NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return pd.Series([function(column_values(data, column, rows)) for column in columns], index=list(columns), dtype=float)
+
+# Function to get the column statistics of a whole dataset over its rows with a response (computed once per process for each key)
+def dataset_statistics(key, data, columns, response_name, strategy="mean"):
+    cache_key = (key, tuple(columns), response_name, strategy)
+    if cache_key not in _statistics:
+        rows = np.flatnonzero(~np.isnan(column_values(data, response_name)))
+        _statistics[cache_key] = column_statistics(data, columns, strategy, rows)
+    return _statistics[cache_key]
+
+# Function to build the float32 feature matrix and the response of the rows with a response, filling the missing feature values
+def prepare_fit(data, feature_columns, response_name, rows=None, strategy="mean", statistics=None):
+    if strategy not in imputation_strategies:
+        raise ValueError(f"Unknown imputation strategy {strategy!r} (expected one of {imputation_strategies}).")
+
+    # Keep the rows with a response (the response is never imputed)
+    response = column_values(data, response_name, rows)
+    has_response = ~np.isnan(response)
+    rows = (np.arange(len(data)) if rows is None else np.asarray(rows))[has_response]
+    response = response[has_response]
+
+    # Copy every feature column with values into the preallocated matrix, and fill its missing values in place
+    columns = []
+    features = np.empty((len(rows), len(feature_columns)), dtype=np.float32, order="F")
+    n_missing = 0
+    for column in feature_columns:
+        values = column_values(data, column, rows)
+        missing = np.isnan(values)
+        if missing.all():
+            continue
+        j = len(columns)
+        columns.append(column)
+        features[:, j] = values
+        n_missing += int(missing.sum())
+        if strategy != "native" and missing.any():
+            if statistics is not None:
+                fill = statistics[column]
+            else:
+                fill = np.mean(values[~missing]) if strategy == "mean" else np.median(values[~missing])
+            features[missing, j] = fill
+
+    return columns, features[:, :len(columns)], response, n_missing
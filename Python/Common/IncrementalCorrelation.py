@@ -0,0 +1,147 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: IncrementalCorrelation.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module keeps the correlation statistics of one input file up to date as
+# new matchup rows arrive, without recomputing everything from scratch.
+# - CorrelationState persists the Pearson moments of every target column (see
+#   Common.Moments) in a state directory, next to the rows seen so far.
+# - Appending rows updates n, r and r2 in O(new rows) and marks the target
+#   columns that received new pairs. Spearman rho is only recomputed for those
+#   columns, and only when the results are requested.
+# - rebuild() recomputes every statistic from all stored rows, reports the
+#   largest difference to the incremental values and resets the state.
+# ----------------------------------------------------------------------------
+# Dependencies: os, json, numpy, Common.Correlation, Common.Moments
+# ----------------------------------------------------------------------------
+# Notes:
+# - A state directory contains state.json (column names), moments.npz and one
+#   rows_XXXXX.npy file per appended block of rows (base column first).
+#   Appending writes one new block and never rewrites the old ones.
+# - Incremental results equal a full recompute up to floating point rounding;
+#   rebuild() reports the difference.
+# ----------------------------------------------------------------------------
+import os
+import json
+import numpy as np
+
+from Common.Correlation import pairwise_correlation
+from Common.Moments import PearsonMoments
+
+class CorrelationState:
+    def __init__(self, directory, base_name, target_columns):
+        self.directory = directory
+        self.base_name = base_name
+        self.target_columns = list(target_columns)
+        self.moments = PearsonMoments(len(self.target_columns))
+        self.rho = np.full(len(self.target_columns), np.nan)
+        self.stale = np.ones(len(self.target_columns), dtype=bool)
+        self.n_blocks = 0
+
+    # Function to check whether a state directory exists
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "state.json"))
+
+    # Function to create a new state from the rows of an input file
+    @classmethod
+    def create(cls, directory, base_name, target_columns, base, targets):
+        state = cls(directory, base_name, target_columns)
+        os.makedirs(directory, exist_ok=True)
+        state.append(base, targets)
+        return state
+
+    # Function to load a state from its directory
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "state.json")) as handle:
+            header = json.load(handle)
+        state = cls(directory, header["base_name"], header["target_columns"])
+        state.n_blocks = header["n_blocks"]
+        with np.load(os.path.join(directory, "moments.npz")) as arrays:
+            state.moments = PearsonMoments.from_arrays(arrays)
+            state.rho = arrays["rho"]
+            state.stale = arrays["stale"]
+        return state
+
+    # Function to save the moments and column names (the row blocks are written by append)
+    def save(self):
+        np.savez(os.path.join(self.directory, "moments.npz"), rho=self.rho, stale=self.stale, **self.moments.to_arrays())
+        header = {"base_name": self.base_name, "target_columns": self.target_columns, "n_blocks": self.n_blocks}
+        with open(os.path.join(self.directory, "state.json"), "w") as handle:
+            json.dump(header, handle)
+
+    # Function to get the path of a stored block of rows
+    def _block_path(self, block):
+        return os.path.join(self.directory, f"rows_{block:05d}.npy")
+
+    # Function to load every stored row (base column first, then the target columns)
+    def rows(self):
+        blocks = [np.load(self._block_path(block)) for block in range(self.n_blocks)]
+        if not blocks:
+            return np.empty((0, 1 + len(self.target_columns)))
+        return np.vstack(blocks)
+
+    # Function to append new rows: update the moments and mark the columns whose rho must be refreshed
+    def append(self, base, targets):
+        base = np.asarray(base, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+
+        # Store the new rows as a block of their own
+        np.save(self._block_path(self.n_blocks), np.column_stack([base, targets]))
+        self.n_blocks += 1
+
+        # Merge the moments of the new rows into the running moments
+        batch = PearsonMoments.from_data(base, targets)
+        self.moments.merge(batch)
+        self.stale |= batch.n > 0
+        self.save()
+        return int(np.count_nonzero(batch.n))
+
+    # Function to append the rows of a data frame (columns are matched by name, missing columns are NaN)
+    def append_frame(self, data):
+        base = data[self.base_name].to_numpy(dtype=float)
+        targets = data.reindex(columns=self.target_columns).to_numpy(dtype=float)
+        return self.append(base, targets)
+
+    # Function to get r, rho, r2 and n, refreshing rho only for the columns that changed
+    def results(self):
+        if self.stale.any():
+            rows = self.rows()
+            columns = np.flatnonzero(self.stale)
+            self.rho = self.rho.copy()
+            self.rho[columns] = pairwise_correlation(rows[:, 0], rows[:, 1 + columns])["rho"]
+            self.stale[:] = False
+            self.save()
+
+        r = self.moments.correlation()
+        return {"r": r, "rho": self.rho, "r2": r ** 2, "n": self.moments.n}
+
+    # Function to recompute every statistic from all stored rows and report the largest differences
+    def rebuild(self):
+        incremental = self.results()
+        rows = self.rows()
+        full = pairwise_correlation(rows[:, 0], rows[:, 1:])
+
+        differences = {}
+        for name in ("r", "rho", "r2"):
+            both = ~np.isnan(full[name]) & ~np.isnan(incremental[name])
+            mismatched = np.isnan(full[name]) != np.isnan(incremental[name])
+            differences[name] = float(np.max(np.abs(full[name][both] - incremental[name][both]), initial=0.0))
+            differences[name + "_nan_mismatches"] = int(mismatched.sum())
+        differences["n_mismatches"] = int(np.count_nonzero(full["n"] != incremental["n"]))
+
+        # Reset the state to the full recompute (kept as a single block of rows)
+        for block in range(self.n_blocks):
+            os.remove(self._block_path(block))
+        self.n_blocks = 0
+        self.moments = PearsonMoments(len(self.target_columns))
+        self.stale[:] = True
+        self.append(rows[:, 0], rows[:, 1:])
+        self.rho = full["rho"]
+        self.stale[:] = False
+        self.save()
+        return differences
@@ -0,0 +1,84 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: KeyedUpdate.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module updates the rows of one table with the values of the matching
+# rows of another table, matched on a set of key columns (e.g. Satellite,
+# Category, Product, Index and Index_Number in the Merge.py scripts).
+# - Builds a hash index on the key columns of the source table once, so every
+#   target row is matched in constant time instead of scanning the source table.
+# - Supports an optional condition on the matched source rows (e.g. n > 10).
+# ----------------------------------------------------------------------------
+# Dependencies: numpy, pandas
+# ----------------------------------------------------------------------------
+# Notes:
+# - Rows with a missing value in any key column never match, as with the
+#   element-wise comparison used before.
+# - When several source rows share a key, the first one (in source order) is
+#   used by default; keep="last" uses the last one instead.
+# - Numeric keys stored as text (e.g. "3" and 3) are treated as equal.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+# Function to bring a key column to a canonical type (float when every value is numeric, text otherwise)
+def _normalize_key(column):
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    numeric = pd.to_numeric(column, errors="coerce")
+    if numeric.notna().sum() == column.notna().sum():
+        return numeric.astype(float)
+    return column.astype(object).where(column.notna(), None).map(lambda value: value if value is None else str(value))
+
+# Function to build the normalized key table of a data frame
+def _key_frame(data, key_columns):
+    import pandas as pd
+
+    return pd.DataFrame({column: _normalize_key(data[column]) for column in key_columns}).reset_index(drop=True)
+
+# Function to find, for every target row, the position of its matching source row (-1 if there is none)
+def match_rows(target, source, key_columns, keep="first"):
+    import pandas as pd
+
+    source_keys = _key_frame(source, key_columns)
+    target_keys = _key_frame(target, key_columns)
+
+    # Rows with a missing key value cannot match
+    source_valid = source_keys.notna().all(axis=1).to_numpy()
+    target_valid = target_keys.notna().all(axis=1).to_numpy()
+
+    # Keep one source row per key, so that duplicate keys resolve deterministically
+    source_positions = np.flatnonzero(source_valid)
+    unique = ~source_keys.iloc[source_positions].duplicated(keep=keep).to_numpy()
+    source_positions = source_positions[unique]
+
+    # Hash the source keys once and look up every target key
+    source_index = pd.MultiIndex.from_frame(source_keys.iloc[source_positions])
+    target_index = pd.MultiIndex.from_frame(target_keys)
+    found = source_index.get_indexer(target_index)
+
+    matches = np.where((found >= 0) & target_valid, source_positions[np.maximum(found, 0)], -1)
+    return matches
+
+# Function to update value_columns of the target rows with the values of their matching source rows
+def keyed_update(target, source, key_columns, value_columns, condition=None, keep="first"):
+    matches = match_rows(target, source, key_columns, keep=keep)
+    hit = matches >= 0
+
+    # Apply the condition (a function of the matched source rows returning a boolean mask)
+    matched_rows = source.iloc[matches[hit]]
+    if condition is not None:
+        accepted = np.asarray(condition(matched_rows), dtype=bool)
+        matched_rows = matched_rows[accepted]
+        hit[np.flatnonzero(hit)[~accepted]] = False
+
+    # Write the values of the matched source rows into the target rows
+    target_rows = target.index[hit]
+    for column in value_columns:
+        target.loc[target_rows, column] = matched_rows[column].to_numpy()
+
+    return target
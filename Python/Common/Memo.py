@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Memo.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module memoizes the results of the analysis stages (importance tables,
+# correlation tables, regression fits and, optionally, fitted models) in the
+# on-disk cache of Common.Cache.
+# - content_key hashes the stage name, the input data slice (DataFrames, arrays)
+#   and the settings (numbers, strings, lists, dicts) into one SHA-1 key.
+# - memoize returns the stored result for a key, or computes, stores and
+#   returns it, so a rerun only recomputes the files whose data or settings
+#   changed.
+# - Entries share the size limit and least-recently-used eviction of the cache.
+# ----------------------------------------------------------------------------
+# Dependencies: hashlib, numpy, pandas, Common.Cache, Common.Trace
+# ----------------------------------------------------------------------------
+# Notes:
+# - Include in the key everything the result depends on (file name, data,
+#   column selection and hyperparameters). Library versions that change the
+#   results (e.g. sklearn for the forests) should be part of the settings.
+# - Bump the version in the stage name (e.g. "RFImportance/2") when the code of
+#   a stage changes its results, so older entries are no longer used.
+# ----------------------------------------------------------------------------
+import hashlib
+import numpy as np
+
+from Common.Cache import DiskCache, cache_directory, max_cache_bytes
+from Common.Trace import count
+
+# Function to feed one value (and, recursively, its items) into a hash
+def _update(digest, value):
+    import pandas as pd
+
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+        digest.update(b"DataFrame")
+        _update(digest, [str(column) for column in value.columns])
+        _update(digest, [str(dtype) for dtype in value.dtypes])
+        digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        digest.update(f"ndarray|{value.dtype.str}|{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(b"dict")
+        for item_key in sorted(value, key=repr):
+            _update(digest, item_key)
+            _update(digest, value[item_key])
+    elif isinstance(value, (list, tuple, pd.Index)):
+        digest.update(f"sequence|{len(value)}".encode())
+        for item in value:
+            _update(digest, item)
+    else:
+        digest.update(f"{type(value).__name__}|{value!r}".encode())
+    digest.update(b";")
+
+# Function to compute the key of a stage result from the stage name and everything the result depends on
+def content_key(stage, *parts):
+    digest = hashlib.sha1(stage.encode())
+    for part in parts:
+        _update(digest, part)
+    return digest.hexdigest()
+
+# Function to return the stored result of a stage, or compute it with compute_function() and store it
+def memoize(stage, parts, compute_function, cache=None, enabled=True):
+    import pandas as pd
+
+    if not enabled:
+        return compute_function()
+    if cache is None:
+        cache = DiskCache(cache_directory, max_cache_bytes)
+
+    key = content_key(stage, *parts)
+    path = cache.get(key, ".pkl")
+    if path is not None:
+        count("memo_hits")
+        return pd.read_pickle(path)
+
+    count("memo_misses")
+    result = compute_function()
+    cache.put(key, lambda temporary_path: pd.to_pickle(result, temporary_path), ".pkl")
+    return result
+
+# Function to store an object (e.g. a fitted model) under the key of a stage result
+def store_object(stage, parts, value, cache=None):
+    import pandas as pd
+
+    if cache is None:
+        cache = DiskCache(cache_directory, max_cache_bytes)
+    return cache.put(content_key(stage, *parts), lambda temporary_path: pd.to_pickle(value, temporary_path), ".pkl")
+
+# Function to load an object stored with store_object, or None if it is not (or no longer) cached
+def load_object(stage, parts, cache=None):
+    import pandas as pd
+
+    if cache is None:
+        cache = DiskCache(cache_directory, max_cache_bytes)
+    path = cache.get(content_key(stage, *parts), ".pkl")
+    return pd.read_pickle(path) if path is not None else None
@@ -0,0 +1,87 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: MergePipeline.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module runs the merge step of the Merge.py scripts as one in-memory
+# pipeline:
+# - Reads the per-file output tables concurrently, in the predefined order, in
+#   whatever format the analysis script wrote them (Common.Writers).
+# - Concatenates them as a compact result store (Common.ResultStore), filters
+#   out the band rows (Index starting with 'B') and updates Merged3.xlsx from
+#   the filtered rows with a keyed update on the integer codes of the labels.
+# - Writes Merged4.xlsx. The intermediate tables (Merged.xlsx, Merged2.xlsx)
+#   are only written on request, on a background thread, as write-only workbooks.
+# - Optionally saves the grids of the MATLAB figures pivoted from Merged4
+#   (Merged4_grids.mat/.npz, see Common.FigureData).
+# ----------------------------------------------------------------------------
+# Dependencies: os, Common.Cache, Common.FigureData, Common.Parallel, Common.ResultStore, Common.Trace,
+#               Common.Writers
+# ----------------------------------------------------------------------------
+import os
+
+from Common.Cache import read_excel
+from Common.FigureData import save_grids
+from Common.Parallel import run_jobs
+from Common.ResultStore import ResultStore
+from Common.Trace import count, span
+from Common.Writers import BackgroundWriter, find_output, read_found, write_xlsx
+
+# Function to read the output tables of file_order concurrently and return them in that order
+def read_outputs(directory, file_order, skiprows=None, n_workers=None, output_format=None):
+    found = [find_output(directory, file_name, output_format) for file_name in file_order]
+    jobs = [(output, skiprows) for output in found]
+    sizes = [os.path.getsize(output[0]) if output is not None else 0 for output in found]
+    tables = run_jobs(read_found, jobs, n_workers=n_workers, sizes=sizes)
+
+    dfs = []
+    for file_name, table in zip(file_order, tables):
+        if table is None:
+            print(f"{file_name} does not exist in the directory.")
+        else:
+            dfs.append(table)
+    return dfs
+
+# Function to filter out the rows where the "Index" column starts with 'B' (the bands) from a result store
+def filter_bands(merged_store):
+    return merged_store.take(~merged_store.label_mask('Index', lambda index: str(index).startswith('B')))
+
+# Function to run the merge pipeline and write Merged4.xlsx (and optionally Merged.xlsx, Merged2.xlsx and the figure grids)
+def run_merge(directory, file_order, merge_columns, value_columns, condition=None, skiprows=None,
+              write_intermediates=False, n_workers=None, build_grids=None, grid_formats=(".mat", ".npz"), output_format=None):
+    with BackgroundWriter() as writer:
+        # Concatenate all the data frames into a single data frame
+        with span("read_outputs"):
+            dfs = read_outputs(directory, file_order, skiprows, n_workers, output_format)
+        with span("concat"):
+            merged_store = ResultStore.concat(ResultStore.from_frame(df) for df in dfs)
+        count("files", len(dfs))
+        count("rows", len(merged_store))
+        if write_intermediates:
+            writer.submit(write_xlsx, merged_store.to_frame(), os.path.join(directory, "Merged.xlsx"))
+
+        # Filter out the band rows
+        with span("filter_bands"):
+            filtered_store = filter_bands(merged_store)
+        count("band_rows_dropped", len(merged_store) - len(filtered_store))
+        if write_intermediates:
+            writer.submit(write_xlsx, filtered_store.to_frame(), os.path.join(directory, "Merged2.xlsx"))
+
+        # Load the Merged3.xlsx file and update it from the filtered data
+        with span("read_excel", file="Merged3.xlsx"):
+            merged3_df = read_excel(os.path.join(directory, "Merged3.xlsx"))
+        with span("keyed_update"):
+            merged3_df = filtered_store.update_frame(merged3_df, merge_columns, value_columns, condition=condition)
+
+        # Write the updated Merged3 data frame to a new Excel file in the same directory
+        with span("write_xlsx", file="Merged4.xlsx"):
+            write_xlsx(merged3_df, os.path.join(directory, "Merged4.xlsx"))
+
+        # Save the grids of the MATLAB figures (build_grids pivots Merged4, e.g. Common.FigureData.correlation_grids)
+        if build_grids is not None and grid_formats:
+            with span("save_grids"):
+                save_grids(build_grids(merged3_df), os.path.join(directory, "Merged4_grids"), grid_formats)
+
+    return merged3_df
@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: ModelSearch.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module searches every candidate model of a Satellite x Category matchup
+# table for the best ones, ranked by their leave-one-out CV-R2:
+# - The candidates are every index column (headers containing "_I") and every
+#   ratio of two band columns of the same product (e.g. ACOLITE_..._B03 /
+#   ACOLITE_..._B02), each fitted to Chl-a (linear) and to log10(Chl-a) (log).
+# - The in-sample fits of all candidates are computed in one batched pass
+#   (Common.Regression). Candidates with n <= min_n pairs are left out, as in
+#   the n > 10 condition of the Merge.py scripts.
+# - The candidates are then cross-validated in blocks, in decreasing order of
+#   their r2. The search stops as soon as the r2 of the next block cannot beat
+#   the k-th best LOO CV-R2 found so far.
+# ----------------------------------------------------------------------------
+# Dependencies: itertools, numpy, pandas, Common.Regression, Common.Schema, Common.Trace
+# ----------------------------------------------------------------------------
+# Notes:
+# - The pruning is exact: the deleted residuals of leave-one-out are never
+#   smaller than the ordinary ones (PRESS >= SSE), so the LOO CV-R2 of a model
+#   is never above its r2. The top-k table is the same as with no pruning.
+# - r2 and LOO CV-R2 are in the fitted space (log10 for the log transform),
+#   while RMSE and LOO CV-RMSE are in Chl-a units, as in the sweep of Models.py.
+# - Band ratios with a zero denominator are left out of the fit of that row. A
+#   band ratio with the same values as an index column is reported as the index.
+# ----------------------------------------------------------------------------
+from itertools import permutations
+import numpy as np
+
+from Common.Regression import batched_ols, leave_one_out
+from Common.Schema import column_schema, feature_mask
+from Common.Trace import count
+
+# Define the transforms of the response: the name of each and whether log10(Chl-a) is fitted
+transforms = {"linear": False, "log": True}
+
+# Function to list the candidate features of a header row: the index columns and the ratios of the band columns of each product
+def candidate_features(columns, first_candidate_column_index=16, band_ratios=True):
+    import pandas as pd
+
+    schema = column_schema(columns)
+    indices = schema[feature_mask(columns, first_candidate_column_index)]
+    features = pd.DataFrame({
+        "Feature": indices["Header"].to_numpy(),
+        "Type": "index",
+        "Product": indices["Product"].astype(object).to_numpy(),
+        "Index": indices["Index"].astype(object).to_numpy(),
+        "Numerator": indices["Position"].to_numpy(),
+        "Denominator": -1,
+    })
+    if not band_ratios:
+        return features
+
+    # Every ordered pair of distinct bands of a product (B03/B02 and B02/B03 are different fits)
+    bands = schema[schema["Is_Band"].to_numpy() & schema["Valid"].to_numpy() & (schema["Position"].to_numpy() >= first_candidate_column_index)]
+    ratios = []
+    for product, group in bands.groupby("Product", observed=True, sort=False):
+        for numerator, denominator in permutations(group.itertuples(index=False), 2):
+            ratios.append((f"{numerator.Header}/{denominator.Header}", "band ratio", product,
+                           f"{numerator.Index}/{denominator.Index}", numerator.Position, denominator.Position))
+    ratios = pd.DataFrame(ratios, columns=features.columns)
+    return pd.concat([features, ratios], ignore_index=True) if len(ratios) else features
+
+# Function to compute the values of the candidate features (rows x features) from the values of a table (rows x columns)
+def feature_values(values, features):
+    numerators = values[:, features["Numerator"].to_numpy()]
+    denominators = features["Denominator"].to_numpy()
+    ratio = denominators >= 0
+    if ratio.any():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            quotients = numerators[:, ratio] / values[:, denominators[ratio]]
+        numerators[:, ratio] = np.where(np.isfinite(quotients), quotients, np.nan)
+    return numerators
+
+# Function to find the top_k candidate models of a table (response: rows, values: rows x columns) by LOO CV-R2
+def search_models(response, values, features, top_k=10, min_n=10, block_size=256):
+    import pandas as pd
+
+    response = np.asarray(response, dtype=float)
+    predictors = feature_values(np.asarray(values, dtype=float), features)
+
+    # In-sample fits of every candidate and transform in one pass (candidates are indexed transform-major)
+    fits = {name: batched_ols(response, predictors, log_response=log_response) for name, log_response in transforms.items()}
+    r2 = np.concatenate([fits[name]["r2"] for name in transforms])
+    n = np.concatenate([fits[name]["n"] for name in transforms])
+
+    # A band ratio with the same values as an index column (or an earlier ratio) is the same model, so it is only fitted once
+    distinct = np.tile(~pd.DataFrame(predictors.T).duplicated().to_numpy(), len(transforms))
+    eligible = np.flatnonzero((n > min_n) & np.isfinite(r2) & distinct)
+    order = eligible[np.argsort(-r2[eligible], kind="stable")]
+    count("candidates", len(r2))
+    count("candidates_duplicate", int((~distinct).sum()))
+    count("candidates_below_min_n", int(((n <= min_n) & distinct).sum()))
+
+    # Cross-validate the candidates in decreasing order of r2, until r2 (an upper bound of LOO CV-R2) cannot beat the k-th best
+    n_features = predictors.shape[1]
+    loo_r2 = np.full(len(r2), np.nan)
+    loo_rmse = np.full(len(r2), np.nan)
+    kth_best = -np.inf
+    evaluated = 0
+    for start in range(0, len(order), block_size):
+        block = order[start:start + block_size]
+        if r2[block[0]] <= kth_best:
+            break
+        for t, (name, log_response) in enumerate(transforms.items()):
+            candidates = block[block // n_features == t]
+            if len(candidates):
+                loo = leave_one_out(response, predictors[:, candidates % n_features], log_response=log_response)
+                loo_r2[candidates] = loo["LOO CV-R2"]
+                loo_rmse[candidates] = loo["LOO CV-RMSE"]
+        evaluated += len(block)
+        scores = loo_r2[order[:evaluated]]
+        scores = scores[np.isfinite(scores)]
+        if len(scores) >= top_k:
+            kth_best = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+    count("candidates_cross_validated", evaluated)
+    count("candidates_pruned", len(order) - evaluated)
+
+    # Rank the cross-validated candidates (ties keep the order of r2)
+    scored = order[:evaluated][np.isfinite(loo_r2[order[:evaluated]])]
+    best = scored[np.argsort(-loo_r2[scored], kind="stable")][:top_k]
+    names = list(transforms)
+    ranking = features.iloc[best % n_features].reset_index(drop=True)[["Product", "Index", "Type", "Feature"]]
+    ranking.insert(0, "Rank", np.arange(1, len(best) + 1))
+    ranking.insert(1, "Transform", [names[t] for t in best // n_features])
+    for metric in ["a", "b", "r2", "RMSE"]:
+        ranking[metric] = np.concatenate([fits[name][metric] for name in transforms])[best]
+    ranking["LOO CV-R2"] = loo_r2[best]
+    ranking["LOO CV-RMSE"] = loo_rmse[best]
+    ranking["n"] = n[best]
+    return ranking
@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Moments.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module keeps mergeable Pearson moments for a base column against many
+# target columns, over the pairwise-complete rows of each column.
+# - PearsonMoments stores, per target column, the count of pairs, the means of
+#   both columns and the centered sums of squares and cross-products.
+# - Moments of new rows are merged in with the parallel update of Chan et al.,
+#   so adding rows costs O(new rows) and stays numerically stable.
+# - RunningMoments keeps the running mean and variance of a stream of vectors
+#   (e.g. the per-tree importances of a growing forest) with the same update,
+#   without stacking the vectors.
+# ----------------------------------------------------------------------------
+# Dependencies: numpy
+# ----------------------------------------------------------------------------
+import numpy as np
+
+class PearsonMoments:
+    fields = ("n", "mean_x", "mean_y", "m2_x", "m2_y", "c_xy")
+
+    def __init__(self, n_columns):
+        self.n = np.zeros(n_columns, dtype=np.int64)
+        self.mean_x = np.zeros(n_columns)
+        self.mean_y = np.zeros(n_columns)
+        self.m2_x = np.zeros(n_columns)
+        self.m2_y = np.zeros(n_columns)
+        self.c_xy = np.zeros(n_columns)
+
+    # Function to compute the moments of a block of rows (base: n rows, or n rows x columns with one base per column; targets: n rows x columns)
+    @classmethod
+    def from_data(cls, base, targets, row_mask=None):
+        base = np.asarray(base, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+        if targets.ndim == 1:
+            targets = targets[:, np.newaxis]
+        if base.ndim == 1:
+            base = base[:, np.newaxis]
+
+        # Rows are valid for a target column when neither the base nor the target value is NaN
+        valid = ~np.isnan(targets) & ~np.isnan(base)
+        if row_mask is not None:
+            valid &= np.asarray(row_mask, dtype=bool)[:, np.newaxis]
+
+        moments = cls(targets.shape[1])
+        moments.n = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x = np.where(valid, base, 0.0)
+            y = np.where(valid, targets, 0.0)
+            count = np.maximum(moments.n, 1)
+            moments.mean_x = x.sum(axis=0) / count
+            moments.mean_y = y.sum(axis=0) / count
+            dx = np.where(valid, x - moments.mean_x, 0.0)
+            dy = np.where(valid, y - moments.mean_y, 0.0)
+        moments.m2_x = (dx * dx).sum(axis=0)
+        moments.m2_y = (dy * dy).sum(axis=0)
+        moments.c_xy = (dx * dy).sum(axis=0)
+        return moments
+
+    # Function to merge the moments of other rows into these moments
+    def merge(self, other):
+        n = self.n + other.n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(n > 0, other.n / np.maximum(n, 1), 0.0)
+            both = self.n * weight
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+
+        self.mean_x = self.mean_x + delta_x * weight
+        self.mean_y = self.mean_y + delta_y * weight
+        self.m2_x = self.m2_x + other.m2_x + delta_x * delta_x * both
+        self.m2_y = self.m2_y + other.m2_y + delta_y * delta_y * both
+        self.c_xy = self.c_xy + other.c_xy + delta_x * delta_y * both
+        self.n = n
+        return self
+
+    # Function to compute the Pearson correlation of every column
+    def correlation(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+
+        # Correlations need at least two pairs and a non-constant column
+        r = np.where((self.n >= 2) & (self.m2_x > 0) & (self.m2_y > 0), r, np.nan)
+        return np.clip(r, -1.0, 1.0)
+
+    # Function to select the moments of some columns
+    def take(self, columns):
+        moments = PearsonMoments(0)
+        for field in self.fields:
+            setattr(moments, field, getattr(self, field)[columns])
+        return moments
+
+    # Function to convert the moments to a dictionary of arrays (e.g. for np.savez)
+    def to_arrays(self, prefix=""):
+        return {prefix + field: getattr(self, field) for field in self.fields}
+
+    # Function to rebuild the moments from a dictionary of arrays
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        moments = cls(0)
+        for field in cls.fields:
+            setattr(moments, field, np.asarray(arrays[prefix + field]))
+        return moments
+
+class RunningMoments:
+    def __init__(self, n_columns):
+        self.n = 0
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+
+    # Function to merge a block of vectors (rows x columns) into the running moments
+    def update(self, values):
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        count = len(values)
+        if count == 0:
+            return self
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+
+        n = self.n + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / n)
+        self.m2 = self.m2 + m2 + delta * delta * (self.n * count / n)
+        self.n = n
+        return self
+
+    # Function to compute the standard deviation of every column (ddof=0 matches np.std)
+    def std(self, ddof=0):
+        if self.n - ddof <= 0:
+            return np.full(self.mean.shape, np.nan)
+        return np.sqrt(self.m2 / (self.n - ddof))
@@ -0,0 +1,97 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Parallel.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module runs independent per-file jobs (one Satellite x Category workbook
+# each) on a pool of worker processes.
+# - Schedules the largest input files first so that a big *_All.xlsx file is
+#   not left running alone at the end.
+# - Returns the results in the order the jobs were given, whatever order they
+#   finish in, so that reports and log messages stay deterministic.
+# - Splits the available cores between the worker processes and the threads
+#   each worker may use (e.g. the n_jobs of a Random Forest).
+# ----------------------------------------------------------------------------
+# Dependencies: os, multiprocessing, concurrent.futures, Common.Trace
+# ----------------------------------------------------------------------------
+# Notes:
+# - With n_workers = 1 the jobs run one by one in the current process.
+# - The job function must be defined at module level so it can be pickled.
+# - Worker processes started with spawn (the default on Windows and macOS) import the
+#   scripts again, so the settings a job depends on must be passed in its arguments.
+#   start_method = "spawn" reproduces this on Linux.
+# - When the run is traced (Common.Trace), the jobs run in the workers return their
+#   spans and counters with their results, and they are added to the trace.
+# ----------------------------------------------------------------------------
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from Common import Trace
+
+# Specify the start method of the worker processes ("spawn", "fork" or "forkserver"; None uses the default of the platform)
+start_method = None
+
+# Function to resolve the number of worker processes (None or 0 means one per core)
+def resolve_workers(n_workers, n_jobs=None):
+    if not n_workers or n_workers < 0:
+        n_workers = os.cpu_count() or 1
+    if n_jobs is not None:
+        n_workers = min(n_workers, max(1, n_jobs))
+    return max(1, n_workers)
+
+# Function to split the cores between the worker processes so they are not oversubscribed
+def threads_per_worker(n_workers):
+    return max(1, (os.cpu_count() or 1) // max(1, n_workers))
+
+# Function to run function(*arguments) for every job and return the results in the order of the jobs
+# (on_result, if given, is called with each result in this process as soon as it is collected, e.g. to write it)
+def run_jobs(function, jobs, n_workers=1, sizes=None, on_result=None):
+    jobs = list(jobs)
+    n_workers = resolve_workers(n_workers, len(jobs))
+
+    # Schedule the biggest jobs first when their sizes are known
+    order = list(range(len(jobs)))
+    if sizes is not None:
+        order.sort(key=lambda i: -sizes[i])
+
+    # Run the jobs in the current process when there is a single worker
+    if n_workers == 1:
+        results = [None] * len(jobs)
+        for i in order:
+            results[i] = function(*jobs[i])
+            if on_result is not None:
+                on_result(results[i])
+        return results
+
+    # Submit the jobs to the pool and collect the results in the original order
+    tracer = Trace.current()
+    context = multiprocessing.get_context(start_method) if start_method else None
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        if tracer is None:
+            futures = {i: executor.submit(function, *jobs[i]) for i in order}
+            results = []
+            for i in range(len(jobs)):
+                results.append(futures[i].result())
+                if on_result is not None:
+                    on_result(results[-1])
+            return results
+
+        # Run the traced jobs with their own trace and add it to the trace of the run
+        futures = {i: executor.submit(Trace.traced_call, function, jobs[i], tracer.trace_memory) for i in order}
+        results = []
+        for i in range(len(jobs)):
+            result, spans, counters, pid, origin_time = futures[i].result()
+            Trace.merge(spans, counters, pid, origin_time)
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+        return results
+
+# Function to run function(file_name, *arguments) for every file in a directory, largest files first
+def run_files(function, input_directory, file_names, arguments=(), n_workers=1, on_result=None):
+    sizes = [os.path.getsize(os.path.join(input_directory, file_name)) for file_name in file_names]
+    jobs = [(file_name,) + tuple(arguments) for file_name in file_names]
+    return run_jobs(function, jobs, n_workers=n_workers, sizes=sizes, on_result=on_result)
@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Permutation.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module computes the out-of-bag (OOB) permutation importance of the
+# features of a fitted Random Forest regressor.
+# - For every tree, the mean squared error on its OOB rows is compared with the
+#   error after shuffling one feature among those rows (n_repeats times). The
+#   importance of a feature is the increase of the error, averaged over trees.
+# - Features that a tree never splits on cannot change its predictions, so only
+#   the features used by each tree are shuffled, and all shuffled copies of the
+#   OOB rows of a tree are predicted in one call.
+# - The trees are split between worker processes, which read the feature matrix
+#   from a memory-mapped .npy file instead of receiving a pickled copy each.
+# ----------------------------------------------------------------------------
+# Dependencies: os, shutil, tempfile, numpy, sklearn (imported when the importance is computed), Common.Parallel
+# ----------------------------------------------------------------------------
+# Notes:
+# - The shuffles of each tree come from a generator seeded with (seed, tree index),
+#   so the results do not depend on the number of workers.
+# - The standard deviation is taken over the repeats (ddof=0), as in
+#   sklearn.inspection.permutation_importance.
+# ----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from Common.Parallel import resolve_workers, run_jobs
+
+# Specify the largest number of shuffled rows predicted in one call (bounds the memory of the stacked copies)
+max_rows_per_call = 200000
+
+# Memory-mapped feature matrices opened by this process, by path
+_matrices = {}
+
+# Function to open a memory-mapped feature matrix once per process
+def _open_matrix(matrix_path):
+    if matrix_path not in _matrices:
+        _matrices[matrix_path] = np.load(matrix_path, mmap_mode='r')
+    return _matrices[matrix_path]
+
+# Function to sum the OOB error increases of every repeat and feature over some trees (run in the worker processes)
+def _permutation_errors(matrix_path, response, trees, tree_indices, n_samples_bootstrap, n_repeats, seed):
+    from sklearn.ensemble._forest import _generate_unsampled_indices
+
+    features = _open_matrix(matrix_path)
+    n_samples, n_features = features.shape
+    increases = np.zeros((n_repeats, n_features))
+    n_trees = 0
+
+    for tree, tree_index in zip(trees, tree_indices):
+        # Select the OOB rows of the tree
+        oob = _generate_unsampled_indices(tree.random_state, n_samples, n_samples_bootstrap, None)
+        if len(oob) == 0:
+            continue
+        oob_features = np.ascontiguousarray(features[oob], dtype=np.float32)
+        oob_response = response[oob]
+        baseline = np.mean((tree.predict(oob_features, check_input=False) - oob_response) ** 2)
+        n_trees += 1
+
+        # Shuffle each used feature n_repeats times (in a fixed order, so chunking does not change the draws)
+        used = np.unique(tree.tree_.feature[tree.tree_.feature >= 0])
+        rng = np.random.default_rng([seed, tree_index])
+        permutations = [[rng.permutation(len(oob)) for _ in range(n_repeats)] for _ in used]
+
+        # Predict the shuffled copies of the OOB rows in as few calls as the memory bound allows
+        features_per_call = max(1, max_rows_per_call // (n_repeats * len(oob)))
+        for start in range(0, len(used), features_per_call):
+            chunk = used[start:start + features_per_call]
+            stacked = np.tile(oob_features, (len(chunk) * n_repeats, 1))
+            for i, feature in enumerate(chunk):
+                for repeat in range(n_repeats):
+                    block = (i * n_repeats + repeat) * len(oob)
+                    stacked[block:block + len(oob), feature] = oob_features[permutations[start + i][repeat], feature]
+            predictions = tree.predict(stacked, check_input=False).reshape(len(chunk), n_repeats, len(oob))
+            errors = np.mean((predictions - oob_response) ** 2, axis=-1)
+            increases[:, chunk] += (errors - baseline).T
+
+    return increases, n_trees
+
+# Function to compute the OOB permutation importance (mean and standard deviation over the repeats) of every feature
+def oob_permutation_importance(rf, features, response, n_repeats=5, seed=42, n_workers=1):
+    from sklearn.ensemble._forest import _get_n_samples_bootstrap
+
+    features = np.asarray(features, dtype=np.float32)
+    response = np.asarray(response, dtype=float)
+    n_samples_bootstrap = _get_n_samples_bootstrap(len(features), rf.max_samples, None)
+    trees = rf.estimators_
+
+    # Split the trees into a few jobs per worker
+    n_workers = resolve_workers(n_workers, len(trees))
+    n_jobs = min(len(trees), n_workers * 4) if n_workers > 1 else 1
+    groups = np.array_split(np.arange(len(trees)), n_jobs)
+
+    # Share the feature matrix with the workers through a memory-mapped file
+    directory = tempfile.mkdtemp(prefix="permutation_")
+    try:
+        matrix_path = os.path.join(directory, "features.npy")
+        np.save(matrix_path, features)
+        jobs = [(matrix_path, response, [trees[i] for i in group], group, n_samples_bootstrap, n_repeats, seed) for group in groups]
+        results = run_jobs(_permutation_errors, jobs, n_workers=n_workers)
+    finally:
+        _matrices.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # Average the error increases over the trees that have OOB rows
+    increases = sum(result[0] for result in results)
+    n_trees = sum(result[1] for result in results)
+    importances = increases / max(n_trees, 1)
+    return importances.mean(axis=0), importances.std(axis=0)
@@ -0,0 +1,218 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Regression.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module fits simple linear regressions (Y = a * X + b) of a response
+# (in-situ Chl-a) on many candidate predictor columns at once.
+# - batched_ols fits every predictor column of every table in one vectorized
+#   closed-form pass, using the pairwise-complete rows of each column, and
+#   reports a (slope), b (intercept), r2, RMSE, MAE, bias and n.
+# - cross_validate reports the leave-one-out (LOO) and seeded k-fold CV-RMSE
+#   and CV-R2 of the same fits. LOO uses the closed-form hat-matrix shortcut
+#   (e_i / (1 - h_ii), h_ii = 1/n + (x_i - mean_x)^2 / Sxx) and k-fold obtains
+#   each training fit by subtracting the held-out fold's sums from the full sums,
+#   so neither needs a refit per left-out row or fold. leave_one_out computes
+#   the LOO metrics alone.
+# - stack_tables pads tables with different numbers of rows into one array so
+#   that several files can be fitted in the same pass.
+# ----------------------------------------------------------------------------
+# Dependencies: numpy
+# ----------------------------------------------------------------------------
+# Notes:
+# - With log_response=True the model is fitted to log10(Y) (rows with Y <= 0 are
+#   left out). r2 refers to the fitted (log) space, while RMSE, MAE and bias are
+#   computed on the back-transformed Chl-a values.
+# - bias is the mean of (modeled - measured).
+# - CV-RMSE is in the same units as RMSE and CV-R2 = 1 - PRESS / Syy is in the
+#   fitted space, like r2.
+# - The k-fold split assigns the rows of each table with a valid response to
+#   folds in a seeded random order, so a given seed always gives the same folds.
+# - Fits with fewer than two pairs or a constant predictor are NaN.
+# ----------------------------------------------------------------------------
+import numpy as np
+
+# Function to pad a list of (response, predictors) tables with NaN rows into arrays of shape (tables, rows) and (tables, rows, columns)
+def stack_tables(tables):
+    n_rows = max(len(response) for response, _ in tables)
+    n_columns = tables[0][1].shape[1]
+    responses = np.full((len(tables), n_rows), np.nan)
+    predictors = np.full((len(tables), n_rows, n_columns), np.nan)
+    for i, (response, table_predictors) in enumerate(tables):
+        responses[i, :len(response)] = response
+        predictors[i, :len(response)] = table_predictors
+    return responses, predictors
+
+# Function to compute the valid rows, the fitted response and the centered sums of every column pair
+def _fit_sums(response, predictors, log_response=False):
+    response = np.asarray(response, dtype=float)
+    predictors = np.asarray(predictors, dtype=float)
+    if predictors.ndim == response.ndim:
+        predictors = predictors[..., np.newaxis]
+
+    # Rows are valid for a predictor column when neither the response nor the predictor value is NaN
+    valid = ~np.isnan(predictors) & ~np.isnan(response)[..., np.newaxis]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if log_response:
+            valid &= (response > 0)[..., np.newaxis]
+            fitted_response = np.log10(np.where(response > 0, response, np.nan))
+        else:
+            fitted_response = response
+
+    n = valid.sum(axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.where(valid, predictors, 0.0)
+        y = np.where(valid, fitted_response[..., np.newaxis], 0.0)
+        mean_x = x.sum(axis=-2) / n
+        mean_y = y.sum(axis=-2) / n
+        dx = np.where(valid, x - mean_x[..., np.newaxis, :], 0.0)
+        dy = np.where(valid, y - mean_y[..., np.newaxis, :], 0.0)
+
+    sums = {
+        "n": n,
+        "mean_x": mean_x,
+        "mean_y": mean_y,
+        "sxx": (dx * dx).sum(axis=-2),
+        "syy": (dy * dy).sum(axis=-2),
+        "sxy": (dx * dy).sum(axis=-2),
+    }
+    return valid, predictors, response, sums
+
+# Function to fit Y = a * X + b for every predictor column (response: (..., rows), predictors: (..., rows, columns))
+def batched_ols(response, predictors, log_response=False):
+    valid, predictors, response, sums = _fit_sums(response, predictors, log_response)
+    n = sums["n"]
+    fittable = (n >= 2) & (sums["sxx"] > 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Closed-form slope, intercept and coefficient of determination
+        slope = np.where(fittable, sums["sxy"] / sums["sxx"], np.nan)
+        intercept = sums["mean_y"] - slope * sums["mean_x"]
+        r2 = np.where(fittable & (sums["syy"] > 0), sums["sxy"] ** 2 / (sums["sxx"] * sums["syy"]), np.nan)
+
+        # Model the response on the valid rows (back-transformed in log mode)
+        modeled = slope[..., np.newaxis, :] * predictors + intercept[..., np.newaxis, :]
+        if log_response:
+            modeled = 10.0 ** modeled
+        errors = np.where(valid, modeled - response[..., np.newaxis], 0.0)
+
+        rmse = np.sqrt((errors ** 2).sum(axis=-2) / n)
+        mae = np.abs(errors).sum(axis=-2) / n
+        bias = errors.sum(axis=-2) / n
+
+    return {
+        "a": slope,
+        "b": intercept,
+        "r2": r2,
+        "RMSE": np.where(fittable, rmse, np.nan),
+        "MAE": np.where(fittable, mae, np.nan),
+        "Bias": np.where(fittable, bias, np.nan),
+        "n": n,
+    }
+
+# Function to compute the prediction-error metrics from the held-out predictions (in the fitted space)
+def _cv_metrics(held_out, valid, response, sums, log_response):
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        fitted_response = np.log10(np.where(response > 0, response, np.nan)) if log_response else response
+        residuals = np.where(valid, fitted_response[..., np.newaxis] - held_out, 0.0)
+        press = (residuals ** 2).sum(axis=-2)
+        defined = np.isfinite(np.where(valid, held_out, 0.0)).all(axis=-2) & (sums["n"] >= 3)
+
+        # RMSE in the same units as batched_ols (back-transformed in log mode)
+        if log_response:
+            errors = np.where(valid, 10.0 ** held_out - response[..., np.newaxis], 0.0)
+            rmse = np.sqrt((errors ** 2).sum(axis=-2) / sums["n"])
+        else:
+            rmse = np.sqrt(press / sums["n"])
+        r2 = np.where(sums["syy"] > 0, 1.0 - press / sums["syy"], np.nan)
+
+    return np.where(defined, rmse, np.nan), np.where(defined, r2, np.nan)
+
+# Function to assign the valid-response rows of every table to k folds in a seeded random order
+def fold_labels(response, n_folds=10, seed=42):
+    response = np.asarray(response, dtype=float)
+    labels = np.full(response.shape, -1)
+    flat_response = response.reshape(-1, response.shape[-1])
+    flat_labels = labels.reshape(-1, response.shape[-1])
+    rng = np.random.default_rng(seed)
+    for i in range(flat_response.shape[0]):
+        rows = np.flatnonzero(~np.isnan(flat_response[i]))
+        flat_labels[i, rng.permutation(rows)] = np.arange(len(rows)) % n_folds
+    return labels
+
+# Function to compute the centered values and the leave-one-out predictions of every valid row (in the fitted space)
+def _loo_held_out(valid, predictors, response, sums, log_response):
+    n = sums["n"][..., np.newaxis, :]
+    mean_x = sums["mean_x"][..., np.newaxis, :]
+    mean_y = sums["mean_y"][..., np.newaxis, :]
+    sxx = sums["sxx"][..., np.newaxis, :]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fitted_response = np.log10(np.where(response > 0, response, np.nan)) if log_response else response
+        dx = np.where(valid, predictors - mean_x, 0.0)
+        dy = np.where(valid, fitted_response[..., np.newaxis] - mean_y, 0.0)
+
+        # The deleted residual is the ordinary residual divided by (1 - leverage)
+        slope = sums["sxy"][..., np.newaxis, :] / sxx
+        residuals = dy - slope * dx
+        leverage = 1.0 / n + dx ** 2 / sxx
+        held_out = np.where(valid, fitted_response[..., np.newaxis] - residuals / (1.0 - leverage), np.nan)
+    return held_out, dx, dy
+
+# Function to compute the LOO CV-RMSE and CV-R2 of every predictor column (without the k-fold pass)
+def leave_one_out(response, predictors, log_response=False):
+    valid, predictors, response, sums = _fit_sums(response, predictors, log_response)
+    held_out, _, _ = _loo_held_out(valid, predictors, response, sums, log_response)
+    loo_rmse, loo_r2 = _cv_metrics(held_out, valid, response, sums, log_response)
+    return {
+        "LOO CV-RMSE": loo_rmse,
+        "LOO CV-R2": loo_r2,
+    }
+
+# Function to compute the LOO and k-fold CV-RMSE and CV-R2 of every predictor column in one vectorized pass
+def cross_validate(response, predictors, log_response=False, n_folds=10, seed=42):
+    valid, predictors, response, sums = _fit_sums(response, predictors, log_response)
+    mean_y = sums["mean_y"][..., np.newaxis, :]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Leave-one-out
+        loo_held_out, dx, dy = _loo_held_out(valid, predictors, response, sums, log_response)
+        loo_rmse, loo_r2 = _cv_metrics(loo_held_out, valid, response, sums, log_response)
+
+        # k-fold: the training sums of each fold are the full sums minus the sums of the held-out rows
+        labels = fold_labels(response, n_folds, seed)
+        membership = (labels[..., np.newaxis] == np.arange(n_folds)).astype(float)
+        masked = valid.astype(float)
+
+        def fold_sums(values):
+            return np.einsum("...rk,...rc->...kc", membership, values)
+
+        fold_n = fold_sums(masked)
+        fold_x = fold_sums(dx)
+        fold_y = fold_sums(dy)
+        train_n = sums["n"][..., np.newaxis, :] - fold_n
+        train_x = -fold_x
+        train_y = -fold_y
+        train_xx = sums["sxx"][..., np.newaxis, :] - fold_sums(dx * dx)
+        train_xy = sums["sxy"][..., np.newaxis, :] - fold_sums(dx * dy)
+
+        # Training fits (on rows centred at the full means) for every fold and column
+        train_sxx = train_xx - train_x ** 2 / train_n
+        train_slope = np.where((train_n >= 2) & (train_sxx > 0), (train_xy - train_x * train_y / train_n) / train_sxx, np.nan)
+        train_intercept = train_y / train_n - train_slope * train_x / train_n
+
+        # Predict every row from the fit of the fold that held it out
+        row_folds = np.broadcast_to(np.clip(labels, 0, None)[..., np.newaxis], dx.shape)
+        row_slope = np.take_along_axis(train_slope, row_folds, axis=-2)
+        row_intercept = np.take_along_axis(train_intercept, row_folds, axis=-2)
+        kfold_held_out = np.where(valid, mean_y + row_intercept + row_slope * dx, np.nan)
+        kfold_rmse, kfold_r2 = _cv_metrics(kfold_held_out, valid, response, sums, log_response)
+
+    return {
+        "LOO CV-RMSE": loo_rmse,
+        "LOO CV-R2": loo_r2,
+        "k-Fold CV-RMSE": kfold_rmse,
+        "k-Fold CV-R2": kfold_r2,
+    }
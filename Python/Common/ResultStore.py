@@ -0,0 +1,211 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: ResultStore.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module holds the per-file output tables of the analysis scripts (one row
+# per file and column, with File Name, Satellite, Category, Header, Product,
+# Index and Index_Number labels and the metrics) in a compact form:
+# - Every label column is stored as integer codes into its own list of
+#   distinct values, and every metric column as one float array.
+# - Stores of several files are concatenated by remapping the codes, and rows
+#   are selected, matched (keyed update) and grouped on the integer codes
+#   instead of comparing strings.
+# - tensor gives a dense Satellite x Category x Product x Index array of a
+#   metric for direct slicing, and to_frame gives back the flat table.
+# ----------------------------------------------------------------------------
+# Dependencies: numpy, pandas, Common.KeyedUpdate
+# ----------------------------------------------------------------------------
+# Notes:
+# - to_frame returns the same columns, in the same order, with the same values
+#   and types as the table the store was built from (metrics given as objects,
+#   e.g. [None, 0.5, ...], come back as floats with NaN).
+# - metric_dtype=np.float32 halves the memory of the metrics, at the cost of
+#   their last digits.
+# - Label values are compared as in Common.KeyedUpdate when matching (e.g. the
+#   Index_Number "3" of an output equals the 3 of Merged3.xlsx).
+# ----------------------------------------------------------------------------
+import numpy as np
+
+from Common.KeyedUpdate import _normalize_key
+
+# Define the label columns of the output tables and the dimensions of the tensor view
+label_columns = ["File Name", "Satellite", "Category", "Header", "Product", "Index", "Index_Number"]
+tensor_dimensions = ["Satellite", "Category", "Product", "Index"]
+
+class ResultStore:
+    def __init__(self, columns, codes, categories, metrics, dtypes):
+        self.columns = list(columns)
+        self.codes = codes
+        self.categories = categories
+        self.metrics = metrics
+        self.dtypes = dtypes
+
+    # Function to build a store from a flat output table (the label columns are coded, the other columns are metrics)
+    @classmethod
+    def from_frame(cls, table, labels=None, metric_dtype=np.float64):
+        import pandas as pd
+
+        labels = label_columns if labels is None else labels
+        codes, categories, metrics, dtypes = {}, {}, {}, {}
+        for column in table.columns:
+            values = table[column]
+            numeric = pd.to_numeric(values, errors="coerce") if column not in labels else None
+
+            # Columns that are not numbers (or are labels) are coded by their distinct values
+            if numeric is None or numeric.notna().sum() != values.notna().sum():
+                column_codes, column_categories = pd.factorize(values.astype(object), use_na_sentinel=True)
+                codes[column] = column_codes.astype(np.int32)
+                categories[column] = pd.Index(column_categories, dtype=object)
+                dtypes[column] = values.dtype
+            else:
+                metrics[column] = numeric.to_numpy(dtype=metric_dtype)
+                dtypes[column] = values.dtype if pd.api.types.is_numeric_dtype(values) else np.dtype(np.float64)
+        return cls(table.columns, codes, categories, metrics, dtypes)
+
+    # Function to concatenate several stores (the union of their columns, as pandas.concat does)
+    @classmethod
+    def concat(cls, stores):
+        import pandas as pd
+
+        stores = list(stores)
+        columns = list(dict.fromkeys(column for store in stores for column in store.columns))
+        lengths = [len(store) for store in stores]
+        codes, categories, metrics, dtypes = {}, {}, {}, {}
+        for column in columns:
+            if any(column in store.codes for store in stores):
+                # Remap the codes of every store to the union of the distinct values
+                union = pd.Index(np.concatenate([np.asarray(store.categories[column], dtype=object)
+                                                 for store in stores if column in store.categories] or [np.empty(0, dtype=object)])).unique()
+                parts = []
+                for store, length in zip(stores, lengths):
+                    if column in store.codes:
+                        remap = np.append(union.get_indexer(store.categories[column]), -1).astype(np.int32)
+                        parts.append(remap[store.codes[column]])
+                    elif column in store.metrics:
+                        raise ValueError(f"Column {column} is a label in some stores and a metric in others.")
+                    else:
+                        parts.append(np.full(length, -1, dtype=np.int32))
+                codes[column] = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+                categories[column] = union
+                column_dtypes = {store.dtypes[column] for store in stores if column in store.dtypes}
+                dtypes[column] = column_dtypes.pop() if len(column_dtypes) == 1 else np.dtype(object)
+            else:
+                dtype = np.result_type(*[store.metrics[column].dtype for store in stores if column in store.metrics])
+                metrics[column] = np.concatenate([store.metrics[column] if column in store.metrics else np.full(length, np.nan, dtype=dtype)
+                                                  for store, length in zip(stores, lengths)])
+                column_dtypes = [store.dtypes[column] for store in stores if column in store.dtypes]
+                integer = all(pd.api.types.is_integer_dtype(dtype) for dtype in column_dtypes) and len(column_dtypes) == len(stores)
+                dtypes[column] = column_dtypes[0] if integer else np.dtype(np.float64)
+        return cls(columns, codes, categories, metrics, dtypes)
+
+    def __len__(self):
+        if self.codes:
+            return len(next(iter(self.codes.values())))
+        return len(next(iter(self.metrics.values()))) if self.metrics else 0
+
+    # Function to select rows by a boolean mask or an array of row positions
+    def take(self, rows):
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+        return ResultStore(self.columns, {column: codes[rows] for column, codes in self.codes.items()}, self.categories,
+                           {column: values[rows] for column, values in self.metrics.items()}, self.dtypes)
+
+    # Function to get the mask of the rows whose label in a column satisfies a condition (evaluated once per distinct value)
+    def label_mask(self, column, condition):
+        accepted = np.append(np.array([bool(condition(value)) for value in self.categories[column]], dtype=bool), False)
+        return accepted[self.codes[column]]
+
+    # Function to convert the store back to the flat table
+    def to_frame(self):
+        import pandas as pd
+
+        data = {}
+        for column in self.columns:
+            if column in self.codes:
+                values = pd.Series(np.append(np.asarray(self.categories[column], dtype=object), None)[self.codes[column]], dtype=object)
+                try:
+                    data[column] = values.astype(self.dtypes[column])
+                except (TypeError, ValueError):
+                    # Missing values cannot be cast back to an integer column
+                    data[column] = values
+            else:
+                values = self.metrics[column]
+                dtype = self.dtypes[column]
+                if pd.api.types.is_integer_dtype(dtype) and not np.isnan(values).any():
+                    values = values.astype(dtype)
+                elif values.dtype != np.float64:
+                    values = values.astype(np.float64)
+                data[column] = values
+        return pd.DataFrame(data, columns=self.columns)
+
+    # Function to compute one integer key per row from the codes of the key columns (-1 when a key value is missing)
+    def _row_keys(self, codes, sizes):
+        valid = np.all([column_codes >= 0 for column_codes in codes], axis=0) if codes else np.ones(0, dtype=bool)
+        keys = np.full(len(valid), -1, dtype=np.int64)
+        if valid.any():
+            keys[valid] = np.ravel_multi_index([column_codes[valid] for column_codes in codes], sizes)
+        return keys
+
+    # Function to find, for every row of a target table, the position of its matching store row (-1 if there is none)
+    def match(self, target, key_columns, keep="first"):
+        import pandas as pd
+
+        source_codes, target_codes, sizes = [], [], []
+        for column in key_columns:
+            # Compare the distinct values as Common.KeyedUpdate does (e.g. "3" equals 3)
+            normalized = _normalize_key(pd.Series(self.categories[column], dtype=object))
+            normalized_codes, unique = pd.factorize(normalized, use_na_sentinel=True)
+            normalized_codes = np.append(normalized_codes, -1)
+            source_codes.append(normalized_codes[self.codes[column]])
+            target_codes.append(pd.Index(unique).get_indexer(_normalize_key(target[column].reset_index(drop=True))))
+            sizes.append(max(1, len(unique)))
+
+        # Keep one store row per key, so that duplicate keys resolve deterministically
+        source_keys = self._row_keys(source_codes, sizes)
+        positions = np.flatnonzero(source_keys >= 0)
+        unique_keys = ~pd.Index(source_keys[positions]).duplicated(keep=keep)
+        positions = positions[unique_keys]
+
+        target_keys = self._row_keys(target_codes, sizes)
+        found = pd.Index(source_keys[positions]).get_indexer(target_keys)
+        return np.where((found >= 0) & (target_keys >= 0), positions[np.maximum(found, 0)], -1)
+
+    # Function to update value_columns of the target rows with the values of their matching store rows (as keyed_update)
+    def update_frame(self, target, key_columns, value_columns, condition=None, keep="first"):
+        matches = self.match(target, key_columns, keep=keep)
+        hit = matches >= 0
+
+        # Apply the condition (a function of the matched rows returning a boolean mask)
+        matched_rows = self.take(matches[hit]).to_frame()
+        if condition is not None:
+            accepted = np.asarray(condition(matched_rows), dtype=bool)
+            matched_rows = matched_rows[accepted]
+            hit[np.flatnonzero(hit)[~accepted]] = False
+
+        # Write the values of the matched rows into the target rows
+        target_rows = target.index[hit]
+        for column in value_columns:
+            target.loc[target_rows, column] = matched_rows[column].to_numpy()
+
+        return target
+
+    # Function to get a dense array of a metric over the dimensions (first row of each cell; NaN for the cells without a row)
+    def tensor(self, metric, dimensions=None):
+        import pandas as pd
+
+        dimensions = tensor_dimensions if dimensions is None else dimensions
+        sizes = [len(self.categories[dimension]) for dimension in dimensions]
+        values = np.full(sizes, np.nan, dtype=self.metrics[metric].dtype)
+
+        keys = self._row_keys([self.codes[dimension] for dimension in dimensions], [max(1, size) for size in sizes])
+        rows = np.flatnonzero(keys >= 0)
+        rows = rows[~pd.Index(keys[rows]).duplicated(keep="first")]
+        if len(rows) and all(sizes):
+            values[tuple(self.codes[dimension][rows] for dimension in dimensions)] = self.metrics[metric][rows]
+        return values, [self.categories[dimension] for dimension in dimensions]
+
+    # Function to get the memory of the codes and metric arrays in bytes
+    def nbytes(self):
+        return sum(codes.nbytes for codes in self.codes.values()) + sum(values.nbytes for values in self.metrics.values())
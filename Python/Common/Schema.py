@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Schema.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module parses the column headers of the matchup tables once per header
+# row and shares the result between the stages:
+# - column_schema describes every column position with its Product (the
+#   processor prefix, e.g. ACOLITE), Index (the text after the last "_", e.g.
+#   I12 or B03), Index_Number (12 for I12), whether it is a band or an index
+#   column, and whether the header could be parsed. The text columns are
+#   categorical, so a wide header costs a few bytes per column.
+# - index_columns and feature_mask select the feature columns of a stage with
+#   vectorized masks on the schema, instead of scanning the header strings.
+# - parse_file_name gets the Satellite and Category of a Satellite x Category
+#   file name (e.g. Landsat8_All.xlsx).
+# ----------------------------------------------------------------------------
+# Dependencies: os, numpy, pandas
+# ----------------------------------------------------------------------------
+# Notes:
+# - Index columns are the headers containing "_I", as the scripts always
+#   selected them. Band columns are those whose Index starts with "B".
+# - Index_Number is kept as text (e.g. "12"), as it is written in the outputs.
+# - The schema of a header row is built once per process and reused by every
+#   file and stage with the same columns.
+# ----------------------------------------------------------------------------
+import os
+import numpy as np
+
+# Define the processors (column prefixes), the satellites (file name prefixes) and the categories (file name suffixes)
+product_prefixes = ["ACOLITE", "ATCOR", "C2RCC", "DOS1", "FLAASH", "iCOR", "Level1", "Level2", "Polymer", "QUAC"]
+satellite_prefixes = ["Landsat5", "Landsat7", "Landsat8", "Sentinel2"]
+category_names = ["All", "HH", "WLO", "AW", "SS", "EH", "OM"]
+
+# Schemas already built by this process, keyed by the header row
+_schemas = {}
+
+# Function to build the schema of a header row (one row per column position)
+def _build_schema(columns):
+    import pandas as pd
+
+    headers = pd.Series([str(column) for column in columns], dtype=object)
+
+    # Product: the first processor the header starts with
+    product = pd.Series(None, index=headers.index, dtype=object)
+    for prefix in reversed(product_prefixes):
+        product[headers.str.startswith(prefix).to_numpy()] = prefix
+
+    # Index: the text after the last "_", and Index_Number: the digits of an index like I12
+    has_underscore = headers.str.contains("_", regex=False).to_numpy()
+    index = headers.str.rsplit("_", n=1).str[-1].where(has_underscore, None)
+    numbered = index.str.match(r"^I\d+$").fillna(False).astype(bool).to_numpy()
+    index_number = index.str[1:].where(numbered, None)
+
+    return pd.DataFrame({
+        "Position": np.arange(len(headers)),
+        "Header": headers,
+        "Product": pd.Categorical(product, categories=product_prefixes),
+        "Index": pd.Categorical(index),
+        "Index_Number": pd.Categorical(index_number),
+        "Is_Band": index.str.startswith("B").fillna(False).astype(bool).to_numpy(),
+        "Is_Index": headers.str.contains("_I", regex=False).to_numpy(),
+        "Valid": product.notna().to_numpy() & has_underscore,
+    })
+
+# Function to get the schema of a header row (built once per process for each distinct header row)
+def column_schema(columns):
+    key = tuple(columns)
+    if key not in _schemas:
+        _schemas[key] = _build_schema(key)
+    return _schemas[key]
+
+# Function to get the mask of the index columns (headers containing "_I") from the first feature position on
+def feature_mask(columns, first_feature_index=16):
+    schema = column_schema(columns)
+    return schema["Is_Index"].to_numpy() & (schema["Position"].to_numpy() >= first_feature_index)
+
+# Function to select the index columns (headers containing "_I") from the first feature position on
+def index_columns(columns, first_feature_index=16):
+    import pandas as pd
+
+    return list(pd.Index(columns)[feature_mask(columns, first_feature_index)])
+
+# Function to get the Product, Index and Index_Number lists of some columns (None where a column has no such part)
+def column_parts(columns):
+    schema = column_schema(columns)
+    return [schema[part].astype(object).where(schema[part].notna(), None).tolist() for part in ["Product", "Index", "Index_Number"]]
+
+# Function to get the Satellite and Category of a Satellite x Category file name (None when they are not recognized)
+def parse_file_name(file_name):
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    satellite = next((prefix for prefix in satellite_prefixes if stem.startswith(prefix)), None)
+    category = next((name for name in category_names if stem.endswith("_" + name)), None)
+    return satellite, category
@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Subsets.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module derives the Satellite x Category subsets directly from AllData.xlsx.
+# - Loads every satellite sheet of AllData.xlsx once per process (through the
+#   on-disk cache of Common.Cache).
+# - Describes each category (All, HH, WLO, AW, SS, EH, OM) as a rule on one of
+#   the metadata columns and yields each subset as a boolean row mask and an
+#   array of row positions into the satellite table, without copying the data.
+# ----------------------------------------------------------------------------
+# Dependencies: os, numpy, Common.Cache
+# ----------------------------------------------------------------------------
+# Notes:
+# - The row positions follow the order of the pre-split input workbooks: the
+#   matching rows are stably sorted by the column of the rule (e.g. Autumn rows
+#   before Winter rows for AW).
+# - A new category only needs a new entry in category_rules.
+# ----------------------------------------------------------------------------
+import os
+import numpy as np
+
+from Common.Cache import file_hash, read_excel
+
+# Define the satellite sheets of AllData.xlsx and the default location of the workbook
+satellite_sheets = ["Landsat5", "Landsat7", "Landsat8", "Sentinel2"]
+all_data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "AllData.xlsx")
+
+# Define each category as (column, accepted values); None selects every row
+category_rules = {
+    "All": None,
+    "HH": ("Study_Area", ["HH"]),
+    "WLO": ("Study_Area", ["WLO"]),
+    "AW": ("Season", ["Autumn", "Winter"]),
+    "SS": ("Season", ["Spring", "Summer"]),
+    "EH": ("TSI_Class", ["Eutrophic", "Hypereutrophic"]),
+    "OM": ("TSI_Class", ["Oligotrophic", "Mesotrophic"]),
+}
+
+# Satellite tables already loaded by this process, keyed by (path, file hash, sheet)
+_tables = {}
+
+class Subset:
+    def __init__(self, satellite, category, data, mask, rows):
+        self.satellite = satellite
+        self.category = category
+        self.data = data
+        self.mask = mask
+        self.rows = rows
+
+    # The file name the subset had as a pre-split workbook (e.g. Landsat8_All.xlsx)
+    @property
+    def file_name(self):
+        return f"{self.satellite}_{self.category}.xlsx"
+
+    def __len__(self):
+        return len(self.rows)
+
+# Function to load one satellite sheet of AllData.xlsx (loaded once per process)
+def load_satellite(satellite, path=all_data_path):
+    key = (os.path.abspath(path), file_hash(path), satellite)
+    if key not in _tables:
+        _tables[key] = read_excel(path, sheet_name=satellite)
+    return _tables[key]
+
+# Function to compute the row mask and the ordered row positions of a category in a satellite table
+def category_rows(data, category):
+    rule = category_rules[category]
+    if rule is None:
+        mask = np.ones(len(data), dtype=bool)
+        return mask, np.arange(len(data))
+
+    column, values = rule
+    labels = data[column].to_numpy()
+    mask = np.isin(labels, values)
+
+    # Order the rows by the rule column (stable, so the sheet order is kept within each value)
+    rows = np.flatnonzero(mask)
+    rows = rows[np.argsort(labels[rows].astype(str), kind="stable")]
+    return mask, rows
+
+# Function to get one Satellite x Category subset
+def get_subset(satellite, category, path=all_data_path):
+    data = load_satellite(satellite, path)
+    mask, rows = category_rows(data, category)
+    return Subset(satellite, category, data, mask, rows)
+
+# Function to yield every Satellite x Category subset of AllData.xlsx
+def iterate_subsets(path=all_data_path, satellites=None, categories=None):
+    for category in categories or category_rules:
+        for satellite in satellites or satellite_sheets:
+            yield get_subset(satellite, category, path)
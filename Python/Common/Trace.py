@@ -0,0 +1,212 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Trace.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This module records where the time of a run goes, cheaply enough to be left on:
+# - traced_run wraps the main() of a script and writes a JSON trace of the run
+#   (<name>_trace.json) next to its outputs.
+# - span times a stage or a file (wall time and the peak resident memory of the
+#   process so far). Spans nest, and each span records its parent.
+# - count adds to named counters (rows, columns, NaN pairs dropped, ...), both
+#   for the whole run and for the span that is open.
+# - Optionally, the run is profiled with cProfile (the .prof file is written next
+#   to the trace and the top functions are listed in it) and the peak of the
+#   Python allocations of every span is traced with tracemalloc.
+# - Jobs run by Common.Parallel in worker processes send their spans and counters
+#   back with their results, so they appear in the trace of the run.
+# ----------------------------------------------------------------------------
+# Dependencies: os, sys, io, json, time, threading, cProfile, pstats, tracemalloc,
+#               contextlib, resource (optional, not available on Windows)
+# ----------------------------------------------------------------------------
+# Notes:
+# - Outside of traced_run, span and count do nothing.
+# - The trace is kept per thread, so runs in different threads (e.g. the stages of
+#   Pipeline.py) do not mix.
+# - tracemalloc and cProfile slow the run down; the spans and counters alone cost
+#   a few microseconds each.
+# ----------------------------------------------------------------------------
+import os
+import sys
+import io
+import json
+import time
+import threading
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Specify the number of functions of the cProfile summary in the trace
+profile_top_functions = 25
+
+# The trace of the run in each thread
+_local = threading.local()
+
+class Tracer:
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.origin = time.perf_counter()
+        self.origin_time = time.time()
+        self.spans = []
+        self.counters = {}
+        self.stack = []
+        self.next_id = 0
+
+    # Function to convert the trace to a dictionary (e.g. for json.dump)
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "pid": os.getpid(),
+            "counters": self.counters,
+            "spans": sorted(self.spans, key=lambda record: record["start"]),
+        }
+
+# Function to get the trace of the current thread (None when the run is not traced)
+def current():
+    return getattr(_local, "tracer", None)
+
+# Function to get the peak resident memory of the process in bytes (None when it is not available)
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+# Function to time a block as a span of the trace, with optional attributes (e.g. file=file_name)
+@contextmanager
+def span(name, **attributes):
+    tracer = current()
+    if tracer is None:
+        yield None
+        return
+
+    parent = tracer.stack[-1] if tracer.stack else None
+    record = {"id": tracer.next_id, "parent": parent["id"] if parent else None, "name": name,
+              "start": time.perf_counter() - tracer.origin}
+    if attributes:
+        record["attributes"] = attributes
+    tracer.next_id += 1
+
+    # Keep the peak of the allocations before this span for the parent, then measure this span from zero
+    if tracer.trace_memory:
+        if parent is not None:
+            parent["_peak"] = max(parent.get("_peak", 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    tracer.stack.append(record)
+    try:
+        yield record
+    finally:
+        tracer.stack.pop()
+        record["seconds"] = time.perf_counter() - tracer.origin - record["start"]
+        record["max_rss_bytes"] = _max_rss_bytes()
+        if tracer.trace_memory:
+            record["peak_traced_bytes"] = max(record.pop("_peak", 0), tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent["_peak"] = max(parent.get("_peak", 0), record["peak_traced_bytes"])
+        tracer.spans.append(record)
+
+# Function to add a value to a counter of the run and of the open span
+def count(name, value=1):
+    tracer = current()
+    if tracer is None:
+        return
+    tracer.counters[name] = tracer.counters.get(name, 0) + value
+    if tracer.stack:
+        counters = tracer.stack[-1].setdefault("counters", {})
+        counters[name] = counters.get(name, 0) + value
+
+# Function to add the spans and counters of a job run in a worker process to the trace of the current thread
+def merge(spans, counters, pid=None, origin_time=None):
+    tracer = current()
+    if tracer is None:
+        return
+    parent = tracer.stack[-1]["id"] if tracer.stack else None
+
+    # Renumber the spans after those of the trace and shift their start to the origin of the trace
+    offset = origin_time - tracer.origin_time if origin_time is not None else 0.0
+    ids = {record["id"]: tracer.next_id + i for i, record in enumerate(spans)}
+    for record in spans:
+        record = dict(record, id=ids[record["id"]], parent=ids.get(record["parent"], parent), pid=pid, start=record["start"] + offset)
+        tracer.spans.append(record)
+    tracer.next_id += len(spans)
+    for name, value in counters.items():
+        tracer.counters[name] = tracer.counters.get(name, 0) + value
+
+# Function to run function(*arguments) with its own trace (in a worker process) and return the result with the trace
+def traced_call(function, arguments, trace_memory=False):
+    tracer = Tracer(function.__name__, trace_memory)
+    previous = current()
+    _local.tracer = tracer
+    started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    try:
+        with span(function.__name__):
+            result = function(*arguments)
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _local.tracer = previous
+    return result, tracer.spans, tracer.counters, os.getpid(), tracer.origin_time
+
+# Function to write the trace (and the cProfile statistics) of a run to the output directory
+def write_trace(tracer, directory, profiler=None):
+    os.makedirs(directory, exist_ok=True)
+    trace = tracer.to_dict()
+
+    if profiler is not None:
+        profile_path = os.path.join(directory, f"{tracer.name}.prof")
+        profiler.dump_stats(profile_path)
+        stream = io.StringIO()
+        statistics = pstats.Stats(profiler, stream=stream)
+        trace["profile_path"] = profile_path
+        trace["profile"] = [
+            {"function": f"{file_name}:{line}({function_name})", "calls": calls, "total_seconds": total, "cumulative_seconds": cumulative}
+            for (file_name, line, function_name), (_, calls, total, cumulative, _) in
+            sorted(statistics.stats.items(), key=lambda item: -item[1][3])[:profile_top_functions]
+        ]
+
+    trace_path = os.path.join(directory, f"{tracer.name}_trace.json")
+    with open(trace_path, "w") as handle:
+        json.dump(trace, handle, indent=1, default=str)
+    return trace_path
+
+# Function to trace the run of a script and write its trace to the output directory when it ends
+@contextmanager
+def traced_run(name, directory, enabled=True, profile=False, trace_memory=False):
+    if not enabled:
+        yield None
+        return
+
+    tracer = Tracer(name, trace_memory)
+    previous = current()
+    _local.tracer = tracer
+    started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        with span(name):
+            yield tracer
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _local.tracer = previous
+        write_trace(tracer, directory, profiler)
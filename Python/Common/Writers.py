@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Writers.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description: 
+# This module writes output files off the critical path.
+# - BackgroundWriter runs write jobs (e.g. DataFrame.to_excel) on a background
+#   thread, so that the computation continues while a file is being encoded.
+# - OutputWriter writes the output tables of a script in one of four formats:
+#   "xlsx": one workbook per table, streamed row by row (openpyxl write-only mode).
+#   "workbook": one workbook (Outputs.xlsx) with a sheet per table.
+#   "parquet" or "csv": one file per table, for the scripts and tools downstream.
+# - read_output finds the output table of a file in any of these formats, so the
+#   Merge.py scripts read whatever the analysis scripts wrote. When a file has
+#   outputs in several formats, the configured format is read (or the newest
+#   output when no format is given) and a warning is printed.
+# ----------------------------------------------------------------------------
+# Dependencies: os, time, concurrent.futures, pandas, openpyxl, pyarrow (parquet
+#               format only), Common.Cache, Common.Trace
+# ----------------------------------------------------------------------------
+# Notes:
+# - The data handed to the writer must not be modified afterwards.
+# - close() waits for every pending write and raises the first error, if any.
+# - Write-only workbooks have the same values as DataFrame.to_excel, without the
+#   bold, bordered header.
+# - Sheet names are the file names without extension, cut to the 31 characters
+#   Excel allows. Writing some files to an existing single workbook keeps its
+#   other sheets.
+# ----------------------------------------------------------------------------
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Common.Cache import read_excel
+from Common.Trace import count
+
+# Define the output formats, the extension of their files and the name of the single workbook
+output_formats = {"xlsx": ".xlsx", "workbook": ".xlsx", "parquet": ".parquet", "csv": ".csv"}
+workbook_name = "Outputs.xlsx"
+
+# Sheet names of the workbooks already opened by this process, keyed by (path, modification time)
+_workbook_sheet_names = {}
+
+class BackgroundWriter:
+    def __init__(self, n_threads=1):
+        self._executor = ThreadPoolExecutor(max_workers=n_threads)
+        self._futures = []
+
+    # Function to queue a write job, e.g. submit(data.to_excel, path, index=False)
+    def submit(self, function, *args, **kwargs):
+        self._futures.append(self._executor.submit(function, *args, **kwargs))
+
+    # Function to wait for every queued write job
+    def close(self):
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+# Function to get the sheet name of a file in the single workbook
+def sheet_name(file_name):
+    return os.path.splitext(file_name)[0][:31]
+
+# Function to get the path the output table of a file is written to in an output format
+def output_path(directory, file_name, output_format="xlsx"):
+    if output_format not in output_formats:
+        raise ValueError(f"Unknown output format {output_format!r} (expected one of {', '.join(output_formats)}).")
+    if output_format == "workbook":
+        return os.path.join(directory, workbook_name)
+    return os.path.join(directory, os.path.splitext(file_name)[0] + output_formats[output_format])
+
+# Function to append a table to a write-only worksheet (header first, missing values as empty cells)
+def _append_rows(worksheet, table):
+    worksheet.append([str(column) for column in table.columns])
+    values = table.astype(object).where(table.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        worksheet.append(row)
+
+# Function to write a table to a workbook in openpyxl write-only mode (rows are streamed, not kept as cells)
+def write_xlsx(table, path, sheet="Sheet1"):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    _append_rows(workbook.create_sheet(sheet), table)
+    workbook.save(path)
+
+class OutputWriter(BackgroundWriter):
+    def __init__(self, directory, output_format="xlsx"):
+        # A single thread keeps the sheets of the single workbook in order
+        super().__init__(n_threads=1)
+        self.directory = directory
+        self.output_format = output_format
+        self.file_names = []
+        self.seconds = 0.0
+        self._workbook = None
+        output_path(directory, "", output_format)
+        os.makedirs(directory, exist_ok=True)
+
+    # Function to write one table on the background thread and return its path
+    def _write(self, file_name, table):
+        start = time.perf_counter()
+        path = output_path(self.directory, file_name, self.output_format)
+        if self.output_format == "xlsx":
+            write_xlsx(table, path)
+        elif self.output_format == "workbook":
+            if self._workbook is None:
+                from openpyxl import Workbook
+                self._workbook = Workbook(write_only=True)
+            _append_rows(self._workbook.create_sheet(sheet_name(file_name)), table)
+        elif self.output_format == "parquet":
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+        self.seconds += time.perf_counter() - start
+        return path
+
+    # Function to queue the output table of a file
+    def write(self, file_name, table):
+        self.file_names.append(file_name)
+        self.submit(self._write, file_name, table)
+
+    # Function to wait for every queued table, save the single workbook and count the files written
+    def close(self):
+        import pandas as pd
+
+        super().close()
+        if self._workbook is not None:
+            # Keep the sheets of an existing workbook that were not rewritten (e.g. after updating one file)
+            path = output_path(self.directory, "", "workbook")
+            if os.path.exists(path):
+                written = {sheet_name(file_name) for file_name in self.file_names}
+                with pd.ExcelFile(path) as existing:
+                    for sheet in existing.sheet_names:
+                        if sheet not in written:
+                            _append_rows(self._workbook.create_sheet(sheet), existing.parse(sheet))
+            self._workbook.save(path)
+            self._workbook = None
+        count("files_written", len(self.file_names))
+        count("write_seconds", self.seconds)
+        self.file_names = []
+
+# Function to get the sheet names of a workbook (read once per modification of the workbook)
+def _workbook_sheets(path):
+    import pandas as pd
+
+    stamp = (os.path.abspath(path), os.path.getmtime(path))
+    if stamp not in _workbook_sheet_names:
+        _workbook_sheet_names[stamp] = set(pd.ExcelFile(path).sheet_names)
+    return _workbook_sheet_names[stamp]
+
+# Function to find the output table of a file, returning (path, sheet name) or None: the output in output_format when
+# there is one, otherwise the most recently written output of any format
+def find_output(directory, file_name, output_format=None):
+    candidates = {}
+    for candidate_format in ["xlsx", "parquet", "csv"]:
+        path = output_path(directory, file_name, candidate_format)
+        if os.path.exists(path):
+            candidates[candidate_format] = (path, None)
+    path = os.path.join(directory, workbook_name)
+    if os.path.exists(path) and sheet_name(file_name) in _workbook_sheets(path):
+        candidates["workbook"] = (path, sheet_name(file_name))
+    if not candidates:
+        return None
+
+    if output_format in candidates:
+        chosen = output_format
+    else:
+        chosen = max(candidates, key=lambda candidate_format: os.path.getmtime(candidates[candidate_format][0]))
+    if len(candidates) > 1:
+        print(f"Warning: {file_name} has outputs in several formats ({', '.join(sorted(candidates))}); reading the {chosen} output.")
+    return candidates[chosen]
+
+# Function to read the output table of a file (skiprows as in pandas.read_excel; None if it does not exist), preferring output_format
+def read_output(directory, file_name, skiprows=None, output_format=None):
+    return read_found(find_output(directory, file_name, output_format), skiprows)
+
+# Function to read an output table found by find_output (None if it was not found)
+def read_found(found, skiprows=None):
+    import pandas as pd
+
+    if found is None:
+        return None
+    path, sheet = found
+    if path.endswith(".parquet"):
+        table = pd.read_parquet(path)
+        # Row 0 of the file is the header, so data row i is row i + 1
+        if skiprows:
+            table = table.drop(index=[row - 1 for row in skiprows if row > 0]).reset_index(drop=True)
+        return table
+    if path.endswith(".csv"):
+        return pd.read_csv(path, skiprows=skiprows)
+    if sheet is not None:
+        return read_excel(path, sheet_name=sheet, skiprows=skiprows)
+    return read_excel(path, skiprows=skiprows)
@@ -11,113 +11,310 @@
 # Excel file for each input file, containing the calculated metrics along with 
 # additional information such as Satellite, Category, Product, and Index.
 # ----------------------------------------------------------------------------
-# Dependencies: pandas, numpy, os
+# Dependencies: pandas, numpy, os, argparse, Common.Cache, Common.ChunkedCorrelation,
+#               Common.Correlation, Common.IncrementalCorrelation, Common.Memo, Common.Parallel, Common.Subsets,
+#               Common.Schema, Common.Trace, Common.Writers
 # ----------------------------------------------------------------------------
 # Input: 
 # - Multiple Excel files located in the specified input directory, each containing 
 #   data columns that will be correlated against a specified base column.
+# - Optionally, CSV or Parquet files with the same columns (e.g. pixel-level
+#   matchups too large for Excel or for memory), which are read in chunks of rows.
 # ----------------------------------------------------------------------------
 # Output: 
 # - Multiple Excel files saved in the specified output directory. Each output file 
 #   contains calculated correlation metrics and additional information for the 
 #   columns of the corresponding input file.
+# - With output_format = "workbook", a single Outputs.xlsx with one sheet per input
+#   file instead; with "parquet" or "csv", one Parquet or CSV file per input file.
+# - CorrelationAnalysis_trace.json: The time and memory of every step and file of the run,
+#   with counters of the rows, columns and dropped pairs (when write_trace is True).
+# ----------------------------------------------------------------------------
+# Notes:
+# - Files are processed concurrently by n_workers worker processes, largest
+#   files first. Each file writes its own output, so results do not depend on
+#   the number of workers.
+# - When all_data_path is set, the 28 Satellite x Category subsets are derived
+#   in memory from AllData.xlsx instead of being read from pre-split workbooks.
+# - New matchup rows can be appended to one file without a full recompute:
+#     python CorrelationAnalysis.py --append Landsat8_All.xlsx NewRows.xlsx
+#   The statistics are kept in Outputs/.state/. Appended rows are stored there,
+#   not in the input workbook, so a full run only sees the input workbooks.
+#   "--rebuild FILE_NAME" (or "--rebuild all") recomputes them from scratch.
+# - The output of every file is memoized in the cache (Common.Memo), keyed by its data and
+#   settings, so a rerun only recomputes the files that changed (reuse_results = False
+#   recomputes everything).
+# - With bootstrap_replicates > 0 (or --bootstrap N), the outputs also contain the
+#   percentile confidence intervals (r_low, r_high, rho_low, rho_high) and the
+#   two-sided bootstrap p-values (r_p, rho_p) of every target column. The
+#   replicates are seeded (bootstrap_seed), so reruns give the same values.
+# - CSV and Parquet input files are streamed in chunks of chunk_rows rows
+#   (Common.ChunkedCorrelation), so memory does not grow with the number of rows.
+#   Their output has the same columns and is named after the file (Landsat8_All.csv
+#   gives Landsat8_All.xlsx). n and r are exact; rho uses binned ranks (rank_bins
+#   per column) and is exact only when a column has few distinct values. These files
+#   are read three times, are not memoized and have no bootstrap columns. Parquet
+#   files need pyarrow.
+# - The output tables are written on a background thread (Common.Writers) while the
+#   next files are computed. Excel workbooks are streamed in write-only mode (plain
+#   header); Merge.py reads the outputs in any of the formats.
 # ----------------------------------------------------------------------------
 
-import pandas as pd
 import numpy as np
 import os
+import sys
+import argparse
+
+# Make the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Common.Cache import read_excel
+from Common.ChunkedCorrelation import file_correlation
+from Common.Correlation import bootstrap_correlation, pairwise_correlation
+from Common.IncrementalCorrelation import CorrelationState
+from Common.Memo import memoize
+from Common.Parallel import run_files, run_jobs
+from Common.Schema import column_parts, parse_file_name
+from Common.Subsets import get_subset, iterate_subsets
+from Common.Trace import count, span, traced_run
+from Common.Writers import OutputWriter
 
 # Specify the input and output directories
 input_directory = "C:\\Users\\PHYS3009\\Desktop\\CorrelationAnalysis\\Inputs\\"
 output_directory = "C:\\Users\\PHYS3009\\Desktop\\CorrelationAnalysis\\Outputs\\"
 
-# List all .xlsx files in the input directory
-input_files = [f for f in os.listdir(input_directory) if f.endswith('.xlsx')]
+# Specify the path of AllData.xlsx to derive the Satellite x Category subsets from it instead of reading the input files (None reads the input files)
+all_data_path = None
 
-# Define the prefixes and suffixes
-satellite_prefixes = ["Landsat5", "Landsat7", "Landsat8", "Sentinel2"]
-category_suffixes = ["All.xlsx", "HH.xlsx", "WLO.xlsx", "AW.xlsx", "SS.xlsx", "EH.xlsx", "OM.xlsx"]
-product_prefixes = ["ACOLITE", "ATCOR", "C2RCC", "DOS1", "FLAASH", "iCOR", "Level1", "Level2", "Polymer", "QUAC"]
+# Specify the input files to process, e.g. ["Landsat8_All.xlsx"] (None processes every file; with all_data_path, the subsets are named the same way)
+selected_files = None
 
-# Loop through each .xlsx file in the input directory
-for file_name in input_files:
-    input_file_path = os.path.join(input_directory, file_name)
+# Specify the number of files processed in parallel (None uses one worker process per core)
+n_workers = None
 
-    # Load the data from the Excel file
-    data = pd.read_excel(input_file_path)
+# Specify the number of bootstrap replicates for the confidence intervals and p-values of r and rho (0 disables the bootstrap)
+bootstrap_replicates = 0
+bootstrap_seed = 42
+bootstrap_confidence = 0.95
 
-    # Specify the base column index (0-indexed) and the target columns range (0-indexed)
-    base_column_index = 7
-    target_columns_range = range(16, len(data.columns))
+# Specify the output format: "xlsx" (one workbook per input file), "workbook" (one Outputs.xlsx with a sheet per input file), "parquet" or "csv"
+output_format = "xlsx"
 
-    # Initialize dictionaries to store the correlation coefficients, R^2, and count of available pairwise data points
-    r_values = {}
-    rho_values = {}
-    r2_values = {}
-    n_r_values = {}
-    n_rho_values = {}
-    
-    # Determine Satellite and Category based on file_name
-    satellite = next((prefix for prefix in satellite_prefixes if file_name.startswith(prefix)), None)
-    category = next((suffix[:-5] for suffix in category_suffixes if file_name.endswith(suffix)), None)
+# Specify the number of rows read at a time from CSV and Parquet input files, the number of rank bins per column and the number of sampled rows that place them (for rho)
+chunk_rows = 50000
+rank_bins = 1024
+rank_sample_rows = 10000
+rank_seed = 42
 
-    
-    # Extract the base column
+# Specify whether a JSON trace of the run (CorrelationAnalysis_trace.json) is written to the output directory, and whether the run is profiled with cProfile
+write_trace = True
+profile_run = False
+
+# Specify whether the outputs of unchanged data and settings are reused from the cache
+reuse_results = True
+
+# Cache stage of the correlation outputs (bump the version when a code change alters the results)
+memo_stage = "CorrelationAnalysis/1"
+
+# Specify the base column index (0-indexed) and the first target column index (0-indexed)
+base_column_index = 7
+first_target_column_index = 16
+
+# Function to compute the correlation metrics of one data table (optionally restricted to the rows in row_mask)
+def compute_correlations(file_name, data, row_mask=None, n_replicates=0):
+    # Extract the base column and the target columns
     base_column = data.iloc[:, base_column_index]
-    
-    # Initialize lists to store Product, Index, and Index_Number
-    product_list = []
-    index_list = []
-    index_number_list = []
-
-    # Calculate the correlation coefficients, R^2, and count of available pairwise data points for each target column
-    for i in target_columns_range:
-        column = data.columns[i]
-        
-        # Drop rows where either the base column or the target column contains NaN values
-        valid_data = data[[base_column.name, column]].dropna()
-        valid_base_column = valid_data[base_column.name]
-        valid_target_column = valid_data[column]
-        
-        # Calculate Pearson correlation coefficient and count of available pairwise data points
-        r = valid_base_column.corr(valid_target_column, method='pearson')
-        r_values[column] = r
-        n_r_values[column] = len(valid_base_column)
-        
-        # Calculate R^2
-        r2 = r ** 2
-        r2_values[column] = r2
-        
-        # Calculate Spearman rank correlation coefficient and count of available pairwise data points
-        rho = valid_base_column.corr(valid_target_column, method='spearman')
-        rho_values[column] = rho
-        n_rho_values[column] = len(valid_base_column)
-        
-        # Determine Product, Index, and Index_Number based on column header
-        product = next((prefix for prefix in product_prefixes if column.startswith(prefix)), None)
-        index = column.split('_')[-1] if '_' in column else None
-        index_number = index.lstrip('I') if index and index.startswith('I') and index[1:].isdigit() else None
-        
-        # Append to lists
-        product_list.append(product)
-        index_list.append(index)
-        index_number_list.append(index_number)
+    targets = data.iloc[:, first_target_column_index:]
+
+    # Reuse the output from the cache when the data, the rows and the settings are unchanged
+    settings = {"n_replicates": n_replicates, "bootstrap_seed": bootstrap_seed, "bootstrap_confidence": bootstrap_confidence}
+    parts = [file_name, base_column, targets, None if row_mask is None else np.asarray(row_mask, dtype=bool), settings]
+    return memoize(memo_stage, parts, lambda: correlate_columns(file_name, base_column, targets, row_mask, n_replicates),
+                   enabled=reuse_results)
+
+# Function to compute the correlation metrics between a base column and the target columns and build the output table
+def correlate_columns(file_name, base_column, targets, row_mask=None, n_replicates=0):
+    target_columns = targets.columns
+
+    # Calculate the correlation coefficients, R^2, and count of available pairwise data points for all target columns in one pass
+    base_values = base_column.to_numpy(dtype=float)
+    target_values = targets.to_numpy(dtype=float)
+    correlations = pairwise_correlation(base_values, target_values, row_mask=row_mask)
+
+    # Count the rows and columns processed and the pairs dropped because of a missing value
+    n_rows = len(base_values) if row_mask is None else int(np.count_nonzero(row_mask))
+    count("rows", n_rows)
+    count("columns", target_values.shape[1])
+    count("nan_pairs_dropped", int(n_rows * target_values.shape[1] - correlations['n'].sum()))
+
+    # Add the bootstrap confidence intervals and p-values of r and rho when requested
+    if n_replicates:
+        correlations.update(bootstrap_correlation(base_values, target_values, row_mask=row_mask, n_replicates=n_replicates,
+                                                  seed=bootstrap_seed, confidence=bootstrap_confidence))
+
+    return build_output(file_name, base_column.name, target_columns, correlations)
+
+# Function to build the output table of one file from the correlation metrics of its target columns
+def build_output(file_name, base_column_name, target_columns, correlations):
+    import pandas as pd
+
+    # Determine Satellite and Category based on file_name
+    satellite, category = parse_file_name(file_name)
+
+    # Look up Product, Index, and Index_Number of the target columns in the column schema
+    product_list, index_list, index_number_list = column_parts(target_columns)
     
     # Create output DataFrame with the calculated values and additional columns
     output_data = pd.DataFrame({
-        'File Name': [file_name] + [file_name] * len(data.columns[target_columns_range]),
-        'Satellite': [satellite] + [satellite] * len(data.columns[target_columns_range]),
-        'Category': [category] + [category] * len(data.columns[target_columns_range]),
-        'Header': [base_column.name] + list(data.columns[target_columns_range]),
+        'File Name': file_name,
+        'Satellite': satellite,
+        'Category': category,
+        'Header': [base_column_name] + list(target_columns),
         'Product': [None] + product_list,
         'Index': [None] + index_list,
         'Index_Number': [None] + index_number_list,
-        'r': [r_values.get(base_column.name, None)] + [r_values.get(col, None) for col in data.columns[target_columns_range]],
-        'rho': [rho_values.get(base_column.name, None)] + [rho_values.get(col, None) for col in data.columns[target_columns_range]],
-        'r2': [r2_values.get(base_column.name, None)] + [r2_values.get(col, None) for col in data.columns[target_columns_range]],
-        'n': [n_rho_values.get(base_column.name, None)] + [n_rho_values.get(col, None) for col in data.columns[target_columns_range]],
+        'r': [None] + list(correlations['r']),
+        'rho': [None] + list(correlations['rho']),
+        'r2': [None] + list(correlations['r2']),
+        'n': [None] + list(correlations['n']),
     })
 
-    # Save the output DataFrame to an Excel file in the output directory
-    output_file_path = os.path.join(output_directory, file_name)
-    output_data.to_excel(output_file_path, header=True, index=False)
+    # Append the bootstrap columns when they were computed
+    for metric in ['r_low', 'r_high', 'r_p', 'rho_low', 'rho_high', 'rho_p']:
+        if metric in correlations:
+            output_data[metric] = [None] + list(correlations[metric])
+
+    return output_data
+
+# Function to compute the correlation metrics for one input file, returning its file name and output table
+def process_file(file_name, input_directory, n_replicates=0):
+    input_file_path = os.path.join(input_directory, file_name)
+
+    # Load the data from the Excel file (through the on-disk cache)
+    with span("read_excel", file=file_name):
+        data = read_excel(input_file_path)
+    with span("correlation", file=file_name):
+        output_data = compute_correlations(file_name, data, n_replicates=n_replicates)
+
+    return file_name, output_data
+
+# Function to compute the correlation metrics for one CSV or Parquet input file in chunks of rows, returning its file name and output table
+def process_chunked_file(file_name, input_directory):
+    input_file_path = os.path.join(input_directory, file_name)
+    output_file_name = os.path.splitext(file_name)[0] + ".xlsx"
+
+    with span("chunked_correlation", file=file_name):
+        base_column_name, target_columns, correlations = file_correlation(input_file_path, base_column_index, first_target_column_index,
+                                                                          chunk_rows, rank_bins, rank_sample_rows, rank_seed)
+        count("columns", len(target_columns))
+        output_data = build_output(output_file_name, base_column_name, target_columns, correlations)
+
+    return output_file_name, output_data
+
+# Function to compute the correlation metrics for one Satellite x Category subset of AllData.xlsx, returning its file name and output table
+def process_subset(satellite, category, all_data_path, n_replicates=0):
+    # The subset is a row mask on the satellite table, so no data is copied
+    with span("load_subset", file=f"{satellite}_{category}.xlsx"):
+        subset = get_subset(satellite, category, all_data_path)
+    with span("correlation", file=subset.file_name):
+        output_data = compute_correlations(subset.file_name, subset.data, row_mask=subset.mask, n_replicates=n_replicates)
+
+    return subset.file_name, output_data
+
+# Function to get the directory holding the incremental statistics of one input file
+def state_directory(file_name):
+    return os.path.join(output_directory, ".state", os.path.splitext(file_name)[0])
+
+# Function to append new matchup rows to the statistics of one input file and update its output file
+def append_rows(file_name, new_rows_path):
+    directory = state_directory(file_name)
+
+    # Load the saved statistics, or build them from the input file on first use
+    if CorrelationState.exists(directory):
+        state = CorrelationState.load(directory)
+    else:
+        data = read_excel(os.path.join(input_directory, file_name))
+        base_column = data.iloc[:, base_column_index]
+        target_columns = data.columns[first_target_column_index:]
+        state = CorrelationState.create(directory, base_column.name, target_columns,
+                                        base_column.to_numpy(dtype=float), data[target_columns].to_numpy(dtype=float))
+
+    # Update the statistics with the new rows only
+    new_rows = read_excel(new_rows_path)
+    changed = state.append_frame(new_rows)
+
+    # Save the output DataFrame to the output directory
+    output_data = build_output(file_name, state.base_name, state.target_columns, state.results())
+    with OutputWriter(output_directory, output_format) as writer:
+        writer.write(file_name, output_data)
+
+    print(f"Appended {len(new_rows)} rows to {file_name} ({changed} target columns changed).")
+
+# Function to recompute the statistics of one input file (or "all") from every stored row and report the differences
+def rebuild_states(file_name):
+    if file_name == "all":
+        states_directory = os.path.join(output_directory, ".state")
+        file_names = sorted(name + ".xlsx" for name in os.listdir(states_directory)) if os.path.isdir(states_directory) else []
+    else:
+        file_names = [file_name]
+
+    for file_name in file_names:
+        state = CorrelationState.load(state_directory(file_name))
+        differences = state.rebuild()
+
+        # Save the output DataFrame to the output directory
+        output_data = build_output(file_name, state.base_name, state.target_columns, state.results())
+        with OutputWriter(output_directory, output_format) as writer:
+            writer.write(file_name, output_data)
+
+        print(f"Rebuilt {file_name}: " + ", ".join(f"{name} = {value:g}" for name, value in differences.items()))
+
+def main():
+    # Write every output table on a background thread as soon as it is computed
+    with traced_run("CorrelationAnalysis", output_directory, enabled=write_trace, profile=profile_run), \
+            OutputWriter(output_directory, output_format) as writer:
+        def write_output(result):
+            writer.write(*result)
+
+        # Derive the subsets from AllData.xlsx when it is specified, largest subsets first
+        if all_data_path:
+            subsets = [subset for subset in iterate_subsets(all_data_path) if selected_files is None or subset.file_name in selected_files]
+            jobs = [(subset.satellite, subset.category, all_data_path, bootstrap_replicates) for subset in subsets]
+            run_jobs(process_subset, jobs, n_workers=n_workers, sizes=[len(subset) for subset in subsets], on_result=write_output)
+            return
+
+        # List all .xlsx files in the input directory
+        input_files = sorted(f for f in os.listdir(input_directory) if f.endswith('.xlsx') and (selected_files is None or f in selected_files))
+
+        # Process the files in parallel, largest files first
+        run_files(process_file, input_directory, input_files, (input_directory, bootstrap_replicates), n_workers=n_workers, on_result=write_output)
+
+        # Stream the CSV and Parquet files in chunks of rows
+        chunked_files = sorted(f for f in os.listdir(input_directory)
+                               if f.endswith(('.csv', '.parquet')) and (selected_files is None or f in selected_files))
+        run_files(process_chunked_file, input_directory, chunked_files, (input_directory,), n_workers=n_workers, on_result=write_output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correlation analysis of the Satellite x Category input files.")
+    parser.add_argument("--append", nargs=2, metavar=("FILE_NAME", "NEW_ROWS_XLSX"),
+                        help="append the matchup rows of NEW_ROWS_XLSX to FILE_NAME and update its output incrementally")
+    parser.add_argument("--rebuild", metavar="FILE_NAME",
+                        help="recompute the incremental statistics of FILE_NAME (or 'all') from scratch and report the differences")
+    parser.add_argument("--bootstrap", type=int, metavar="N_REPLICATES",
+                        help="add bootstrap confidence intervals and p-values of r and rho with N_REPLICATES replicates")
+    parser.add_argument("--profile", action="store_true", help="profile the run with cProfile (saved next to the trace)")
+    parser.add_argument("--output-format", choices=["xlsx", "workbook", "parquet", "csv"], help="format of the output tables")
+    arguments = parser.parse_args()
+
+    if arguments.bootstrap is not None:
+        bootstrap_replicates = arguments.bootstrap
+    if arguments.profile:
+        profile_run = True
+    if arguments.output_format:
+        output_format = arguments.output_format
+
+    if arguments.append:
+        append_rows(*arguments.append)
+    elif arguments.rebuild:
+        rebuild_states(arguments.rebuild)
+    else:
+        main()
@@ -9,30 +9,59 @@
 # - Reads multiple Excel files from a specified directory in a predefined order.
 # - Merges the Excel files into a single data frame.
 # - Filters out rows from the merged data based on certain criteria.
-# - Updates values in one Excel file (Merged3.xlsx) using data from another 
-#   Excel file (Merged2.xlsx) if specific conditions are met.
+# - Loads another Excel file (Merged3.xlsx) and updates its rows from the matching
+#   rows of the filtered merged data (Merged2) if specific conditions are met.
 # - Outputs the merged and updated data to new Excel files in the same directory.
 # ----------------------------------------------------------------------------
-# Dependencies: os, pandas, numpy
+# Dependencies: os, Common.MergePipeline (pandas), Common.FigureData (numpy, scipy), Common.Trace
 # ----------------------------------------------------------------------------
 # Input: 
 # - Multiple Excel files located in the specified directory.
 # ----------------------------------------------------------------------------
 # Output: 
-# - Merged.xlsx: Excel file containing data merged from all input Excel files.
-# - Merged2.xlsx: Excel file containing merged data after filtering specific rows.
+# - Merged.xlsx: Excel file containing data merged from all input Excel files
+#   (only written when write_intermediates is True).
+# - Merged2.xlsx: Excel file containing merged data after filtering specific rows
+#   (only written when write_intermediates is True).
 # - Merged4.xlsx: Updated version of Merged3.xlsx based on data from Merged2.xlsx.
+# - Merged4_grids.mat, Merged4_grids.npz: The r2 grids of Rsquared_Heatmap.m (with
+#   the Avg row and column) and the r, rho and n grids of CorelationAnalysis.m,
+#   pivoted from Merged4.xlsx (one file per format in grid_formats; the .mat file
+#   is a MAT-file version 5).
+# - Merge_trace.json: The time and memory of each step of the run (when write_trace is True).
 # ----------------------------------------------------------------------------
 # Notes:
 # - Ensure the directory path and file order are correctly defined before executing.
+# - The merge, filter and update run in memory; the intermediate files are not read back.
 # ----------------------------------------------------------------------------
 import os
-import pandas as pd
-import numpy as np
+import sys
+
+# Make the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Common.FigureData import correlation_grids
+from Common.MergePipeline import run_merge
+from Common.Trace import traced_run
 
 # Define the directory containing the Excel files
 directory = r"C:\Users\PHYS3009\Desktop\CorrelationAnalysis\Outputs"
 
+# Specify whether the intermediate Merged.xlsx and Merged2.xlsx files are written (in the background)
+write_intermediates = False
+
+# Specify the format of the analysis outputs to read ("xlsx", "workbook", "parquet" or "csv"; None reads the newest output of each file)
+output_format = None
+
+# Specify the formats of the figure grids (".mat", ".npz" and/or ".h5"; an empty list writes none)
+grid_formats = [".mat", ".npz"]
+
+# Specify the number of files read in parallel (None uses one worker process per core)
+n_workers = None
+
+# Specify whether a JSON trace of the run (Merge_trace.json) is written to the directory, and whether the run is profiled with cProfile
+write_trace = True
+profile_run = False
+
 # Define the order of the files to be read and merged
 file_order = [
     "Landsat5_All.xlsx",
@@ -65,63 +94,16 @@ file_order = [
     "Sentinel2_OM.xlsx"
 ]
 
-# Initialize an empty list to hold the data frames
-dfs = []
-
-# Loop over each file in the specified order
-for file_name in file_order:
-    file_path = os.path.join(directory, file_name)
-    
-    # Check if the file exists
-    if os.path.exists(file_path):
-        # Read the Excel file, skipping the second row (index 1)
-        df = pd.read_excel(file_path, skiprows=[1])
-        dfs.append(df)
-    else:
-        print(f"{file_name} does not exist in the directory.")
-
-# Concatenate all the data frames into a single data frame
-merged_df = pd.concat(dfs, ignore_index=True)
-
-# Write the merged data frame to a new Excel file in the same directory
-output_file = os.path.join(directory, "Merged.xlsx")
-merged_df.to_excel(output_file, index=False)
-
-# Read the original merged file
-merged_df = pd.read_excel(os.path.join(directory, "Merged.xlsx"))
-
-# Filter out the rows where the "Index" column starts with 'B'
-filtered_df = merged_df[~merged_df['Index'].astype(str).str.startswith('B')]
-
-# Write the filtered data frame to a new Excel file in the same directory
-output_file = os.path.join(directory, "Merged2.xlsx")
-filtered_df.to_excel(output_file, index=False)
-
-# Load the Merged2.xlsx file
-merged2_file_path = os.path.join(directory, "Merged2.xlsx")
-merged2_df = pd.read_excel(merged2_file_path)
-
-# Load the Merged3.xlsx file
-merged3_file_path = os.path.join(directory, "Merged3.xlsx")
-merged3_df = pd.read_excel(merged3_file_path)
-
 # Define the columns on which to merge
 merge_columns = ["Satellite", "Category", "Product", "Index", "Index_Number"]
 
-# Iterate over each row in Merged3.xlsx
-for index, row in merged3_df.iterrows():
-    # Find the corresponding row in Merged2.xlsx
-    matched_row = merged2_df[(merged2_df[merge_columns] == row[merge_columns]).all(axis=1)]
-    
-    # If a matching row is found and the value of "n" is greater than 10, update the columns in Merged3.xlsx
-    if not matched_row.empty and matched_row.iloc[0]['n'] > 10:
-        merged3_df.at[index, 'r'] = matched_row.iloc[0]['r']
-        merged3_df.at[index, 'rho'] = matched_row.iloc[0]['rho']
-        merged3_df.at[index, 'r2'] = matched_row.iloc[0]['r2']
-        merged3_df.at[index, 'n'] = matched_row.iloc[0]['n']
-
-# Write the updated Merged3 data frame to a new Excel file in the same directory
-output_file = os.path.join(directory, "Merged4.xlsx")
-merged3_df.to_excel(output_file, index=False)
-
+def main():
+    with traced_run("Merge", directory, enabled=write_trace, profile=profile_run):
+        # Read the files (skipping the second row, index 1), merge and filter them, and update Merged3.xlsx
+        # from the first matching row if the value of "n" is greater than 10
+        run_merge(directory, file_order, merge_columns, ['r', 'rho', 'r2', 'n'], condition=lambda rows: rows['n'] > 10,
+                  skiprows=[1], write_intermediates=write_intermediates, n_workers=n_workers,
+                  output_format=output_format, build_grids=correlation_grids, grid_formats=grid_formats)
 
+if __name__ == "__main__":
+    main()
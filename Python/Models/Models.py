@@ -10,9 +10,18 @@
 # - For each file, it performs a linear regression on the first two columns.
 # - Appends the modeled Y values based on the regression coefficients to the data.
 # - Outputs the modified data to new Excel files in an output directory.
-# - Generates a report summarizing the regression results for each file.
+# - Generates a report summarizing the regression results for each file, with the
+#   leave-one-out and k-fold cross-validated RMSE and R2 of each regression.
+# - With --sweep, fits measured Chl-a on every candidate index column of the full
+#   matchup files (all files and columns in one batched pass) and reports a, b,
+#   r2, RMSE, MAE, bias, n and the cross-validated errors for each of them
+#   (--log fits log10(Chl-a)).
+# - With --search, ranks the top_k candidate models (index columns and band ratios,
+#   fitted to Chl-a or log10(Chl-a)) of every Satellite x Category matchup file by
+#   their LOO CV-R2, for choosing the product and index of the regressions.
 # ----------------------------------------------------------------------------
-# Dependencies: os, pandas, scipy.stats
+# Dependencies: os, argparse, pandas, scipy.stats (imported by the per-file regressions), Common.Cache, Common.Memo, Common.ModelSearch,
+#               Common.Regression, Common.Schema, Common.Trace, Common.Writers
 # ----------------------------------------------------------------------------
 # Input: 
 # - Multiple Excel files located in the specified input directory.
@@ -20,18 +29,75 @@
 # Output: 
 # - Modified Excel files with added "Modeled_Y" values in the output directory.
 # - Report.xlsx: A summary report of the regression results for each input file.
+# - Sweep.xlsx (Sweep_log.xlsx with --log): The fit of every candidate index column
+#   of every matchup file (with --sweep).
+# - Search.xlsx: The top_k models of every Satellite x Category matchup file, ranked by
+#   LOO CV-R2 (with --search).
+# - With output_format = "workbook", these tables are sheets of a single Outputs.xlsx
+#   instead; with "parquet" or "csv", they are Parquet or CSV files.
+# - Models_trace.json (Models_Sweep_trace.json with --sweep, Models_Search_trace.json with --search): The time and memory of every
+#   step and file of the run (when write_trace is True).
 # ----------------------------------------------------------------------------
 # Notes:
 # - Ensure the input directory path and output directory path are correctly defined before executing.
 # - This script assumes that the regression should be performed on the first two columns of each input file.
+# - Leave-one-out errors use the closed-form hat-matrix shortcut and k-fold errors use
+#   fixed seeded folds, so neither refits the regression per row or per fold.
+# - The sweep fits are memoized in the cache (Common.Memo), keyed by the data of each group of
+#   files and the settings, so an unchanged sweep is not refitted (reuse_results = False refits).
+# - The output tables are written on a background thread (Common.Writers) while the next
+#   files are fitted. Excel workbooks are streamed in write-only mode (plain header).
+# - The search only cross-validates the candidates whose r2 (an upper bound of their
+#   LOO CV-R2) can still enter the top_k, and only those with more than search_min_n pairs.
 # ----------------------------------------------------------------------------
 import os
-import pandas as pd
-from scipy.stats import linregress
+import sys
+import argparse
+
+# Make the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Common.Cache import read_excel
+from Common.Memo import memoize
+from Common.ModelSearch import candidate_features, search_models
+from Common.Regression import batched_ols, cross_validate, stack_tables
+from Common.Schema import index_columns, parse_file_name
+from Common.Trace import count, span, traced_run
+from Common.Writers import OutputWriter
+
+# Specify the input and output directories, and the directory of the full matchup files used by the sweep
+input_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\Models\\Inputs"
+output_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\Models\\Outputs"
+sweep_input_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\CorrelationAnalysis\\Inputs"
+
+# Specify the number of folds and the random seed of the k-fold cross-validation
+n_folds = 10
+cv_seed = 42
+
+# Specify the output format: "xlsx" (one workbook per table), "workbook" (one Outputs.xlsx with a sheet per table), "parquet" or "csv"
+output_format = "xlsx"
+
+# Specify whether a JSON trace of the run (Models_trace.json, Models_Sweep_trace.json) is written to the output directory, and whether the run is profiled with cProfile
+write_trace = True
+profile_run = False
+
+# Specify whether the sweep fits of unchanged data and settings are reused from the cache
+reuse_results = True
+
+# Specify the number of models kept per matchup file by the search, the minimum number of pairs
+# (candidates need more than search_min_n, as in Merge.py) and whether band ratios are searched
+top_k = 10
+search_min_n = 10
+search_band_ratios = True
+
+# Cache stages of the sweep fits and of the search (bump the version when a code change alters the results)
+memo_stage = "Models/Sweep/1"
+search_memo_stage = "Models/Search/1"
 
 def perform_regression_for_file(file_path):
+    from scipy.stats import linregress
+
     # Read the data
-    data = pd.read_excel(file_path)
+    data = read_excel(file_path)
     
     # Check if the data has at least two columns
     if len(data.columns) < 2:
@@ -53,41 +119,177 @@ def perform_regression_for_file(file_path):
 
     return slope, intercept, len(X), filtered_data
 
-def main():
-    input_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\Models\\Inputs"
-    output_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\Models\\Outputs"
-    
+# Function to fit and cross-validate every predictor column of a stacked group of files
+def fit_group(responses, predictors, log_response=False):
+    fits = batched_ols(responses, predictors, log_response=log_response)
+    fits.update(cross_validate(responses, predictors, log_response=log_response, n_folds=n_folds, seed=cv_seed))
+    return fits
+
+# Function to fit Chl-a on every candidate index column of every matchup file in one batched pass and write Sweep.xlsx
+def sweep_models(sweep_input_directory, output_directory, log_response=False, output_format="xlsx"):
+    import pandas as pd
+
+    # Specify the response column index (0-indexed) and the first candidate column index (0-indexed)
+    response_column_index = 7
+    first_candidate_column_index = 16
+
+    # Group the files by their columns so that each group is fitted in a single pass
+    groups = {}
+    for file_name in sorted(os.listdir(sweep_input_directory)):
+        if file_name.endswith('.xlsx'):
+            with span("read_excel", file=file_name):
+                data = read_excel(os.path.join(sweep_input_directory, file_name))
+            groups.setdefault(tuple(data.columns), []).append((file_name, data))
+
+    # Fit every candidate index column (headers containing "_I") of every file in the group at once
+    reports = []
+    for columns, files in groups.items():
+        candidates = index_columns(columns, first_candidate_column_index)
+        if not candidates:
+            continue
+        responses, predictors = stack_tables([(data.iloc[:, response_column_index].to_numpy(dtype=float),
+                                               data[candidates].to_numpy(dtype=float)) for _, data in files])
+        # Reuse the fits from the cache when the data of the group and the settings are unchanged
+        parts = [[file_name for file_name, _ in files], candidates, responses, predictors,
+                 {"log_response": log_response, "n_folds": n_folds, "cv_seed": cv_seed}]
+        with span("fit_group", files=len(files), columns=len(candidates)):
+            fits = memoize(memo_stage, parts, lambda: fit_group(responses, predictors, log_response), enabled=reuse_results)
+        count("regressions", len(files) * len(candidates))
+
+        # Collect one report row per file and candidate column
+        for i, (file_name, _) in enumerate(files):
+            report = pd.DataFrame({"File Name": file_name, "Header": candidates})
+            for metric, values in fits.items():
+                report[metric] = values[i]
+            reports.append(report)
+
+    # Generate the sweep report in the original file order and save it
+    sweep_df = pd.concat(reports, ignore_index=True).sort_values("File Name", kind="stable")
+    report_name = "Sweep_log.xlsx" if log_response else "Sweep.xlsx"
+    with OutputWriter(output_directory, output_format) as writer:
+        writer.write(report_name, sweep_df)
+    return sweep_df
+
+# Function to rank the top_k candidate models of every Satellite x Category matchup file and write Search.xlsx
+def search_best_models(sweep_input_directory, output_directory, output_format="xlsx"):
+    import pandas as pd
+
+    # Specify the response column index (0-indexed) and the first candidate column index (0-indexed)
+    response_column_index = 7
+    first_candidate_column_index = 16
+
+    rankings = []
+    for file_name in sorted(os.listdir(sweep_input_directory)):
+        if not file_name.endswith('.xlsx'):
+            continue
+        with span("read_excel", file=file_name):
+            data = read_excel(os.path.join(sweep_input_directory, file_name))
+        features = candidate_features(data.columns, first_candidate_column_index, band_ratios=search_band_ratios)
+        if features.empty:
+            continue
+        response = data.iloc[:, response_column_index].to_numpy(dtype=float)
+        values = data.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+
+        # Reuse the ranking from the cache when the data of the file and the settings are unchanged
+        parts = [file_name, list(data.columns), response, values,
+                 {"top_k": top_k, "min_n": search_min_n, "band_ratios": search_band_ratios}]
+        with span("search", file=file_name, candidates=len(features)):
+            ranking = memoize(search_memo_stage, parts, lambda: search_models(response, values, features, top_k, search_min_n),
+                              enabled=reuse_results)
+
+        satellite, category = parse_file_name(file_name)
+        ranking.insert(0, "File Name", file_name)
+        ranking.insert(1, "Satellite", satellite)
+        ranking.insert(2, "Category", category)
+        rankings.append(ranking)
+
+    search_df = pd.concat(rankings, ignore_index=True)
+    with OutputWriter(output_directory, output_format) as writer:
+        writer.write("Search.xlsx", search_df)
+    return search_df
+
+def search():
     # Ensure the output directory exists
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    # Prepare to collect results for the final report
-    results = []
+    with traced_run("Models_Search", output_directory, enabled=write_trace, profile=profile_run):
+        search_best_models(sweep_input_directory, output_directory, output_format=output_format)
+
+def sweep(log_response=False):
+    # Ensure the output directory exists
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    with traced_run("Models_Sweep", output_directory, enabled=write_trace, profile=profile_run):
+        sweep_models(sweep_input_directory, output_directory, log_response=log_response, output_format=output_format)
+
+def main():
+    import pandas as pd
+
+    # Write the output tables on a background thread while the next files are fitted
+    with traced_run("Models", output_directory, enabled=write_trace, profile=profile_run), \
+            OutputWriter(output_directory, output_format) as writer:
+
+        # Prepare to collect results and the regression data for the final report
+        results = []
+        tables = []
     
-    # Iterate over all Excel files in the input directory
-    for file_name in os.listdir(input_directory):
-        if file_name.endswith('.xlsx'):
-            file_path = os.path.join(input_directory, file_name)
+        # Iterate over all Excel files in the input directory
+        for file_name in os.listdir(input_directory):
+            if file_name.endswith('.xlsx'):
+                file_path = os.path.join(input_directory, file_name)
             
-            # Perform regression for the current file
-            a, b, n, modified_data = perform_regression_for_file(file_path)
+                # Perform regression for the current file
+                with span("regression", file=file_name):
+                    a, b, n, modified_data = perform_regression_for_file(file_path)
             
-            # If we got valid results, save the modified data and collect results for the report
-            if a is not None and b is not None and n is not None:
-                # Save the modified file to the output directory
-                modified_data.to_excel(os.path.join(output_directory, file_name), index=False)
+                # If we got valid results, save the modified data and collect results for the report
+                if a is not None and b is not None and n is not None:
+                    # Save the modified file to the output directory
+                    writer.write(file_name, modified_data)
+                    count("rows", n)
                 
-                # Collect results for the report
-                results.append({
-                    "File Name": file_name,
-                    "a": a,
-                    "b": b,
-                    "n": n
-                })
-
-    # Generate the final report and save it
-    report_df = pd.DataFrame(results)
-    report_df.to_excel(os.path.join(output_directory, "Report.xlsx"), index=False)
+                    # Collect results for the report
+                    results.append({
+                        "File Name": file_name,
+                        "a": a,
+                        "b": b,
+                        "n": n
+                    })
+                    tables.append((modified_data.iloc[:, 0].to_numpy(dtype=float), modified_data.iloc[:, [1]].to_numpy(dtype=float)))
+
+        # Generate the final report with the cross-validated errors of all files (computed in one pass) and save it
+        report_df = pd.DataFrame(results)
+        if tables:
+            with span("cross_validation"):
+                responses, predictors = stack_tables(tables)
+                for metric, values in cross_validate(responses, predictors, n_folds=n_folds, seed=cv_seed).items():
+                    report_df[metric] = values[:, 0]
+        writer.write("Report.xlsx", report_df)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Linear regressions of measured Chl-a on satellite indices.")
+    parser.add_argument("--sweep", action="store_true",
+                        help="fit every candidate index column of the full matchup files and write Sweep.xlsx")
+    parser.add_argument("--log", action="store_true", help="fit log10(Chl-a) instead of Chl-a in the sweep")
+    parser.add_argument("--search", action="store_true",
+                        help="rank the top-k models (index columns and band ratios) of every matchup file and write Search.xlsx")
+    parser.add_argument("--top-k", type=int, help="number of models kept per matchup file by the search")
+    parser.add_argument("--profile", action="store_true", help="profile the run with cProfile (saved next to the trace)")
+    parser.add_argument("--output-format", choices=["xlsx", "workbook", "parquet", "csv"], help="format of the output tables")
+    arguments = parser.parse_args()
+
+    if arguments.profile:
+        profile_run = True
+    if arguments.output_format:
+        output_format = arguments.output_format
+    if arguments.top_k:
+        top_k = arguments.top_k
+
+    if arguments.search:
+        search()
+    elif arguments.sweep:
+        sweep(log_response=arguments.log)
+    else:
+        main()
@@ -0,0 +1,315 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Pipeline.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This script runs the whole workflow as a graph of stages with declared
+# inputs and outputs:
+#   CorrelationAnalysis -> Merge -> copy Merged4.xlsx and its grids to the MATLAB heatmap folders -> MATLAB plots
+#   RFImportance        -> Merge -> copy Merged4.xlsx and its grids to the MATLAB barplot folder  -> MATLAB plots
+#   Models
+# - The directories come from a JSON configuration file (Pipeline.json next to
+#   this script by default) instead of the paths written in the scripts.
+# - A stage runs once all the stages it depends on are done. Independent
+#   branches run at the same time (up to max_parallel_stages).
+# - A stage is skipped when the content of its inputs and its settings are the
+#   same as in its last successful run and its outputs are unchanged since then.
+#   A stage that produces identical outputs does not cause its dependents to run.
+# ----------------------------------------------------------------------------
+# Dependencies: os, sys, json, shutil, hashlib, argparse, importlib, subprocess,
+#               concurrent.futures, Common.Writers (the scripts of the stages are imported when they run)
+# ----------------------------------------------------------------------------
+# Input:
+# - Pipeline.json: The directories of the stages (relative to the configuration file)
+#   and the pipeline settings.
+# ----------------------------------------------------------------------------
+# Output:
+# - The outputs of every stage, in the configured directories.
+# - .pipeline_state.json: The input and output hashes of the last successful run of
+#   every stage (next to the configuration file).
+# ----------------------------------------------------------------------------
+# Notes:
+# - Usage: python Pipeline.py [--config Pipeline.json] [--force] [--dry-run]
+# - --dry-run lists the stages that would run without running them. The stages that
+#   require one of them are listed too, without checking their inputs, since these
+#   would be rewritten first.
+# - Merged3.xlsx (the template of Merged4.xlsx) must exist in both output directories;
+#   a missing input stops the stage with an error and skips its dependents.
+# - The MATLAB stages only run when "matlab_command" is set in the configuration,
+#   e.g. "matlab -batch" (the script name is appended and it runs in its own folder).
+# - Content hashes are remembered per (size, modification time), so unchanged files
+#   are not read again on a rerun.
+# - "output_format" sets the format of the per-file outputs of the analysis scripts
+#   ("xlsx", "workbook", "parquet" or "csv", see Common.Writers). Merged4.xlsx is always
+#   an Excel workbook, since the MATLAB plots read it when Merged4_grids.mat is missing.
+# ----------------------------------------------------------------------------
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import importlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Make the scripts and the shared modules in this folder importable
+script_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_directory)
+from Common.Writers import output_path
+
+# Specify the default configuration file
+default_config_path = os.path.join(script_directory, "Pipeline.json")
+
+# Define the satellites and categories of the Satellite x Category files (used when they are derived from AllData.xlsx)
+satellites = ["Landsat5", "Landsat7", "Landsat8", "Sentinel2"]
+categories = ["All", "HH", "WLO", "AW", "SS", "EH", "OM"]
+
+class Stage:
+    def __init__(self, name, run, inputs, outputs, requires=(), settings=None, enabled=True):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        self.settings = settings or {}
+        self.enabled = enabled
+
+# Function to load the configuration and resolve its paths relative to the configuration file
+def load_config(config_path):
+    with open(config_path) as handle:
+        config = json.load(handle)
+
+    base = os.path.dirname(os.path.abspath(config_path))
+    for key, value in config.items():
+        if (key.endswith("_directory") or key.endswith("_path")) and isinstance(value, str):
+            config[key] = os.path.normpath(os.path.join(base, value))
+    config["state_path"] = os.path.join(base, ".pipeline_state.json")
+    return config
+
+# Function to list the .xlsx files of a directory (sorted, so that hashes do not depend on the listing order)
+def list_workbooks(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith(".xlsx") and not name.startswith("~$"))
+
+# Function to import a script of the workflow, point it to the configured directories and run its main()
+def run_script(module_name, **settings):
+    module = importlib.import_module(module_name)
+    for name, value in settings.items():
+        setattr(module, name, value)
+    module.main()
+
+# Function to copy a file to several destinations
+def copy_file(source, destinations):
+    for destination in destinations:
+        shutil.copyfile(source, destination)
+
+# Function to run a MATLAB script in its own folder with the configured command
+def run_matlab(command, script_path):
+    subprocess.run(command.split() + [f"run('{os.path.basename(script_path)}')"], cwd=os.path.dirname(script_path), check=True)
+
+# Function to build the stages of the workflow from the configuration
+def build_stages(config):
+    n_workers = config.get("n_workers") or max(1, (os.cpu_count() or 1) // max(1, config.get("max_parallel_stages", 2)))
+    all_data_path = config.get("all_data_path")
+    matlab_command = config.get("matlab_command")
+    matlab_directory = config["matlab_directory"]
+    output_format = config.get("output_format", "xlsx")
+    stages = []
+
+    # The output files of a stage (a single workbook holds the tables of every file)
+    def output_paths(directory, names):
+        return list(dict.fromkeys(output_path(directory, name, output_format) for name in names))
+
+    # The per-file stages read either the pre-split workbooks or AllData.xlsx
+    def split_files(input_directory):
+        if all_data_path:
+            return [all_data_path], [f"{satellite}_{category}.xlsx" for category in categories for satellite in satellites]
+        names = list_workbooks(input_directory)
+        return [os.path.join(input_directory, name) for name in names], names
+
+    for prefix, module, merge_module, plots in [
+        ("correlation", "CorrelationAnalysis.CorrelationAnalysis", "CorrelationAnalysis.Merge", ["Rsquared_Heatmap", "CorelationAnalysis"]),
+        ("rf_importance", "RFImportance.RFImportance", "RFImportance.Merge", ["RFImportance_Barplots"]),
+    ]:
+        input_directory = config[prefix + "_input_directory"]
+        output_directory = config[prefix + "_output_directory"]
+        inputs, names = split_files(input_directory)
+        outputs = output_paths(output_directory, names)
+        merged3 = os.path.join(output_directory, "Merged3.xlsx")
+        merged4 = os.path.join(output_directory, "Merged4.xlsx")
+        merged4_grids = os.path.join(output_directory, "Merged4_grids.mat")
+        published = [os.path.join(matlab_directory, plot, "Merged4.xlsx") for plot in plots]
+        published_grids = [os.path.join(matlab_directory, plot, "Merged4_grids.mat") for plot in plots]
+
+        # Per-file analysis, merge of its outputs into Merged4.xlsx and its figure grids, and copy of both to the MATLAB folders
+        stages.append(Stage(prefix, lambda module=module, input_directory=input_directory, output_directory=output_directory:
+                            run_script(module, input_directory=input_directory, output_directory=output_directory,
+                                       all_data_path=all_data_path, n_workers=n_workers, output_format=output_format),
+                            inputs, outputs, settings={"all_data_path": all_data_path, "output_format": output_format}))
+        stages.append(Stage(prefix + "_merge", lambda merge_module=merge_module, output_directory=output_directory:
+                            run_script(merge_module, directory=output_directory, n_workers=n_workers, grid_formats=[".mat"],
+                                       output_format=output_format),
+                            outputs + [merged3], [merged4, merged4_grids], requires=[prefix]))
+        stages.append(Stage(prefix + "_publish", lambda merged4=merged4, published=published, merged4_grids=merged4_grids,
+                            published_grids=published_grids: (copy_file(merged4, published), copy_file(merged4_grids, published_grids)),
+                            [merged4, merged4_grids], published + published_grids, requires=[prefix + "_merge"]))
+
+        # MATLAB plots (only when a MATLAB command is configured)
+        for plot in plots:
+            script_path = os.path.join(matlab_directory, plot, plot + ".m")
+            stages.append(Stage("matlab_" + plot, lambda script_path=script_path: run_matlab(matlab_command, script_path),
+                                [script_path, os.path.join(matlab_directory, plot, "Merged4.xlsx"),
+                                 os.path.join(matlab_directory, plot, "Merged4_grids.mat")], [],
+                                requires=[prefix + "_publish"], settings={"matlab_command": matlab_command},
+                                enabled=bool(matlab_command)))
+
+    # Linear regressions of the Models inputs
+    models_input_directory = config["models_input_directory"]
+    models_output_directory = config["models_output_directory"]
+    names = list_workbooks(models_input_directory)
+    stages.append(Stage("models", lambda: run_script("Models.Models", input_directory=models_input_directory,
+                                                     output_directory=models_output_directory, output_format=output_format),
+                        [os.path.join(models_input_directory, name) for name in names],
+                        output_paths(models_output_directory, names + ["Report.xlsx"]), settings={"output_format": output_format}))
+
+    return stages
+
+# Function to compute the SHA-1 hash of a file, reusing the stored hash when its size and modification time are unchanged
+def file_hash(path, known_hashes):
+    status = os.stat(path)
+    known = known_hashes.get(path)
+    if known and known[0] == status.st_size and known[1] == status.st_mtime_ns:
+        return known[2]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    known_hashes[path] = [status.st_size, status.st_mtime_ns, digest.hexdigest()]
+    return known_hashes[path][2]
+
+# Function to compute the signature of a stage from its settings and the content of its inputs
+def stage_signature(stage, known_hashes):
+    missing = [path for path in stage.inputs if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Stage {stage.name} is missing its inputs: " + ", ".join(missing))
+
+    digest = hashlib.sha1(json.dumps([stage.name, stage.settings], sort_keys=True, default=str).encode())
+    for path in stage.inputs:
+        digest.update(f"{path}|{file_hash(path, known_hashes)};".encode())
+    return digest.hexdigest()
+
+# Function to hash the outputs of a stage (None for an output that does not exist)
+def output_hashes(stage, known_hashes):
+    return {path: file_hash(path, known_hashes) if os.path.exists(path) else None for path in stage.outputs}
+
+# Function to load the state of the last runs
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return {"stages": {}, "files": {}}
+    with open(state_path) as handle:
+        return json.load(handle)
+
+# Function to save the state of the last runs (replacing the file at once)
+def save_state(state_path, state):
+    temporary_path = state_path + ".tmp"
+    with open(temporary_path, "w") as handle:
+        json.dump(state, handle, indent=1, sort_keys=True)
+    os.replace(temporary_path, state_path)
+
+# Function to run the stages in dependency order, concurrently where possible, skipping the up-to-date stages
+def run_pipeline(config, force=False, dry_run=False):
+    stages = {stage.name: stage for stage in build_stages(config)}
+    state = load_state(config["state_path"])
+    known_hashes = state["files"]
+    done = set()
+    failed = set()
+    running = {}
+    would_run = set()
+
+    # Function to decide whether a stage must run (returns its signature, or None when it is up to date)
+    def check(stage):
+        signature = stage_signature(stage, known_hashes)
+        last = state["stages"].get(stage.name)
+        if not force and last and last["signature"] == signature and last["outputs"] == output_hashes(stage, known_hashes):
+            return None
+        return signature
+
+    with ThreadPoolExecutor(max_workers=max(1, config.get("max_parallel_stages", 2))) as executor:
+        while len(done) + len(failed) < len(stages):
+            # Start every stage whose requirements are done
+            for name, stage in stages.items():
+                if name in done or name in failed or name in running:
+                    continue
+                if any(requirement in failed for requirement in stage.requires):
+                    print(f"Skipping {name}: a stage it requires failed.")
+                    failed.add(name)
+                    continue
+                if not all(requirement in done for requirement in stage.requires):
+                    continue
+                if not stage.enabled:
+                    done.add(name)
+                    continue
+                if dry_run and any(requirement in would_run for requirement in stage.requires):
+                    # The inputs of the stage would be rewritten first, so they are not checked
+                    print(f"{name} would run.")
+                    done.add(name)
+                    would_run.add(name)
+                    continue
+                try:
+                    signature = check(stage)
+                except FileNotFoundError as error:
+                    print(f"Error: {error}")
+                    failed.add(name)
+                    continue
+                if signature is None:
+                    print(f"{name} is up to date.")
+                    done.add(name)
+                elif dry_run:
+                    print(f"{name} would run.")
+                    done.add(name)
+                    would_run.add(name)
+                else:
+                    print(f"Running {name}...")
+                    running[name] = (executor.submit(stage.run), signature)
+
+            if not running:
+                continue
+
+            # Record the stages that finish
+            finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name, (future, signature) in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                try:
+                    future.result()
+                except Exception as error:
+                    print(f"Error: stage {name} failed ({error!r}).")
+                    failed.add(name)
+                    state["stages"].pop(name, None)
+                    continue
+                state["stages"][name] = {"signature": signature, "outputs": output_hashes(stages[name], known_hashes)}
+                done.add(name)
+                print(f"Finished {name}.")
+
+            if not dry_run:
+                save_state(config["state_path"], state)
+
+    if not dry_run:
+        save_state(config["state_path"], state)
+    return not failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workflow stages that are out of date.")
+    parser.add_argument("--config", default=default_config_path, help="configuration file (default: Pipeline.json next to this script)")
+    parser.add_argument("--force", action="store_true", help="run every stage, even the up-to-date ones")
+    parser.add_argument("--dry-run", action="store_true", help="only list the stages that would run")
+    arguments = parser.parse_args()
+
+    if not run_pipeline(load_config(arguments.config), force=arguments.force, dry_run=arguments.dry_run):
+        sys.exit(1)
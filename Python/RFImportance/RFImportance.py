@@ -8,112 +8,208 @@
 # This script performs the following tasks:
 # - Iterates over Excel files in a specified directory.
 # - For each file, it extracts feature columns based on certain criteria.
-# - Imputes missing values in these feature columns using the mean strategy.
-# - Trains a Random Forest Regressor using the imputed features.
+# - Imputes missing values in these feature columns using the mean strategy (or the median, or
+#   leaves them to the forest); the response is never imputed.
+# - Trains a Random Forest Regressor using the imputed features, adding trees in batches
+#   until the importance scores and their standard deviations converge.
 # - Extracts and computes the feature importance scores and standard deviations.
 # - Stores the extracted information along with derived data into a new Excel file.
 # ----------------------------------------------------------------------------
-# Dependencies: pandas, numpy, os, sklearn
+# Dependencies: pandas, os, argparse, sklearn, Common.Cache, Common.Forest, Common.Imputation, Common.Memo,
+#               Common.Parallel, Common.Permutation, Common.Schema, Common.Subsets, Common.Trace,
+#               Common.Writers
 # ----------------------------------------------------------------------------
 # Input: 
 # - Multiple Excel files located in the specified input directory.
 # ----------------------------------------------------------------------------
 # Output: 
 # - An Excel file for each input file, containing feature importance scores and other derived columns.
+#   With output_format = "workbook", a single Outputs.xlsx with one sheet per input file instead;
+#   with "parquet" or "csv", one Parquet or CSV file per input file.
+# - RFImportance_trace.json: The time and memory of every step and file of the run, with counters
+#   of the rows, features, imputed values and trees (when write_trace is True).
 # ----------------------------------------------------------------------------
 # Notes:
 # - Ensure the directory paths are correctly defined before executing.
 # - This script assumes specific naming conventions and file structures. Ensure input files adhere to these conventions.
+# - Files are processed concurrently by n_workers worker processes, largest files first,
+#   and each forest uses the remaining cores (n_jobs) so that the machine is not oversubscribed.
+# - When all_data_path is set, the 28 Satellite x Category subsets are derived in memory
+#   from AllData.xlsx instead of being read from pre-split workbooks.
+# - With permutation_repeats > 0 (or --permutation N), the outputs also contain the out-of-bag
+#   permutation importance (increase of the OOB mean squared error when a feature is shuffled)
+#   and its standard deviation over the repeats. It is less biased than the impurity-based score
+#   toward correlated indices with many distinct values.
+# - The importance table of every file is memoized in the cache (Common.Memo), keyed by the
+#   selected data slice and the settings, so a rerun only refits the forests of files whose
+#   data or settings changed (reuse_results = False refits everything). With store_models = True,
+#   the fitted forests are stored in the cache too.
+# - Heavy modules (pandas, sklearn) are imported by the functions that use them, here and in the
+#   shared modules, so importing this script (e.g. by Pipeline.py or Worker.py) is fast.
+# - Setting importance_tolerance = None and max_trees = 100 grows the same forest as a
+#   single RandomForestRegressor(n_estimators=100, random_state=42) fit.
+# - The output tables are written on a background thread (Common.Writers) while the next
+#   forests are grown. Excel workbooks are streamed in write-only mode (plain header).
+# - The features are copied once into a float32 matrix with the missing values filled in place
+#   (Common.Imputation). Rows without a Chl-a value are left out of the fit instead of being
+#   imputed. With imputation_scope = "dataset", the column statistics are computed once per
+#   satellite sheet of AllData.xlsx (or per input file) and shared by its subsets.
+# - The permutation and imputation settings are passed to the jobs explicitly, since worker
+#   processes started with spawn (the default on Windows and macOS) import this script again
+#   and do not see the values set by the command line.
 # ----------------------------------------------------------------------------
-import pandas as pd
-import numpy as np
 import os
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.impute import SimpleImputer
-
-# Function to derive "Product", "Index", and "Index_Number" from the feature name
-def get_product_index_and_number(feature_name):
-    # Find the position of the first "_"
-    underscore_pos = feature_name.find("_")
-    
-    # The substring before the first "_" is "Product"
-    product = feature_name[:underscore_pos]
-    
-    # The substring after "_I" is "Index"
-    index = feature_name[feature_name.rfind("_") + 1:]  # Extracts everything after the last "_"
-
-    # "Index_Number" is "Index" with the first character "I" removed
-    index_number = index.lstrip("I")  # Removes "I" from the beginning of the index
-    
-    return product, index, index_number
+import sys
+import argparse
+
+# Make the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Common.Cache import read_excel
+from Common.Forest import grow_forest
+from Common.Imputation import dataset_statistics, prepare_fit
+from Common.Memo import memoize, store_object
+from Common.Permutation import oob_permutation_importance
+from Common.Parallel import resolve_workers, run_files, run_jobs, threads_per_worker
+from Common.Schema import column_parts, index_columns, parse_file_name
+from Common.Subsets import get_subset, iterate_subsets
+from Common.Trace import count, span, traced_run
+from Common.Writers import OutputWriter
 
 # Specify the input and output directories
 input_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\RFImportance\\Inputs"
 output_directory = "C:\\Users\\alire\\OneDrive\\Desktop\\RFImportance\\Outputs"
 
-# List all .xlsx files in the input directory
-input_files = [f for f in os.listdir(input_directory) if f.endswith('.xlsx')]
+# Specify the path of AllData.xlsx to derive the Satellite x Category subsets from it instead of reading the input files (None reads the input files)
+all_data_path = None
 
-# Loop through each .xlsx file in the input directory
-for file_name in input_files:
-    input_file_path = os.path.join(input_directory, file_name)
+# Specify the input files to process, e.g. ["Landsat8_All.xlsx"] (None processes every file; with all_data_path, the subsets are named the same way)
+selected_files = None
+
+# Specify the number of files processed in parallel (None uses one worker process per core)
+n_workers = None
+
+# Specify how the forests are grown: batches of trees_per_batch trees are added until the importances change by less than
+# importance_tolerance between two batches (after at least min_trees trees), up to max_trees trees (None disables early stopping)
+trees_per_batch = 25
+min_trees = 50
+max_trees = 500
+importance_tolerance = 0.05
+
+# Specify how the missing feature values are filled: "mean" or "median" (of each column), or "native" (kept as NaN for the forest,
+# which handles them itself), and whether the statistics are computed per Satellite x Category subset ("subset", as SimpleImputer)
+# or once per dataset (a satellite sheet of AllData.xlsx, or an input file) and shared by its subsets ("dataset")
+imputation_strategy = "mean"
+imputation_scope = "subset"
+
+# Specify the number of shuffles of each feature for the out-of-bag permutation importance (0 disables the permutation importance)
+permutation_repeats = 0
+permutation_seed = 42
+
+# Specify the output format: "xlsx" (one workbook per input file), "workbook" (one Outputs.xlsx with a sheet per input file), "parquet" or "csv"
+output_format = "xlsx"
 
-    # Load the data from the Excel file
-    data = pd.read_excel(input_file_path)
+# Specify whether a JSON trace of the run (RFImportance_trace.json) is written to the output directory, and whether the run is profiled with cProfile
+write_trace = True
+profile_run = False
 
+# Specify whether the results of unchanged data and settings are reused from the cache, and whether the fitted forests are stored there too
+reuse_results = True
+store_models = False
+
+# Cache stage of the importance results (bump the version when a code change alters the results)
+memo_stage = "RFImportance/1"
+
+# Function to fit the Random Forest on one data table (optionally restricted to the row positions in rows) and compute the importance scores
+# (dataset_key names the dataset of the table for the shared column statistics, e.g. the path and sheet of AllData.xlsx)
+def compute_importance(file_name, data, rf_n_jobs=1, rows=None, n_repeats=0, dataset_key=None, imputation_strategy="mean",
+                       imputation_scope="subset"):
     # Specify the base column index (0-indexed) and the response variable
     base_column_index = 7
     response_variable = data.iloc[:, base_column_index]
 
-    # Select feature columns based on the condition (contains "_I" and from 17th to last column)
-    feature_columns = [col for col in data.columns[16:] if "_I" in col]
+    # Select feature columns based on the condition (contains "_I" and from 17th to last column) from the column schema
+    feature_columns = index_columns(data.columns, 16)
 
     # Check if any feature columns are selected
     if not feature_columns:
         print(f"Skipping {file_name} due to no selected feature columns.")
-        continue
+        return None
 
     # Select feature columns and response variable column
     selected_columns = feature_columns + [response_variable.name]
 
-    # Drop columns that have all NaN values
-    valid_data = data[selected_columns].dropna(axis=1, how='all')
+    # Select the rows of the subset, if any
+    valid_data = data[selected_columns]
+    if rows is not None:
+        valid_data = valid_data.iloc[rows]
+
+    # Compute the column statistics of the whole dataset once, when its subsets share them
+    statistics = None
+    if imputation_scope == "dataset" and imputation_strategy != "native":
+        with span("dataset_statistics", file=file_name):
+            statistics = dataset_statistics(dataset_key or file_name, data, feature_columns, response_variable.name, imputation_strategy)
+
+    # Reuse the results from the cache when the data slice, the statistics and the settings are unchanged
+    parts = [file_name, valid_data, statistics, model_settings(n_repeats, imputation_strategy, imputation_scope)]
+    return memoize(memo_stage, parts, lambda: fit_importance(file_name, valid_data, response_variable.name, rf_n_jobs, n_repeats, parts,
+                                                             statistics, imputation_strategy), enabled=reuse_results)
 
-    # Update feature_columns to only include columns that haven't been dropped
-    feature_columns = valid_data.columns.tolist()
-    feature_columns.remove(response_variable.name)
+# Function to collect the settings that the importance results depend on (the number of threads does not change them)
+def model_settings(n_repeats=0, imputation_strategy="mean", imputation_scope="subset"):
+    import sklearn
 
-    # Initialize the SimpleImputer with the strategy to impute missing values
-    imputer = SimpleImputer(strategy='mean')
+    return {
+        "trees_per_batch": trees_per_batch,
+        "min_trees": min_trees,
+        "max_trees": max_trees,
+        "importance_tolerance": importance_tolerance,
+        "random_state": 42,
+        "permutation_repeats": n_repeats,
+        "permutation_seed": permutation_seed,
+        "imputation_strategy": imputation_strategy,
+        "imputation_scope": imputation_scope,
+        "sklearn": sklearn.__version__,
+    }
 
-    # Apply the imputer to the selected columns
-    imputed_data = pd.DataFrame(imputer.fit_transform(valid_data), columns=valid_data.columns)
+# Function to impute the selected columns of one data table, fit the Random Forest and build the importance table
+def fit_importance(file_name, valid_data, response_name, rf_n_jobs=1, n_repeats=0, parts=None, statistics=None, imputation_strategy="mean"):
+    import pandas as pd
 
-    # Separate the imputed features and response variable
-    imputed_features = imputed_data[feature_columns]
-    imputed_response_variable = imputed_data[response_variable.name]
+    # Copy the feature columns with values into a float32 matrix and fill their missing values (rows without a response are left out)
+    feature_columns = [column for column in valid_data.columns if column != response_name]
+    with span("impute", file=file_name):
+        feature_columns, imputed_features, imputed_response_variable, n_missing = prepare_fit(
+            valid_data, feature_columns, response_name, strategy=imputation_strategy, statistics=statistics)
+    count("rows", len(imputed_response_variable))
+    count("rows_without_response", len(valid_data) - len(imputed_response_variable))
+    count("features", len(feature_columns))
+    count("missing_values", n_missing)
+    count("imputed_values", 0 if imputation_strategy == "native" else n_missing)
 
-    # Initialize the Random Forest Regressor
-    rf = RandomForestRegressor(n_estimators=100, random_state=42)
+    # Grow the Random Forest Regressor in batches of trees until the importances converge
+    with span("fit_forest", file=file_name):
+        rf, importance_moments = grow_forest(imputed_features, imputed_response_variable, n_jobs=rf_n_jobs, random_state=42,
+                                             batch_size=trees_per_batch, min_trees=min_trees, max_trees=max_trees,
+                                             tolerance=importance_tolerance)
+    count("trees", len(rf.estimators_))
 
-    # Fit the model to the imputed data using all selected features
-    rf.fit(imputed_features, imputed_response_variable)
+    # Keep the fitted forest in the cache next to the results when requested
+    if store_models and parts is not None:
+        store_object(memo_stage + "/model", parts, rf)
 
-    # Get the feature importance scores and standard deviations
+    # Get the feature importance scores and standard deviations (of the per-tree importances, accumulated while growing)
     importance_scores = dict(zip(feature_columns, rf.feature_importances_))
-    std_devs = dict(zip(feature_columns, np.std([tree.feature_importances_ for tree in rf.estimators_], axis=0)))
+    std_devs = dict(zip(feature_columns, importance_moments.std()))
 
-    # Derive additional columns
-    file_names = [file_name] * len(feature_columns)
-    satellites = ["Landsat5" if file_name.startswith("Landsat5") else "Landsat7" if file_name.startswith("Landsat7") else "Landsat8" if file_name.startswith("Landsat8") else "Sentinel2" for _ in feature_columns]
-    categories = [file_name.split("_")[-1].replace(".xlsx", "") for _ in feature_columns]
-    products, indices, index_numbers = zip(*[get_product_index_and_number(feature) for feature in feature_columns])
+    # Derive additional columns (Satellite and Category from the file name, Product, Index and Index_Number from the column schema)
+    satellite, category = parse_file_name(file_name)
+    products, indices, index_numbers = column_parts(feature_columns)
 
     # Create a DataFrame to store the results
     results_df = pd.DataFrame({
-        'File Name': file_names,
-        'Satellite': satellites,
-        'Category': categories,
+        'File Name': file_name,
+        'Satellite': satellite,
+        'Category': category,
         'Header': feature_columns,
         'Product': products,
         'Index': indices,
@@ -125,10 +221,105 @@ for file_name in input_files:
     # Reorder the columns
     results_df = results_df[['File Name', 'Satellite', 'Category', 'Header', 'Product', 'Index', 'Index_Number', 'Importance Score', 'Standard Deviation']]
 
-    # Save the results DataFrame to an Excel file in the output directory
-    output_file_path = os.path.join(output_directory, file_name)
-    results_df.to_excel(output_file_path, index=False)
-    
+    # Add the out-of-bag permutation importance when requested (the trees are shared between rf_n_jobs worker processes)
+    if n_repeats:
+        with span("permutation_importance", file=file_name):
+            permutation_scores, permutation_std_devs = oob_permutation_importance(rf, imputed_features, imputed_response_variable, n_repeats=n_repeats,
+                                                                                  seed=permutation_seed, n_workers=rf_n_jobs)
+        results_df['Permutation Importance'] = permutation_scores
+        results_df['Permutation Standard Deviation'] = permutation_std_devs
+
+    return results_df
+
+# Function to queue the importance scores of one file (a (file name, table) result, None for a skipped file) for writing
+def save_results(writer, result):
+    if result is None:
+        return
+    file_name, results_df = result
+    writer.write(file_name, results_df)
+
     print(f"Feature importance analysis completed for {file_name}.")
 
-print("Feature importance analysis completed for all files.")
+# Function to fit the Random Forest for one input file, returning its file name and importance scores
+def process_file(file_name, input_directory, rf_n_jobs=1, n_repeats=0, imputation_strategy="mean", imputation_scope="subset"):
+    input_file_path = os.path.join(input_directory, file_name)
+
+    # Load the data from the Excel file (through the on-disk cache)
+    with span("read_excel", file=file_name):
+        data = read_excel(input_file_path)
+    with span("importance", file=file_name):
+        results_df = compute_importance(file_name, data, rf_n_jobs, n_repeats=n_repeats, imputation_strategy=imputation_strategy,
+                                        imputation_scope=imputation_scope)
+    if results_df is None:
+        return None
+
+    return file_name, results_df
+
+# Function to fit the Random Forest for one Satellite x Category subset of AllData.xlsx, returning its file name and importance scores
+def process_subset(satellite, category, all_data_path, rf_n_jobs=1, n_repeats=0, imputation_strategy="mean", imputation_scope="subset"):
+    # Only the selected feature columns of the subset rows are copied, right before imputation
+    with span("load_subset", file=f"{satellite}_{category}.xlsx"):
+        subset = get_subset(satellite, category, all_data_path)
+    with span("importance", file=subset.file_name):
+        results_df = compute_importance(subset.file_name, subset.data, rf_n_jobs, rows=subset.rows, n_repeats=n_repeats,
+                                        dataset_key=(os.path.abspath(all_data_path), satellite), imputation_strategy=imputation_strategy,
+                                        imputation_scope=imputation_scope)
+    if results_df is None:
+        return None
+
+    return subset.file_name, results_df
+
+def main():
+    # Write every importance table on a background thread as soon as it is computed
+    with traced_run("RFImportance", output_directory, enabled=write_trace, profile=profile_run), \
+            OutputWriter(output_directory, output_format) as writer:
+        def write_output(result):
+            save_results(writer, result)
+
+        # Derive the subsets from AllData.xlsx when it is specified, largest subsets first
+        if all_data_path:
+            subsets = [subset for subset in iterate_subsets(all_data_path) if selected_files is None or subset.file_name in selected_files]
+            workers = resolve_workers(n_workers, len(subsets))
+            rf_n_jobs = threads_per_worker(workers)
+            jobs = [(subset.satellite, subset.category, all_data_path, rf_n_jobs, permutation_repeats, imputation_strategy, imputation_scope)
+                    for subset in subsets]
+            run_jobs(process_subset, jobs, n_workers=workers, sizes=[len(subset) for subset in subsets], on_result=write_output)
+            print("Feature importance analysis completed for all files.")
+            return
+
+        # List all .xlsx files in the input directory
+        input_files = sorted(f for f in os.listdir(input_directory) if f.endswith('.xlsx') and (selected_files is None or f in selected_files))
+
+        # Share the cores between the worker processes and the trees of each forest
+        workers = resolve_workers(n_workers, len(input_files))
+        rf_n_jobs = threads_per_worker(workers)
+
+        # Process the files in parallel, largest files first
+        run_files(process_file, input_directory, input_files,
+                  (input_directory, rf_n_jobs, permutation_repeats, imputation_strategy, imputation_scope), n_workers=workers,
+                  on_result=write_output)
+
+        print("Feature importance analysis completed for all files.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Random Forest feature importance of the Satellite x Category input files.")
+    parser.add_argument("--permutation", type=int, metavar="N_REPEATS",
+                        help="add the out-of-bag permutation importance with N_REPEATS shuffles of each feature")
+    parser.add_argument("--imputation", choices=["mean", "median", "native"], help="strategy for the missing feature values")
+    parser.add_argument("--imputation-scope", choices=["subset", "dataset"], help="compute the column statistics per subset or per dataset")
+    parser.add_argument("--profile", action="store_true", help="profile the run with cProfile (saved next to the trace)")
+    parser.add_argument("--output-format", choices=["xlsx", "workbook", "parquet", "csv"], help="format of the output tables")
+    arguments = parser.parse_args()
+
+    if arguments.permutation is not None:
+        permutation_repeats = arguments.permutation
+    if arguments.imputation:
+        imputation_strategy = arguments.imputation
+    if arguments.imputation_scope:
+        imputation_scope = arguments.imputation_scope
+    if arguments.profile:
+        profile_run = True
+    if arguments.output_format:
+        output_format = arguments.output_format
+
+    main()
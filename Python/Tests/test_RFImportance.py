@@ -0,0 +1,58 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: test_RFImportance.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This test checks that the imputation settings of RFImportance.py reach the
+# worker processes: the importance tables computed by a pool of spawned workers
+# (which import the script again, as on Windows) must be the same as the ones
+# computed in the current process with the same settings.
+# ----------------------------------------------------------------------------
+# Dependencies: os, sys, pandas, pytest, Benchmark.Synthetic, Common.Parallel,
+#               RFImportance.RFImportance
+# ----------------------------------------------------------------------------
+# Notes:
+# - Usage: python -m pytest -q Python/Tests
+# ----------------------------------------------------------------------------
+import os
+import sys
+import pandas as pd
+import pytest
+
+# Make the scripts and the shared modules in the parent folder importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Benchmark.Synthetic import generate_files, write_files
+from Common import Parallel
+from RFImportance import RFImportance
+
+# Function to run RFImportance.py on the input directory with some settings and return the output tables by file name
+# (the spawned workers only see the settings passed in the job arguments; the others keep the values of the script)
+def run_importance(monkeypatch, input_directory, output_directory, **settings):
+    settings = dict({"input_directory": str(input_directory), "output_directory": str(output_directory), "all_data_path": None,
+                     "selected_files": None, "output_format": "csv",
+                     "write_trace": False, "reuse_results": False}, **settings)
+    for name, value in settings.items():
+        monkeypatch.setattr(RFImportance, name, value)
+    RFImportance.main()
+    return {name: pd.read_csv(os.path.join(output_directory, name)) for name in sorted(os.listdir(output_directory))}
+
+@pytest.mark.parametrize("imputation_strategy, imputation_scope", [("median", "subset"), ("median", "dataset"), ("native", "subset")])
+def test_spawned_workers_use_the_imputation_settings(monkeypatch, tmp_path, imputation_strategy, imputation_scope):
+    input_directory = tmp_path / "Inputs"
+    write_files(generate_files(2, 60, n_products=2, n_indices=4, n_bands=2, nan_fraction=0.3), input_directory)
+    settings = {"imputation_strategy": imputation_strategy, "imputation_scope": imputation_scope}
+
+    expected = run_importance(monkeypatch, input_directory, tmp_path / "InProcess", n_workers=1, **settings)
+    monkeypatch.setattr(Parallel, "start_method", "spawn")
+    spawned = run_importance(monkeypatch, input_directory, tmp_path / "Spawned", n_workers=2, **settings)
+
+    assert list(spawned) == list(expected)
+    for name in expected:
+        pd.testing.assert_frame_equal(spawned[name], expected[name])
+
+    # The strategy changes the results, so a worker falling back to the default "mean" would not match
+    defaults = run_importance(monkeypatch, input_directory, tmp_path / "Defaults", n_workers=1, imputation_strategy="mean",
+                              imputation_scope="subset")
+    assert any(not defaults[name].equals(expected[name]) for name in expected)
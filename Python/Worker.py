@@ -0,0 +1,217 @@
+# ----------------------------------------------------------------------------
+# Header information:
+# Author: Ali Reza Shahvaran
+# Filename: Worker.py
+# License: CC BY 4.0
+# ----------------------------------------------------------------------------
+# Description:
+# This script runs the scripts of the workflow as jobs of a long-lived local
+# worker process, so that frequent small runs do not pay for the interpreter
+# startup, the imports of pandas, scikit-learn and SciPy, and the parsing of
+# the input workbooks every time:
+# - The worker imports the scripts once and keeps the parsed tables in memory
+#   (Common.Cache) and the other per-process caches (column schemas, subsets
+#   of AllData.xlsx, imputation statistics) between the jobs.
+# - A job runs one function of a stage (main by default) with some settings,
+#   optionally on some input files only, e.g.
+#   {"id": 1, "stage": "correlation", "files": ["Landsat8_All.xlsx"],
+#    "settings": {"input_directory": "...", "output_directory": "..."}}
+# - Jobs are read as JSON lines from the standard input (--stdin) or from the
+#   connections to a Unix socket (--socket PATH), and each job is answered with
+#   a JSON line: {"id": 1, "ok": true, "seconds": 0.8} or
+#   {"id": 1, "ok": false, "error": "...", "traceback": "..."}.
+# - --submit PATH JOB sends one job to a running worker and prints its answer.
+# ----------------------------------------------------------------------------
+# Dependencies: os, sys, json, time, argparse, importlib, socket, socketserver,
+#               traceback, contextlib (the scripts of the stages are imported when
+#               the worker starts)
+# ----------------------------------------------------------------------------
+# Notes:
+# - Usage: python Worker.py --stdin
+#          python Worker.py --socket /tmp/uw_worker.sock
+#          python Worker.py --submit /tmp/uw_worker.sock '{"stage": "models"}'
+# - Jobs run one at a time, in the order they are received. The settings of a job
+#   only apply to that job: the previous values are restored after it.
+# - The settings of a job are set on the module of the script in the worker, so
+#   worker processes started by the script would not see them (with spawn, they
+#   import the script again). The files of a job therefore run in the worker
+#   itself: n_workers is always 1, and a job setting another value is rejected.
+# - "files" sets the selected_files setting of the per-file stages (correlation,
+#   rf_importance). {"command": "ping"} checks that the worker is up and
+#   {"command": "shutdown"} stops it.
+# - What the scripts print is written to the standard error, so that the
+#   standard output only carries the answers.
+# - Unix sockets are not available on Windows; use --stdin there. The socket file
+#   is only accessible to the user running the worker.
+# ----------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import socket
+import socketserver
+import traceback
+from contextlib import redirect_stdout
+
+# Make the scripts and the shared modules in this folder importable
+script_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_directory)
+
+# Define the stages a job can run (the names of the stages of Pipeline.py) and their scripts
+stages = {
+    "correlation": "CorrelationAnalysis.CorrelationAnalysis",
+    "correlation_merge": "CorrelationAnalysis.Merge",
+    "rf_importance": "RFImportance.RFImportance",
+    "rf_importance_merge": "RFImportance.Merge",
+    "models": "Models.Models",
+}
+
+# Specify the bytes of parsed tables kept in memory between the jobs
+memory_cache_bytes = 2 * 1024 * 1024 * 1024
+
+# Function to import the scripts of the stages and the libraries they use, so that the first job does not pay for them
+def warm_up():
+    from Common import Cache
+    Cache.memory_cache_bytes = memory_cache_bytes
+    for module_name in stages.values():
+        importlib.import_module(module_name)
+    import pandas  # noqa: F401
+    import sklearn.ensemble  # noqa: F401
+    import scipy.stats  # noqa: F401
+    import scipy.io  # noqa: F401
+
+# Function to run one job and return its answer
+def run_job(job):
+    answer = {"id": job.get("id")}
+    started = time.perf_counter()
+    try:
+        command = job.get("command", "run")
+        if command == "ping":
+            answer["ok"] = True
+            return answer
+        if command != "run":
+            raise ValueError(f"Unknown command {command!r}.")
+        if job.get("stage") not in stages:
+            raise ValueError(f"Unknown stage {job.get('stage')!r} (expected one of {sorted(stages)}).")
+        function_name = job.get("function", "main")
+        if function_name.startswith("_"):
+            raise ValueError(f"{function_name!r} cannot be run as a job.")
+
+        # Apply the settings of the job to the script, and restore them afterwards
+        module = importlib.import_module(stages[job["stage"]])
+        settings = {"n_workers": 1}
+        settings.update(job.get("settings", {}))
+        if "files" in job:
+            settings["selected_files"] = job["files"]
+        if settings["n_workers"] != 1:
+            raise ValueError("Jobs run in the worker itself: n_workers must be 1 (the settings of a job do not reach worker processes).")
+        unknown = [name for name in settings if not hasattr(module, name) and name != "n_workers"]
+        if unknown:
+            raise ValueError(f"Unknown settings {unknown} for the {job['stage']} stage.")
+        previous = {name: getattr(module, name) for name in settings if hasattr(module, name)}
+        try:
+            for name, value in settings.items():
+                if hasattr(module, name):
+                    setattr(module, name, value)
+            with redirect_stdout(sys.stderr):
+                getattr(module, function_name)(*job.get("arguments", []))
+        finally:
+            for name, value in previous.items():
+                setattr(module, name, value)
+        answer["ok"] = True
+    except Exception as error:
+        answer["ok"] = False
+        answer["error"] = f"{type(error).__name__}: {error}"
+        answer["traceback"] = traceback.format_exc()
+    answer["seconds"] = time.perf_counter() - started
+    return answer
+
+# Function to answer the JSON lines of a stream of jobs, until its end or a shutdown command (returns True on shutdown)
+def serve_lines(read_line, write_line):
+    for line in iter(read_line, ""):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as error:
+            write_line(json.dumps({"ok": False, "error": f"Invalid job: {error}"}))
+            continue
+        if job.get("command") == "shutdown":
+            write_line(json.dumps({"id": job.get("id"), "ok": True}))
+            return True
+        write_line(json.dumps(run_job(job), default=str))
+    return False
+
+# Function to serve the jobs of the standard input
+def serve_stdin():
+    def write_line(line):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    serve_lines(sys.stdin.readline, write_line)
+
+# Function to serve the jobs of the connections to a Unix socket (one connection at a time)
+def serve_socket(socket_path):
+    if not hasattr(socketserver, "UnixStreamServer"):
+        raise OSError("Unix sockets are not available on this platform; use --stdin instead.")
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def read_line():
+                return self.rfile.readline().decode()
+
+            def write_line(line):
+                self.wfile.write((line + "\n").encode())
+                self.wfile.flush()
+
+            if serve_lines(read_line, write_line):
+                self.server.stopping = True
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    previous_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, JobHandler)
+    finally:
+        os.umask(previous_umask)
+    server.stopping = False
+    print(f"Worker listening on {socket_path}.", file=sys.stderr)
+    try:
+        with server:
+            while not server.stopping:
+                server.handle_request()
+    finally:
+        os.remove(socket_path)
+
+# Function to send one job to a running worker and return its answer
+def submit(socket_path, job):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(job) + "\n").encode())
+        with connection.makefile("r") as stream:
+            return json.loads(stream.readline())
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived worker running the stages of the workflow as jobs.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--stdin", action="store_true", help="read the jobs as JSON lines from the standard input")
+    mode.add_argument("--socket", metavar="PATH", help="serve the jobs of the connections to a Unix socket")
+    mode.add_argument("--submit", nargs=2, metavar=("PATH", "JOB"), help="send a JSON job to the worker listening on PATH")
+    arguments = parser.parse_args()
+
+    if arguments.submit:
+        answer = submit(arguments.submit[0], json.loads(arguments.submit[1]))
+        print(json.dumps(answer))
+        sys.exit(0 if answer.get("ok") else 1)
+
+    warm_up()
+    if arguments.stdin:
+        serve_stdin()
+    else:
+        serve_socket(arguments.socket)
+
+if __name__ == "__main__":
+    main()